@@ -0,0 +1,95 @@
+# This script measures how long a new process takes to load all jobs of a buildjson
+# file depending on how we store it in our cache:
+#
+# gzip:     the file as served (default)
+# raw:      the file decompressed after download (transfer.CACHE_CODEC = 'raw')
+# snapshot: a marshal snapshot of the decoded file (transfer.SNAPSHOT_MODE)
+# records:  a record store (buildjson.RECORD_STORE_MODE); we decode every record
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from argparse import ArgumentParser
+
+from mozci.utils import transfer
+from mozci.utils.recordstore import open_record_store, write_record_store
+
+
+def _prepare(source, tmp_dir):
+    """Store source in every codec and return the path of each of them."""
+    paths = dict((codec, os.path.join(tmp_dir, codec, os.path.basename(source)))
+                 for codec in CODECS)
+    for path in paths.itervalues():
+        os.mkdir(os.path.dirname(path))
+        shutil.copy2(source, path)
+
+    transfer.CACHE_CODEC = 'raw'
+    transfer._apply_codec(paths['raw'])
+    transfer.CACHE_CODEC = 'gzip'
+
+    transfer.SNAPSHOT_MODE = True
+    jobs = transfer.read_file(paths['snapshot'])['builds']
+    transfer.SNAPSHOT_MODE = False
+    write_record_store(transfer._sidecar_path(paths['records'], 'records'), jobs,
+                       transfer._last_mod_key(paths['records']))
+    return paths
+
+
+def _load_gzip(filepath):
+    return len(transfer.read_file(filepath)['builds'])
+
+
+def _load_snapshot(filepath):
+    transfer.SNAPSHOT_MODE = True
+    return len(transfer.read_file(filepath)['builds'])
+
+
+def _load_records(filepath):
+    store = open_record_store(transfer._sidecar_path(filepath, 'records'),
+                              transfer._last_mod_key(filepath))
+    return len(list(store))
+
+
+def _measure(codec, filepath, queue):
+    start = time.time()
+    count = CODECS[codec](filepath)
+    queue.put((time.time() - start, count))
+
+
+def _size(codec, filepath):
+    """Return the size in MB of what we read for codec."""
+    if codec in ('snapshot', 'records'):
+        filepath = transfer._sidecar_path(filepath, codec)
+    return os.path.getsize(filepath) / 1024 / 1024
+
+
+CODECS = {
+    'gzip': _load_gzip,
+    'raw': _load_gzip,
+    'snapshot': _load_snapshot,
+    'records': _load_records,
+}
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('filepath', type=str,
+                        help="Path to a gzipped builds-*.js file.")
+    options = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        paths = _prepare(options.filepath, tmp_dir)
+        for codec in ('gzip', 'raw', 'snapshot', 'records'):
+            # Every load runs in a new process so nothing is cached in memory
+            queue = multiprocessing.Queue()
+            proc = multiprocessing.Process(target=_measure,
+                                           args=(codec, paths[codec], queue))
+            proc.start()
+            elapsed, count = queue.get()
+            proc.join()
+            print "%-9s %5.2fs  (%d jobs, %d MB on disk)" % \
+                (codec, elapsed, count, _size(codec, paths[codec]))
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,27 @@
+# This script measures how long it takes to decode several buildjson files
+# with a growing number of processes (see mozci.sources.buildjson.decode_files).
+import time
+
+from argparse import ArgumentParser
+
+from mozci.sources.buildjson import decode_files
+
+FIELDS = ('starttime', 'endtime', 'result', 'properties.buildername',
+          'properties.revision')
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('filepaths', type=str, nargs='+',
+                        help="Paths to (gzipped) builds-*.js files.")
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                        help="Number of processes to try.")
+    options = parser.parse_args()
+
+    baseline = None
+    for processes in options.processes:
+        start = time.time()
+        rows = decode_files(options.filepaths, FIELDS, processes)
+        elapsed = time.time() - start
+        baseline = baseline or elapsed
+        print "%2d process(es): %6.1fs  speedup: %4.1fx  (%d jobs)" % \
+            (processes, elapsed, baseline / elapsed, sum(len(r) for r in rows))
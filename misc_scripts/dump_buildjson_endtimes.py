@@ -1,13 +1,11 @@
-from mozci.sources.buildjson import _fetch_data, BUILDS_DAY_FILE
+from mozci.sources.buildjson import zone_map
 from mozci.utils.tzone import pacific_time as pt
 from mozci.utils.tzone import utc_time as ut
 
-builds = _fetch_data(BUILDS_DAY_FILE % "2015-02-23")
+# The zone map is only built the first time; after that we don't decode the file
+summary = zone_map("2015-02-23")
+min_endtime = summary["min_endtime"]
+max_endtime = summary["max_endtime"]
 
-endtimes_list = []
-for job in builds:
-    endtimes_list.append(job["endtime"])
-
-endtimes_list.sort()
-print "%s %s %s" % (endtimes_list[0], ut(endtimes_list[0]), pt(endtimes_list[0]))
-print "%s %s %s" % (endtimes_list[-1], ut(endtimes_list[-1]), pt(endtimes_list[-1]))
+print "%s %s %s" % (min_endtime, ut(min_endtime), pt(min_endtime))
+print "%s %s %s" % (max_endtime, ut(max_endtime), pt(max_endtime))
@@ -4,7 +4,7 @@ import urllib
 from argparse import ArgumentParser
 
 from mozci.mozci import query_repo_name_from_buildername, _matching_jobs, \
-    _status_info, _status_summary
+    _status_infos, _status_summary
 from mozci.sources.buildapi import HOST_ROOT, RESULTS, COALESCED, \
     query_job_status, query_jobs_schedule
 
@@ -46,25 +46,25 @@ if __name__ == "__main__":
     all_jobs = query_jobs_schedule(repo_name, options.rev)
     jobs = _matching_jobs(options.buildername, all_jobs)
     import pprint
-    for schedule_info in jobs:
-        status = query_job_status(schedule_info)
-        if status == COALESCED:
-            print "%d %s %s/%s/build/%s" % \
-                (schedule_info["requests"][0]["request_id"],
-                 RESULTS[status], HOST_ROOT, repo_name, schedule_info["build_id"])
-            status_info = _status_info(schedule_info)
-            pprint.pprint(status_info)
+    coalesced_jobs = [schedule_info for schedule_info in jobs
+                      if query_job_status(schedule_info) == COALESCED]
+    # Every buildjson file is only searched once for all the coalesced jobs
+    for schedule_info, status_info in zip(coalesced_jobs, _status_infos(coalesced_jobs)):
+        print "%d %s %s/%s/build/%s" % \
+            (schedule_info["requests"][0]["request_id"],
+             RESULTS[COALESCED], HOST_ROOT, repo_name, schedule_info["build_id"])
+        pprint.pprint(status_info)
 
-            revision = status_info["properties"]["revision"]
-            # Print the job that was coalesced with
-            print 'https://treeherder.mozilla.org/#/jobs?%s' % \
-                (urllib.urlencode({
-                    'repo': repo_name,
-                    'fromchange': schedule_info["revision"],
-                    'tochange': revision,
-                    'filter-searchStr': options.buildername,
-                    'filter-resultStatus': ['success', 'testfailed', 'busted',
-                                            'exception', 'retry', 'usercancel',
-                                            'running', 'pending', 'coalesced']}, True))
+        revision = status_info["properties"]["revision"]
+        # Print the job that was coalesced with
+        print 'https://treeherder.mozilla.org/#/jobs?%s' % \
+            (urllib.urlencode({
+                'repo': repo_name,
+                'fromchange': schedule_info["revision"],
+                'tochange': revision,
+                'filter-searchStr': options.buildername,
+                'filter-resultStatus': ['success', 'testfailed', 'busted',
+                                        'exception', 'retry', 'usercancel',
+                                        'running', 'pending', 'coalesced']}, True))
     print "Status of all jobs (success, pending, running, coalesced)"
     print _status_summary(jobs)
@@ -0,0 +1,62 @@
+# This script compares the memory used to load allthethings.json as a whole (load)
+# and when streaming it to keep only what mozci uses (lean, see
+# allthethings.LEAN_LOAD). For every mode we report the peak memory and the memory
+# still used while we hold on to the loaded data.
+# It only works on Linux since it relies on the resource module and /proc.
+import multiprocessing
+import resource
+import time
+
+from argparse import ArgumentParser
+
+from mozci.sources import allthethings
+
+
+def _load(filepath):
+    allthethings.FILENAME = filepath
+    return allthethings._load()
+
+
+def _lean(filepath):
+    allthethings.LEAN_LOAD = True
+    return _load(filepath)
+
+
+def _current_rss():
+    """Return the resident memory of this process in MB."""
+    with open('/proc/self/status') as fd:
+        for line in fd:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+
+
+def _measure(mode, filepath, queue):
+    start = time.time()
+    result = MODES[mode](filepath)
+    elapsed = time.time() - start
+    # ru_maxrss is in kilobytes on Linux
+    queue.put((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, _current_rss(),
+               elapsed))
+    del result
+
+
+MODES = {
+    'load': _load,
+    'lean': _lean,
+}
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('filepath', type=str,
+                        help="Path to an allthethings.json file.")
+    options = parser.parse_args()
+
+    for mode in sorted(MODES):
+        # Every mode runs in a new process to get its own peak memory
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_measure, args=(mode, options.filepath, queue))
+        proc.start()
+        peak_rss, retained_rss, elapsed = queue.get()
+        proc.join()
+        print "%-5s peak RSS: %5d MB  retained RSS: %5d MB  time: %.1fs" % \
+            (mode, peak_rss, retained_rss, elapsed)
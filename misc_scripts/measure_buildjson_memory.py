@@ -0,0 +1,66 @@
+# This script compares the memory used to go through all jobs of a buildjson file
+# when loading the whole file (load), when loading it with interned strings (intern)
+# and when streaming it (stream). For every mode we report the peak memory and the
+# memory still used while we hold on to what the mode returns.
+# It only works on Linux since it relies on the resource module and /proc.
+import multiprocessing
+import resource
+import time
+
+from argparse import ArgumentParser
+
+from mozci.utils import transfer
+
+
+def _load(filepath):
+    return transfer.read_file(filepath)["builds"]
+
+
+def _intern(filepath):
+    transfer.INTERN_STRINGS = True
+    return transfer.read_file(filepath)["builds"]
+
+
+def _stream(filepath):
+    return [job["endtime"] for job in transfer.iter_builds(filepath, fields=('endtime',))]
+
+
+def _current_rss():
+    """Return the resident memory of this process in MB."""
+    with open('/proc/self/status') as fd:
+        for line in fd:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+
+
+def _measure(mode, filepath, queue):
+    start = time.time()
+    result = MODES[mode](filepath)
+    elapsed = time.time() - start
+    # ru_maxrss is in kilobytes on Linux
+    queue.put((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, _current_rss(),
+               elapsed))
+    del result
+
+
+MODES = {
+    'load': _load,
+    'intern': _intern,
+    'stream': _stream,
+}
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('filepath', type=str,
+                        help="Path to a (gzipped) builds-*.js file.")
+    options = parser.parse_args()
+
+    for mode in sorted(MODES):
+        # Every mode runs in a new process to get its own peak memory
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_measure, args=(mode, options.filepath, queue))
+        proc.start()
+        peak_rss, retained_rss, elapsed = queue.get()
+        proc.join()
+        print "%-7s peak RSS: %5d MB  retained RSS: %5d MB  time: %.1fs" % \
+            (mode, peak_rss, retained_rss, elapsed)
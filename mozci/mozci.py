@@ -10,7 +10,7 @@ import logging
 
 from buildapi_client import make_retrigger_request, trigger_arbitrary_job
 
-from mozci import repositories
+from mozci import query_jobs, repositories
 from mozci.errors import MozciError
 from mozci.platforms import (
     build_talos_buildernames_for_repo,
@@ -30,11 +30,13 @@ from mozci.query_jobs import (
     EXCEPTION,
     RETRY,
     BuildApi,
+    BuildjsonApi,
     TreeherderApi
 )
 from mozci.utils.authentication import get_credentials
+from mozci.utils.cache_manager import schedule_cleanup
 from mozci.utils.misc import _all_urls_reachable
-from mozci.utils.transfer import path_to_file, clean_directory
+from mozci.utils.transfer import path_to_file
 
 LOG = logging.getLogger('mozci')
 SCHEDULING_MANAGER = {}
@@ -58,6 +60,8 @@ def set_query_source(query_source="buildapi"):
     global QUERY_SOURCE
     if query_source == "treeherder":
         source_class = TreeherderApi
+    elif query_source == "buildjson":
+        source_class = BuildjsonApi
     else:
         source_class = BuildApi
     QUERY_SOURCE = source_class()
@@ -235,10 +239,29 @@ def _status_info(job_schedule_info):
     complete_at = job_schedule_info["requests"][0]["complete_at"]
     request_id = job_schedule_info["requests"][0]["request_id"]
 
+    # get_job_status might have found the job already (see BuildApi._prefetch_job_status)
+    if request_id in query_jobs.JOB_DATA_CACHE:
+        return query_jobs.JOB_DATA_CACHE[request_id]
+
     # NOTE: This call can take a bit of time
     return buildjson.query_job_data(complete_at, request_id)
 
 
+def _status_infos(jobs_schedule_info):
+    """
+    Return the status information of many jobs (see _status_info) in the same order.
+
+    The jobs which we have not found yet are looked for at once (see
+    buildjson.query_jobs_data), thus, every buildjson file is only searched once.
+    """
+    requests = [job["requests"][0] for job in jobs_schedule_info]
+    missing = [(req["complete_at"], req["request_id"]) for req in requests
+               if req["request_id"] not in query_jobs.JOB_DATA_CACHE]
+    found = buildjson.query_jobs_data(missing) if missing else {}
+    return [query_jobs.JOB_DATA_CACHE.get(req["request_id"], found.get(req["request_id"]))
+            for req in requests]
+
+
 def _find_files(job_schedule_info):
     """
     Find the files needed to trigger a job.
@@ -422,8 +445,8 @@ def trigger_job(revision, buildername, times=1, files=None, dry_run=False,
     else:
         LOG.debug("Nothing needs to be triggered")
 
-    # Cleanup old buildjson files.
-    clean_directory()
+    # Cleanup old buildjson files without waiting for it.
+    schedule_cleanup()
 
     return list_of_requests
 
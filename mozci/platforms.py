@@ -8,7 +8,13 @@ import os
 import re
 
 from mozci.errors import MozciError
-from mozci.sources.allthethings import fetch_allthethings_data
+from mozci.sources.allthethings import (
+    fetch_allthethings_data,
+    fetch_allthethings_manifest,
+    fetch_allthethings_shard,
+    load_catalog,
+    write_catalog,
+)
 
 LOG = logging.getLogger('mozci')
 
@@ -43,33 +49,90 @@ BUILDERNAME_TO_TRIGGER = {}
 BUILD_JOBS = {}
 UPSTREAM_TO_DOWNSTREAM = None
 
+# Everything we derive from the allthethings data of every repository (see
+# _compile_catalog) keyed by repository name. Catalogs are stored next to
+# allthethings.json, thus, other processes skip both parsing the data and deriving it.
+# We only load the catalogs of the repositories we are asked about.
+CATALOGS = {}
 
-def is_upstream(buildername):
-    """Determine if a job triggered by any other."""
-    return not is_downstream(buildername)
 
+def _load_catalog(repo_name):
+    """Return the catalog of a repository, compiling it if needed."""
+    if repo_name not in CATALOGS:
+        catalog = load_catalog(repo_name)
+        if catalog is None:
+            catalog = _compile_catalog(repo_name, fetch_allthethings_shard(repo_name))
+            write_catalog(repo_name, catalog)
+        _add_catalog(repo_name, catalog)
+    return CATALOGS[repo_name]
 
-def is_downstream(buildername):
-    """Determine if a job requires a build job to have triggered."""
-    return get_buildername_metadata(buildername)['downstream']
 
+def _add_catalog(repo_name, catalog):
+    """Make the catalog of a repository available to the functions of this module."""
+    CATALOGS[repo_name] = catalog
+    SHORTNAME_TO_NAME.update(catalog['shortname_to_name'])
+    BUILD_JOBS.update(catalog['build_jobs'])
+    BUILDERNAME_TO_TRIGGER.update(catalog['buildername_to_trigger'])
 
-def _process_data():
-    """Filling the dictionaries used by determine_upstream_builder."""
-    # We check if we already computed before
-    if BUILDERNAME_TO_TRIGGER:
-        return
 
-    LOG.debug("Computing builders' relations from allthethings data.")
-    # We'll look at every builder and if it's a build job we will add it
-    # to SHORTNAME_TO_NAME
-    for buildername, builderinfo in fetch_allthethings_data()['builders'].iteritems():
-        if not _wanted_builder(buildername):
-            continue
+def _catalogs(buildername=None):
+    """
+    Generator of the catalogs of every repository; they are loaded lazily.
+
+    If buildername is set, the catalogs we have already loaded and those of the
+    repositories named in buildername come first.
+    """
+    repo_names = sorted(fetch_allthethings_manifest())
+    if buildername is not None:
+        repo_names.sort(key=lambda repo_name: (repo_name not in CATALOGS,
+                                               repo_name not in buildername))
+    for repo_name in repo_names:
+        yield _load_catalog(repo_name)
+
+
+def _find_catalog(buildername):
+    """Return the catalog which has buildername or None if no repository has it."""
+    for catalog in _catalogs(buildername):
+        if buildername in catalog['builders']:
+            return catalog
+    return None
+
+
+def _compile_catalog(repo_name, data):
+    """
+    Derive from the allthethings data of a repository what the functions of this
+    module need.
+
+    The catalog is a dictionary with:
+        * builders - The set of the repository's buildernames
+        * metadata - What get_buildername_metadata returns for every builder
+        * shortname_to_name, build_jobs and buildername_to_trigger - See _process_data
+        * upstream_to_downstream - See get_downstream_jobs
+    """
+    LOG.debug("Compiling the builders' catalog of %s." % repo_name)
+    metadata = {}
+    for buildername, builderinfo in data['builders'].iteritems():
+        try:
+            metadata[buildername] = _derive_metadata(buildername, builderinfo['properties'])
+        except (KeyError, TypeError):
+            # e.g. release builders lack the properties we need (even the branch)
+            pass
+
+    # The functions used below read the catalog we are compiling
+    catalog = {
+        'builders': set(data['builders']),
+        'metadata': metadata,
+    }
+    CATALOGS[repo_name] = catalog
 
+    # We'll look at every builder and if it's a build job we will add it
+    # to shortname_to_name
+    shortname_to_name = {}
+    build_jobs = {}
+    for buildername in list_builders(repo_name):
         if is_upstream(buildername):
-            SHORTNAME_TO_NAME[builderinfo['shortname']] = buildername
-            BUILD_JOBS[buildername.lower()] = buildername
+            shortname_to_name[data['builders'][buildername]['shortname']] = buildername
+            build_jobs[buildername.lower()] = buildername
 
     # data['schedulers'] is a dictionary that maps a scheduler name to a
     # dictionary of it's properties:
@@ -84,14 +147,41 @@ def _process_data():
     # A test scheduler has a list of tests in "downstream" and a trigger
     # name in "triggered_by". We will map every test in downstream to the
     # trigger name in triggered_by
-    for sched, values in fetch_allthethings_data()['schedulers'].iteritems():
+    buildername_to_trigger = {}
+    for sched, values in data['schedulers'].iteritems():
         # We are only interested in test schedulers
         if not sched.startswith('tests-'):
             continue
 
         for buildername in values['downstream']:
-            assert buildername.lower() not in BUILDERNAME_TO_TRIGGER
-            BUILDERNAME_TO_TRIGGER[buildername.lower()] = values['triggered_by'][0]
+            assert buildername.lower() not in buildername_to_trigger
+            buildername_to_trigger[buildername.lower()] = values['triggered_by'][0]
+
+    catalog.update({
+        'shortname_to_name': shortname_to_name,
+        'build_jobs': build_jobs,
+        'buildername_to_trigger': buildername_to_trigger,
+    })
+    _add_catalog(repo_name, catalog)
+    catalog['upstream_to_downstream'] = \
+        dict(_generate_builders_relations_dictionary(repo_name))
+    return catalog
+
+
+def is_upstream(buildername):
+    """Determine if a job triggered by any other."""
+    return not is_downstream(buildername)
+
+
+def is_downstream(buildername):
+    """Determine if a job requires a build job to have triggered."""
+    return get_buildername_metadata(buildername)['downstream']
+
+
+def _process_data(buildername):
+    """Filling the dictionaries used by determine_upstream_builder for buildername."""
+    # Loading the catalog of buildername's repository adds its builders' relations
+    _find_catalog(buildername)
 
 
 def determine_upstream_builder(buildername):
@@ -104,7 +194,7 @@ def determine_upstream_builder(buildername):
 
     Raises MozciError if no matching build job is found.
     """
-    _process_data()
+    _process_data(buildername)
 
     # For some platforms in mozilla-beta and mozilla-aurora there are both
     # talos and pgo talos jobs, only the pgo talos ones are valid.
@@ -169,12 +259,18 @@ def get_buildername_metadata(buildername):
         * product - e.g. firefox
         * repo_name - Associated short name for a repository (e.g. alder)
         * suite_name - talos & test jobs have an associated suite name (e.g chromez)
+
+    Returns None for unknown builders and builders lacking the properties we need.
     """
-    if buildername not in fetch_allthethings_data()['builders']:
+    catalog = _find_catalog(buildername)
+    if catalog is None or buildername not in catalog['metadata']:
         return None
 
-    props = _get_raw_builder_metadata(buildername)['properties']
+    return dict(catalog['metadata'][buildername])
+
 
+def _derive_metadata(buildername, props):
+    """Compute the metadata of get_buildername_metadata from a builder's properties."""
     # For talos tests we have to check stage_platform
     if 'talos' in buildername:
         platform_name = props['stage_platform']
@@ -325,7 +421,7 @@ def build_talos_buildernames_for_repo(repo_name, pgo_only=False):
     in the talos_re jobs.  Now we can take the pgo jobs and jobs with no pgo
     equivalent and have a full set of pgo jobs.
     """
-    buildernames = list_builders()
+    buildernames = list_builders(repo_name)
     retVal = []
 
     # Android and OSX do not have PGO, so we need to get those specific jobs
@@ -427,6 +523,8 @@ def _wanted_builder(builder, filter=True, repo_name=None):
     # We lack metadata in allthethings for release builders
     # in order to call get_buildername_metadata()
     info = get_buildername_metadata(builder)
+    if info is None:
+        return False
 
     if repo_name and repo_name != info['repo_name']:
         return False
@@ -439,7 +537,7 @@ def _wanted_builder(builder, filter=True, repo_name=None):
            info['job_type'] == 'talos' and _get_job_type(builder) == 'opt':
 
             equiv_pgo_builder = builder.replace('talos', 'pgo talos')
-            if equiv_pgo_builder in fetch_allthethings_data()['builders']:
+            if equiv_pgo_builder in _load_catalog(info['repo_name'])['builders']:
                 # There are two talos builders, we only can use the pgo one
                 return False
             else:
@@ -451,37 +549,56 @@ def _wanted_builder(builder, filter=True, repo_name=None):
 
 def list_builders(repo_name=None, filter=True):
     """Return a list of all builders running in the buildbot CI."""
-    all_builders = fetch_allthethings_data()['builders']
-    assert len(all_builders) > 0, "The list of builders cannot be empty."
+    repo_names = fetch_allthethings_manifest()
+    assert len(repo_names) > 0, "The list of builders cannot be empty."
+
+    # We only need the catalog of repo_name if set
+    if repo_name is None:
+        all_builders = [builder for catalog in _catalogs() for builder in catalog['builders']]
+    elif repo_name in repo_names:
+        all_builders = _load_catalog(repo_name)['builders']
+    else:
+        all_builders = []
 
     # Let's filter out builders which are not triggered per push
     # and are not associated to a repo_name if set
     builders_list = []
-    for builder in all_builders.keys():
+    for builder in all_builders:
         if _wanted_builder(builder=builder, filter=filter, repo_name=repo_name):
             builders_list.append(builder)
 
     return builders_list
 
 
-def _generate_builders_relations_dictionary():
+def _generate_builders_relations_dictionary(repo_name=None):
     """Create a dictionary that maps every upstream job to its downstream jobs."""
-    builders = list_builders()
+    builders = list_builders(repo_name)
     relations = collections.defaultdict(list)
     for buildername in builders:
         if is_downstream(buildername):
-            relations[determine_upstream_builder(buildername)].append(buildername)
+            try:
+                relations[determine_upstream_builder(buildername)].append(buildername)
+            except MozciError:
+                # determine_upstream_builder has already logged it
+                continue
     return relations
 
 
 def load_relations():
-    """Loads upstream to downstream mapping."""
+    """Loads upstream to downstream mapping of every repository."""
     global UPSTREAM_TO_DOWNSTREAM
     if UPSTREAM_TO_DOWNSTREAM is None:
-        UPSTREAM_TO_DOWNSTREAM = _generate_builders_relations_dictionary()
+        UPSTREAM_TO_DOWNSTREAM = collections.defaultdict(list)
+        for catalog in _catalogs():
+            for upstream_job, downstream_jobs in \
+                    catalog['upstream_to_downstream'].iteritems():
+                UPSTREAM_TO_DOWNSTREAM[upstream_job].extend(downstream_jobs)
 
 
 def get_downstream_jobs(upstream_job):
     """Return all test jobs that are downstream from a build job."""
-    load_relations()
-    return UPSTREAM_TO_DOWNSTREAM[upstream_job]
+    # We only need the catalog of upstream_job's repository
+    catalog = _find_catalog(upstream_job)
+    if catalog is None:
+        return []
+    return list(catalog['upstream_to_downstream'].get(upstream_job, []))
@@ -1,8 +1,10 @@
 from __future__ import absolute_import
 
+import collections
 import logging
 
 from abc import ABCMeta, abstractmethod
+from urlparse import urlparse
 
 from buildapi_client import query_jobs_schedule
 from thclient import TreeherderClient
@@ -10,7 +12,14 @@ from thclient import TreeherderClient
 from mozci.errors import TreeherderError, BuildapiError, BuildjsonError
 from mozci.utils.authentication import get_credentials
 from mozci.platforms import list_builders
-from mozci.sources.buildjson import query_job_data
+from mozci.repositories import query_repo_url
+from mozci.sources import buildqueue
+from mozci.sources.buildjson import (
+    missing_dates,
+    query_job_data,
+    query_jobs_by_revision,
+    query_jobs_data,
+)
 
 
 LOG = logging.getLogger('mozci')
@@ -19,6 +28,17 @@ LOG = logging.getLogger('mozci')
 PENDING, RUNNING, COALESCED, UNKNOWN = range(-4, 0)
 SUCCESS, WARNING, FAILURE, SKIPPED, EXCEPTION, RETRY, CANCELLED = range(7)
 JOBS_CACHE = {}
+# buildjson data of completed jobs keyed by request_id; the oldest entries are
+# dropped once it has JOB_DATA_CACHE_SIZE jobs (see _cache_job_data)
+JOB_DATA_CACHE = collections.OrderedDict()
+JOB_DATA_CACHE_SIZE = 10000
+
+
+def _cache_job_data(request_id, job):
+    JOB_DATA_CACHE.pop(request_id, None)
+    JOB_DATA_CACHE[request_id] = job
+    while len(JOB_DATA_CACHE) > JOB_DATA_CACHE_SIZE:
+        JOB_DATA_CACHE.popitem(last=False)
 
 
 class QueryApi(object):
@@ -38,6 +58,10 @@ class QueryApi(object):
     def get_job_status(self, job):
         pass
 
+    def _prefetch_job_status(self, jobs):
+        """Gather at once what get_job_status needs to determine the status of jobs."""
+        pass
+
     def determine_missing_jobs(self, repo_name, revision, considered_list_of_builders=None):
         if considered_list_of_builders is None:
             considered_list_of_builders = list_builders(repo_name=repo_name)
@@ -86,6 +110,7 @@ class QueryApi(object):
 
         """
         all_jobs = self._get_all_jobs(repo_name, revision)
+        self._prefetch_job_status(all_jobs)
         wrong_status_builders = set()
         correct_status_builders = set()
         for job in all_jobs:
@@ -106,6 +131,9 @@ class QueryApi(object):
 
 class BuildApi(QueryApi):
 
+    # request_ids which the last _prefetch_job_status did not find in buildjson
+    _not_found = frozenset()
+
     def _get_all_jobs(self, repo_name, revision):
         """
         Return a list with all jobs for that revision.
@@ -171,7 +199,10 @@ class BuildApi(QueryApi):
         assert job["status"] == SUCCESS
 
         req = job["requests"][0]
-        status_data = query_job_data(req["complete_at"], req["request_id"])
+        status_data = JOB_DATA_CACHE.get(req["request_id"])
+        # We trust _prefetch_job_status instead of looking for the job again
+        if status_data is None and req["request_id"] not in self._not_found:
+            status_data = query_job_data(req["complete_at"], req["request_id"])
         if not status_data:
             LOG.info("We have not found the job. We assume the job to be running.")
             return RUNNING
@@ -181,6 +212,29 @@ class BuildApi(QueryApi):
         else:
             return SUCCESS
 
+    def _prefetch_job_status(self, jobs):
+        """
+        Look for the buildjson data of all successful jobs at once.
+
+        Every buildjson file is only searched once instead of once per job (see _is_coalesced).
+        """
+        requests = [job["requests"][0] for job in jobs
+                    if job.get("status") == SUCCESS and "requests" in job]
+        requests = [req for req in requests if req["request_id"] not in JOB_DATA_CACHE]
+        self._not_found = frozenset()
+        if not requests:
+            return
+
+        LOG.debug("Looking for the buildjson data of %d jobs." % len(requests))
+        found = query_jobs_data((req["complete_at"], req["request_id"]) for req in requests)
+        for request_id, status_data in found.iteritems():
+            # Jobs we did not find might show up later, thus, we only remember them
+            # until the next prefetch
+            if status_data is not None:
+                _cache_job_data(request_id, status_data)
+        self._not_found = frozenset(request_id for request_id, status_data in found.iteritems()
+                                    if status_data is None)
+
     def find_all_jobs_by_status(self, repo_name, revision, status):
         """
         Find all jobs with status 'status' in a given branch and revision.
@@ -188,6 +242,7 @@ class BuildApi(QueryApi):
         Returns a list with the request_ids of the jobs whose only status is 'status'.
         """
         all_jobs = self._get_all_jobs(repo_name, revision)
+        self._prefetch_job_status(all_jobs)
         request_id_by_buildername = {}
         right_status_buildernames = set()
         wrong_status_buildernames = set()
@@ -208,6 +263,104 @@ class BuildApi(QueryApi):
         return sorted([request_id_by_buildername[b] for b in buildernames])
 
 
+class BuildjsonApi(BuildApi):
+    """
+    Query source which answers about completed jobs from our cached buildjson files.
+
+    Pending and running jobs come from the snapshot of builds-pending.js and
+    builds-running.js (see mozci.sources.buildqueue). We ask buildapi if we do not know
+    about any job of a builder for a revision or if we have not cached the buildjson
+    files of every day that query_jobs_by_revision searches.
+    """
+
+    def get_matching_jobs(self, repo_name, revision, buildername):
+        """Return all jobs that matched the criteria."""
+        dates = missing_dates()
+        if dates:
+            LOG.debug("We have not cached the buildjson files of %s; asking buildapi." %
+                      ", ".join(dates))
+            return super(BuildjsonApi, self).get_matching_jobs(
+                repo_name, revision, buildername)
+
+        repo_path = urlparse(query_repo_url(repo_name)).path.strip('/')
+        completed_jobs = query_jobs_by_revision(repo_path, revision, buildername)
+        pending_jobs = buildqueue.query_pending_jobs(revision, buildername)
+        running_jobs = buildqueue.query_running_jobs(revision, buildername)
+        if not completed_jobs and not pending_jobs and not running_jobs:
+            LOG.debug("We have not found jobs of '%s'; asking buildapi." % buildername)
+            return super(BuildjsonApi, self).get_matching_jobs(
+                repo_name, revision, buildername)
+
+        LOG.debug("We have found %d completed, %d pending and %d running job(s) of '%s'." %
+                  (len(completed_jobs), len(pending_jobs), len(running_jobs), buildername))
+        return [self._buildapi_job(job) for job in completed_jobs] + \
+            [self._pending_job(job) for job in pending_jobs] + \
+            [self._running_job(job) for job in running_jobs]
+
+    def get_job_status(self, job):
+        """
+        Helper to determine the scheduling status of a job.
+
+        The jobs which buildapi considers pending or running might have moved on
+        since; builds-pending.js and builds-running.js are at most
+        buildqueue.POLL_INTERVAL seconds old.
+        """
+        if job.get("status") is None and job.get("endtime") is None:
+            state = buildqueue.query_job_state(job["requests"][0]["request_id"])
+            if state == buildqueue.RUNNING:
+                return RUNNING
+            if state == buildqueue.PENDING:
+                return PENDING
+        return super(BuildjsonApi, self).get_job_status(job)
+
+    def _pending_job(self, job):
+        """Convert a job from builds-pending.js into the format of buildapi's jobs."""
+        # Without a "status" get_job_status considers the job pending
+        return {
+            "buildername": job["buildername"],
+            "revision": job["revision"],
+            "requests": [{
+                "request_id": job["id"],
+                "revision": job["revision"],
+            }],
+        }
+
+    def _running_job(self, job):
+        """Convert a job from builds-running.js into the format of buildapi's jobs."""
+        return {
+            "buildername": job["buildername"],
+            "status": None,
+            "starttime": job.get("start_time"),
+            "endtime": None,
+            "revision": job["revision"],
+            "requests": [{
+                "request_id": request_id,
+                "revision": job["revision"],
+            } for request_id in job["request_ids"]],
+        }
+
+    def _buildapi_job(self, job):
+        """Convert a job from buildjson into the format of buildapi's jobs."""
+        properties = job["properties"]
+        request_ids = properties.get("request_ids", []) or job["request_ids"]
+        for request_id in request_ids:
+            # get_job_status will not need to look for the job again
+            _cache_job_data(request_id, job)
+
+        return {
+            "buildername": properties["buildername"],
+            "status": job["result"],
+            "starttime": job["starttime"],
+            "endtime": job["endtime"],
+            "revision": properties["revision"],
+            "requests": [{
+                "request_id": request_id,
+                "complete_at": job["endtime"],
+                "revision": properties["revision"],
+            } for request_id in request_ids],
+        }
+
+
 class TreeherderApi(QueryApi):
 
     def __init__(self):
@@ -11,7 +11,7 @@ from buildapi_client import BuildapiAuthError, make_query_repositories_request
 
 from mozci.errors import AuthenticationError, MozciError
 from mozci.utils.authentication import get_credentials, remove_credentials
-from mozci.utils.transfer import path_to_file
+from mozci.utils.transfer import atomic_open, path_to_file, verify_checksum, write_checksum
 
 LOG = logging.getLogger('mozci')
 REPOSITORIES_FILE = path_to_file("repositories.txt")
@@ -67,6 +67,10 @@ def query_repositories(clobber=False):
     if REPOSITORIES:
         return REPOSITORIES
 
+    if os.path.exists(REPOSITORIES_FILE) and verify_checksum(REPOSITORIES_FILE) is False:
+        LOG.info("%s is corrupted, we will fetch it again." % REPOSITORIES_FILE)
+        os.remove(REPOSITORIES_FILE)
+
     if os.path.exists(REPOSITORIES_FILE):
         LOG.debug("Loading %s" % REPOSITORIES_FILE)
         fd = open(REPOSITORIES_FILE)
@@ -78,7 +82,8 @@ def query_repositories(clobber=False):
             remove_credentials()
             raise AuthenticationError("Your credentials were invalid. Please try again.")
 
-        with open(REPOSITORIES_FILE, "wb") as fd:
+        with atomic_open(REPOSITORIES_FILE) as fd:
             json.dump(REPOSITORIES, fd)
+        write_checksum(REPOSITORIES_FILE)
 
     return REPOSITORIES
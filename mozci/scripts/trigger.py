@@ -78,10 +78,11 @@ def parse_args(argv=None):
                         help="set debug for logging.")
 
     parser.add_argument("--query-source",
-                        metavar="[buildapi|treeherder]",
+                        metavar="[buildapi|buildjson|treeherder]",
                         dest="query_source",
                         default="buildapi",
-                        help="Query info from buildapi or treeherder.")
+                        help="Query info from buildapi, our cached buildjson files "
+                             "(completed jobs) or treeherder.")
 
     parser.add_argument("--file",
                         action="append",
@@ -45,14 +45,36 @@ It contains a dictionary with 4 keys:
 
 * **master_builders**
 * **slavepools**
+
+When we download the file we also split its builders and schedulers into a shard per
+repository (see fetch_allthethings_shard), thus, most processes never load the whole file.
 """
 import json
 import logging
 import os
+import time
 
 import requests
 
-from mozci.utils.transfer import path_to_file
+# yajl2 backend is faster then the default backend, but it requires
+# libyajl2 to be installed in the system
+try:
+    import ijson.backends.yajl2 as ijson
+except:
+    import ijson
+
+from mozci.errors import MozciError
+from mozci.utils.cache_manager import record_use
+from mozci.utils.transfer import (
+    DOWNLOAD_ATTEMPTS,
+    atomic_open,
+    load_sidecar,
+    path_to_file,
+    touch,
+    verify_checksum,
+    write_checksum,
+    write_sidecar,
+)
 
 LOG = logging.getLogger('mozci')
 
@@ -60,7 +82,151 @@ FILENAME = path_to_file("allthethings.json")
 ALLTHETHINGS = \
     "https://secure.pub.build.mozilla.org/builddata/reports/allthethings.json"
 
+# How many seconds we trust our copy of allthethings.json without checking the server
+MAX_AGE = 24 * 60 * 60
+# Set this to True to stream the file and only keep what mozci uses: the builders
+# (with LEAN_PROPERTIES and their shortname) and the schedulers. The rest of the file
+# (e.g. master_builders and slavepools) is never held in memory.
+LEAN_LOAD = False
+LEAN_PROPERTIES = frozenset([
+    'branch',
+    'platform',
+    'product',
+    'slavebuilddir',
+    'stage_platform',
+])
+
+# Builders without a branch are kept in this shard
+OTHER_SHARD = '_other'
+
 DATA = None
+# Number of builders of every repository (see fetch_allthethings_manifest)
+MANIFEST = None
+
+
+def _fetch():
+    """
+    Download allthethings.json into FILENAME and return its contents.
+
+    Raises MozciError if we can't download the whole file in DOWNLOAD_ATTEMPTS attempts.
+    """
+    for attempt in range(DOWNLOAD_ATTEMPTS):
+        LOG.debug("Fetching allthethings.json %s" % ALLTHETHINGS)
+        req = requests.get(ALLTHETHINGS, stream=True)
+        content_length = int(req.headers['content-length'])
+
+        # This automatically erases the previous cached file once the new one
+        # has been completely downloaded.
+        try:
+            with atomic_open(FILENAME) as fd:
+                for chunk in req.iter_content(chunk_size=1024):
+                    if chunk:  # filter out keep-alive new chunks
+                        fd.write(chunk)
+                if fd.tell() != content_length:
+                    raise MozciError("We downloaded %d bytes instead of %d." %
+                                     (fd.tell(), content_length))
+            break
+        except MozciError, e:
+            LOG.debug('File integrity failed (%s). Retrying fetching the file.' % e)
+    else:
+        raise MozciError("We could not download %s after %d attempts." %
+                         (ALLTHETHINGS, DOWNLOAD_ATTEMPTS))
+
+    write_checksum(FILENAME)
+    data = _load()
+    _write_shards(data)
+    return data
+
+
+def _load():
+    """Return the contents of FILENAME (only what we use if LEAN_LOAD is set)."""
+    with open(FILENAME, "r") as fd:
+        if LEAN_LOAD:
+            return _lean_load(fd)
+        return json.load(fd)
+
+
+def _lean_load(fd):
+    """
+    Stream allthethings.json and keep only the builders and schedulers sections.
+
+    Builders only keep their shortname and LEAN_PROPERTIES.
+    """
+    builders = {}
+    schedulers = {}
+    # Keys leading to the current value (None for the items of a list). We cannot
+    # use ijson's prefixes since buildernames can contain dots.
+    path = []
+    for _, event, value in ijson.parse(fd):
+        if event == 'map_key':
+            path[-1] = value
+            continue
+        if event in ('end_map', 'end_array'):
+            path.pop()
+            continue
+
+        depth = len(path)
+        container = event in ('start_map', 'start_array')
+        if depth >= 2 and path[0] == 'builders':
+            buildername = path[1]
+            if depth == 2:
+                builders[buildername] = {'properties': {}}
+            elif depth == 3 and path[2] == 'shortname':
+                builders[buildername]['shortname'] = value
+            elif depth == 4 and path[2] == 'properties' and path[3] in LEAN_PROPERTIES \
+                    and not container:
+                builders[buildername]['properties'][path[3]] = value
+        elif depth >= 2 and path[0] == 'schedulers':
+            scheduler = path[1]
+            if depth == 2:
+                schedulers[scheduler] = {}
+            elif depth == 3:
+                # e.g. "downstream" or "triggered_by"
+                schedulers[scheduler][path[2]] = [] if event == 'start_array' else value
+            elif depth == 4 and path[3] is None and not container:
+                schedulers[scheduler][path[2]].append(value)
+
+        if container:
+            path.append(None)
+
+    return {'builders': builders, 'schedulers': schedulers}
+
+
+def _verify_file_integrity():
+    """Return True if our copy of allthethings.json is complete and up-to-date."""
+    if not os.path.exists(FILENAME):
+        return False
+
+    # Files downloaded by mozci have a checksum which tells us if they are
+    # corrupted; we only ask the server if it has a newer file once in a while
+    valid = verify_checksum(FILENAME)
+    if valid is False:
+        return False
+    if valid and time.time() - os.path.getmtime(FILENAME) < MAX_AGE:
+        return True
+
+    statinfo = os.stat(FILENAME)
+    file_size = statinfo.st_size
+    response = requests.head(ALLTHETHINGS)
+    content_length = int(response.headers['content-length'])
+    if file_size != content_length:
+        return False
+
+    if valid is None:
+        # e.g. it was downloaded by an older version of mozci; from now on the
+        # checksum verifies it and keys its catalogs
+        write_checksum(FILENAME)
+    # Our copy is current; we trust it for another MAX_AGE without asking the server
+    touch(FILENAME, _sidecar_kinds())
+    return True
+
+
+def _sidecar_kinds():
+    """Return the kinds of the sidecars which we store next to FILENAME."""
+    kinds = ["sha1", "shards"]
+    for shard_name in load_sidecar(FILENAME, "shards") or []:
+        kinds += ["shard-%s" % shard_name, "catalog-%s" % shard_name]
+    return kinds
 
 
 def fetch_allthethings_data(no_caching=False, verify=True):
@@ -71,40 +237,11 @@ def fetch_allthethings_data(no_caching=False, verify=True):
     If verify is False, we load from disk without checking. This should only be used if
     allthethings.json exists and it's trusted.
     """
-    def _fetch():
-        LOG.debug("Fetching allthethings.json %s" % ALLTHETHINGS)
-        req = requests.get(ALLTHETHINGS, stream=True)
-
-        # This automatically erases the previous cached file.
-        with open(FILENAME, "wb") as fd:
-            for chunk in req.iter_content(chunk_size=1024):
-                if chunk:  # filter out keep-alive new chunks
-                    fd.write(chunk)
-                    fd.flush()
-
-        if _verify_file_integrity():
-            fd = open(FILENAME, "r")
-            data = json.load(fd)
-            return data
-        else:
-            LOG.debug('File integrity failed. Retrying fetching the file.')
-            return _fetch()
-
-    def _verify_file_integrity():
-        if not os.path.exists(FILENAME):
-            return False
-
-        statinfo = os.stat(FILENAME)
-        file_size = statinfo.st_size
-        response = requests.head(ALLTHETHINGS)
-        content_length = int(response.headers['content-length'])
-        if file_size != content_length:
-            return False
-        else:
-            return True
-
     global DATA
 
+    if not no_caching:
+        record_use(FILENAME)
+
     if no_caching:
         DATA = _fetch()
     # If we do not have an in-memory cache, try to use the file cache.
@@ -113,14 +250,158 @@ def fetch_allthethings_data(no_caching=False, verify=True):
         if not verify or _verify_file_integrity():
             assert os.path.exists(FILENAME), \
                 "verify=False should only be used if allthethings.json exists."
-            fd = open(FILENAME)
-            DATA = json.load(fd)
+            DATA = _load()
         else:
             DATA = _fetch()
 
     return DATA
 
 
+def _shard_name(builderinfo):
+    """Return the repository name of a builder (see platforms._get_repo_name)."""
+    branch = builderinfo.get('properties', {}).get('branch')
+    if not branch:
+        return OTHER_SHARD
+    return os.path.basename(branch)
+
+
+def split_into_shards(data):
+    """
+    Split allthethings data by repository.
+
+    Returns a dictionary mapping every repository name to its builders and the
+    schedulers of those builders (only with the downstream builders of that repository).
+    """
+    shards = {}
+    shard_of_builder = {}
+    for buildername, builderinfo in data.get('builders', {}).iteritems():
+        shard_name = _shard_name(builderinfo)
+        shard_of_builder[buildername] = shard_name
+        shard = shards.setdefault(shard_name, {'builders': {}, 'schedulers': {}})
+        shard['builders'][buildername] = builderinfo
+
+    for sched, values in data.get('schedulers', {}).iteritems():
+        downstream_per_shard = {}
+        for buildername in values.get('downstream', []):
+            shard_name = shard_of_builder.get(buildername, OTHER_SHARD)
+            downstream_per_shard.setdefault(shard_name, []).append(buildername)
+
+        for shard_name, downstream in downstream_per_shard.iteritems():
+            shard = shards.setdefault(shard_name, {'builders': {}, 'schedulers': {}})
+            shard['schedulers'][sched] = dict(values, downstream=downstream)
+
+    return shards
+
+
+def _write_shards(data):
+    """Store the shards of data next to allthethings.json and their manifest."""
+    global MANIFEST
+
+    shards = split_into_shards(data)
+    for shard_name, shard in shards.iteritems():
+        write_sidecar(FILENAME, "shard-%s" % shard_name, shard)
+
+    manifest = dict((shard_name, len(shard['builders']))
+                    for shard_name, shard in shards.iteritems())
+    # The manifest goes last; it tells other processes that every shard is there
+    write_sidecar(FILENAME, "shards", manifest)
+    MANIFEST = manifest
+
+
+def fetch_allthethings_manifest():
+    """
+    Return a dictionary mapping every repository name to its number of builders.
+
+    We split allthethings.json into a shard per repository when we download it.
+    If our copy does not have its shards yet (e.g. it has been downloaded by an older
+    version of mozci), we split it now.
+    """
+    global MANIFEST
+
+    if MANIFEST is None:
+        if DATA is None and _verify_file_integrity():
+            MANIFEST = load_sidecar(FILENAME, "shards")
+            if MANIFEST is not None:
+                record_use(FILENAME)
+        if MANIFEST is None:
+            data = fetch_allthethings_data()
+            # Downloading the file writes its shards
+            if MANIFEST is None:
+                _write_shards(data)
+
+    return MANIFEST
+
+
+def fetch_allthethings_shard(repo_name):
+    """
+    Return the builders and schedulers of a repository from allthethings.json.
+
+    Unlike fetch_allthethings_data, we only load the data of this repository.
+    """
+    if repo_name not in fetch_allthethings_manifest():
+        return {'builders': {}, 'schedulers': {}}
+
+    shard = load_sidecar(FILENAME, "shard-%s" % repo_name)
+    if shard is None:
+        # The shard might have been evicted
+        LOG.debug("Splitting allthethings.json again to find the shard of %s." % repo_name)
+        _write_shards(fetch_allthethings_data())
+        shard = load_sidecar(FILENAME, "shard-%s" % repo_name)
+
+    return shard
+
+
+def _content_key():
+    """
+    Return what identifies the contents of our copy of allthethings.json.
+
+    That is the sha1 stored when we downloaded the file (see write_checksum) with the
+    file's size; we never hash the file again. The checksum belongs to the current
+    modification time of the file, which changes when we verify the file with the
+    server (see _verify_file_integrity), thus, it is not part of the key.
+    Returns None if we do not have a checksum for this version of the file.
+    """
+    checksum = load_sidecar(FILENAME, "sha1")
+    if checksum is None or checksum['size'] != os.path.getsize(FILENAME):
+        return None
+    return (checksum['sha1'], checksum['size'])
+
+
+def load_catalog(repo_name):
+    """
+    Return the catalog stored by write_catalog for a repository.
+
+    Returns None if our copy of allthethings.json is outdated (see
+    fetch_allthethings_data) or if the catalog was compiled from a file with
+    different contents.
+    """
+    fetch_allthethings_manifest()
+    stored = load_sidecar(FILENAME, "catalog-%s" % repo_name)
+    content_key = _content_key()
+    if stored is None or content_key is None or stored['key'] != content_key:
+        return None
+
+    LOG.debug("Loaded the builders' catalog of %s." % repo_name)
+    return stored['catalog']
+
+
+def write_catalog(repo_name, catalog):
+    """
+    Store a catalog (anything derived from the shard of a repository) next to
+    allthethings.json.
+
+    The catalog is keyed by the sha1 of the file (see _content_key), thus, a new
+    version of the file invalidates it.
+    """
+    content_key = _content_key()
+    if content_key is None:
+        LOG.debug("We cannot store the catalog of an unverified allthethings.json.")
+        return
+
+    write_sidecar(FILENAME, "catalog-%s" % repo_name,
+                  {'key': content_key, 'catalog': catalog})
+
+
 def _list_builders():
     """Return a list of all builders running in the buildbot CI."""
     j = fetch_allthethings_data()
@@ -3,11 +3,37 @@
 This module helps with the buildjson data generated by the Release Engineering
 systems: http://builddata.pub.build.mozilla.org/builddata/buildjson
 """
+import bisect
+import collections
+import contextlib
+import datetime
 import logging
+import multiprocessing
 import os
+import subprocess
+import sys
+import time
 
-from mozci.utils.tzone import utc_dt, utc_time, utc_day
-from mozci.utils.transfer import load_file, path_to_file
+from multiprocessing.pool import ThreadPool
+
+from mozci.utils import transfer
+from mozci.utils.bloomfilter import BloomFilter
+from mozci.utils.recordstore import RecordStore, open_record_store, write_record_store
+from mozci.utils.tzone import day_format, utc_dt, utc_time, utc_day
+from mozci.utils.transfer import (
+    _fd_last_mod_key,
+    _last_mod_key,
+    _sidecar_path,
+    fetch_file,
+    file_lock,
+    iter_builds,
+    load_file,
+    load_sidecar,
+    load_versioned_file,
+    path_to_file,
+    read_versioned_file,
+    write_sidecar,
+)
 
 LOG = logging.getLogger('mozci')
 
@@ -15,57 +41,1024 @@ BUILDJSON_DATA = "http://builddata.pub.build.mozilla.org/builddata/buildjson"
 BUILDS_4HR_FILE = "builds-4hr.js"
 BUILDS_DAY_FILE = "builds-%s.js"
 
+# Approximate number of bytes that the decoded files in BUILDS_CACHE can use
+BUILDS_CACHE_BUDGET = 2 * 1024 ** 3
+# In-memory copy of the request_id -> position indexes of the files in BUILDS_CACHE
+INDEX_CACHE = {}
+# Jobs completed this close (in seconds) to midnight UTC might be in the file of the
+# adjacent day (see query_job_data)
+AMBIGUOUS_WINDOW = 4 * 60 * 60
+# Jobs completed in the last hours are searched for in builds-4hr.js
+RECENT_HOURS = 8
+# Number of days that fetch_range downloads and decodes ahead of the day being consumed
+PREFETCH_DAYS = 2
+# Number of processes used to decode several buildjson files at once (e.g. by
+# query_jobs_data); 1 decodes them one after the other in this process
+DECODE_PROCESSES = 1
+# Number of days before today searched by query_jobs_by_revision
+REVISION_LOOKBACK_DAYS = 7
+# query_jobs_by_revision checks if builds-4hr.js has changed at most this often (seconds)
+BUILDS_4HR_POLL_INTERVAL = 60
+LAST_4HR_POLL = 0
+# In-memory copy of the revision indexes keyed by file: (_last_mod_key, index)
+REVISION_INDEXES = {}
+# Fields of the jobs summarized by the zone maps (see zone_map)
+ZONE_MAP_FIELDS = ('starttime', 'endtime', 'properties.buildername', 'properties.repo_path')
+# Set this to True to keep the jobs of a buildjson file in a memory-mapped record store
+# rather than decoding all of them into memory (see mozci.utils.recordstore)
+RECORD_STORE_MODE = False
+# Directory where the record stores are written; by default they are written next to
+# the cached files. Set it to e.g. /dev/shm/mozci to keep them in shared memory: every
+# process of the host maps the same record store read-only and only the first one
+# to need it decodes the buildjson file.
+RECORD_STORE_DIR = None
+# Record stores in RECORD_STORE_DIR not written in this many seconds are removed
+RECORD_STORE_MAX_AGE = 2 * 24 * 60 * 60
+
+
+def _estimate_size(jobs, sample_size=100):
+    """
+    Estimate how many bytes of memory the decoded jobs of a buildjson file use.
+
+    We measure a sample of the jobs and extrapolate. Dictionary keys are not
+    counted since the json decoder shares them between all jobs.
+    """
+    if isinstance(jobs, RecordStore):
+        # The records are in the page cache rather than in our memory
+        return sys.getsizeof(jobs)
+
+    def _deep_size(obj):
+        size = sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            size += sum(_deep_size(value) for value in obj.itervalues())
+        elif isinstance(obj, (list, tuple)):
+            size += sum(_deep_size(item) for item in obj)
+        return size
+
+    if not jobs:
+        return sys.getsizeof(jobs)
+
+    sample = jobs[:sample_size]
+    per_job = sum(_deep_size(job) for job in sample) / float(len(sample))
+    return sys.getsizeof(jobs) + int(per_job * len(jobs))
+
+
+class BuildsCache(object):
+    """
+    In-memory cache of the jobs of buildjson files with a memory budget.
+
+    When the estimated size of the cached files goes over the budget (in bytes),
+    the least recently used files are evicted. Files can be pinned to prevent
+    them from being evicted (e.g. builds-4hr.js while it is being refreshed).
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._sizes = {}
+        self._versions = {}
+        self._pinned = collections.Counter()
+
+    def __contains__(self, filename):
+        return filename in self._entries
+
+    def __getitem__(self, filename):
+        # Mark it as the most recently used file
+        jobs = self._entries.pop(filename)
+        self._entries[filename] = jobs
+        return jobs
+
+    def get(self, filename, default=None):
+        """Return the cached jobs of filename (or default) and count the hit or miss."""
+        if filename not in self._entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return self[filename]
+
+    def __setitem__(self, filename, jobs):
+        self.put(filename, jobs)
+
+    def __delitem__(self, filename):
+        del self._entries[filename]
+        del self._sizes[filename]
+        self._versions.pop(filename, None)
+        INDEX_CACHE.pop(filename, None)
+
+    def put(self, filename, jobs, last_mod_key=None):
+        """
+        Cache the jobs of filename.
+
+        last_mod_key is the version of the file which the jobs were decoded from
+        (see transfer.read_versioned_file) or None if we do not know it.
+        """
+        self._entries.pop(filename, None)
+        self._entries[filename] = jobs
+        self._sizes[filename] = _estimate_size(jobs)
+        self._versions[filename] = last_mod_key
+        self._evict(keep=filename)
+
+    def version(self, filename):
+        """Return the version of the file which the cached jobs were decoded from."""
+        return self._versions.get(filename)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Remove every file from the cache."""
+        for filename in self._entries.keys():
+            del self[filename]
+
+    @contextlib.contextmanager
+    def pinned(self, filename):
+        """Prevent filename from being evicted within this context."""
+        self._pinned[filename] += 1
+        try:
+            yield
+        finally:
+            self._pinned[filename] -= 1
+            if self._pinned[filename] <= 0:
+                del self._pinned[filename]
+
+    def size(self):
+        """Return the estimated number of bytes used by the cached files."""
+        return sum(self._sizes.itervalues())
+
+    def stats(self):
+        """Return the counters of the cache."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self),
+            'size': self.size(),
+        }
+
+    def _evict(self, keep):
+        """Evict the least recently used files until we are within budget."""
+        if self.budget is None:
+            return
+
+        for filename in self._entries.keys():
+            if self.size() <= self.budget:
+                break
+
+            if filename == keep or filename in self._pinned:
+                continue
+
+            LOG.debug("Evicting %s from the in-memory cache." % filename)
+            del self[filename]
+            self.evictions += 1
+
+
 # This helps us read into memory and load less from disk
-BUILDS_CACHE = {}
+BUILDS_CACHE = BuildsCache(budget=BUILDS_CACHE_BUDGET)
+
+
+def fetch_by_date(date, fields=None):
+    """
+    Helper method to download a buildjson file by providing a date.
+
+    If fields is set, only those fields of every job are kept
+    (e.g. ('endtime', 'result', 'properties.buildername')).
+    """
+    return _fetch_data(BUILDS_DAY_FILE % date, fields)
+
+
+def iter_by_date(date, fields=None):
+    """
+    Generator of the jobs of the buildjson file of a date.
+
+    Unlike fetch_by_date, the jobs are decoded one at a time and they are not kept
+    in memory; this lets us go through a whole day in constant memory.
+    If fields is set, only those fields of every job are kept.
+    """
+    filename = BUILDS_DAY_FILE % date
+    filepath = _filepath(filename)
+    fetch_file(filepath, _url(filename))
+    return iter_builds(filepath, fields)
+
+
+def fetch_range(start_date, end_date, fields=None, prefetch=None):
+    """
+    Generator of the jobs of the buildjson files from start_date to end_date (inclusive).
+
+    While the jobs of a day are being consumed, the files of the next prefetch days
+    (PREFETCH_DAYS by default) are downloaded and decoded on background threads.
+    At most prefetch + 1 days are held in memory at any time and, unlike
+    fetch_by_date, they are not kept in BUILDS_CACHE.
+    If fields is set, only those fields of every job are kept.
+    """
+    if prefetch is None:
+        prefetch = PREFETCH_DAYS
+
+    pool = ThreadPool(max(prefetch, 1))
+    in_flight = collections.deque()
+    try:
+        for date in _dates(start_date, end_date):
+            in_flight.append(pool.apply_async(_load_day, (date, fields)))
+            if len(in_flight) > prefetch:
+                for job in in_flight.popleft().get():
+                    yield job
+
+        while in_flight:
+            for job in in_flight.popleft().get():
+                yield job
+    finally:
+        # The caller might stop before consuming every day
+        pool.terminate()
+
+
+def _load_day(date, fields=None):
+    """Return the jobs of the buildjson file of a date without caching them in memory."""
+    filename = BUILDS_DAY_FILE % date
+    return load_file(_filepath(filename), _url(filename), fields)["builds"]
+
+
+def _dates(start_date, end_date):
+    """Return the dates from start_date to end_date (inclusive) formatted like utc_day."""
+    start = datetime.datetime.strptime(start_date, day_format).date()
+    end = datetime.datetime.strptime(end_date, day_format).date()
+    return [(start + datetime.timedelta(days=days)).strftime(day_format)
+            for days in range((end - start).days + 1)]
+
+
+def fetch_range_rows(start_date, end_date, fields, processes=None):
+    """
+    Generator of the fields of the jobs from start_date to end_date (inclusive).
+
+    Every job is yielded as a tuple with the values of fields in the same order,
+    e.g. fields=('endtime', 'properties.buildername') yields (endtime, buildername).
+    The files are decoded on a pool of processes (see decode_files).
+    """
+    filepaths = []
+    for date in _dates(start_date, end_date):
+        filename = BUILDS_DAY_FILE % date
+        fetch_file(_filepath(filename), _url(filename))
+        filepaths.append(_filepath(filename))
+
+    for rows in decode_files(filepaths, fields, processes):
+        for row in rows:
+            yield row
+
+
+def decode_files(filepaths, fields, processes=None):
+    """
+    Decode several cached buildjson files on a pool of processes.
+
+    Decoding json is CPU bound, thus, threads do not help. In order to keep the cost
+    of sending the jobs back to this process low, the workers only return the values
+    of fields of every job as a tuple (see fetch_range_rows).
+
+    Returns a list with the rows of every file in the same order as filepaths.
+    processes defaults to the number of CPUs.
+    """
+    tasks = [(filepath, tuple(fields)) for filepath in filepaths]
+    return _map_files(_decode_rows, tasks, processes or multiprocessing.cpu_count())
+
+
+def _map_files(function, tasks, processes):
+    """Run function for every task on a pool of processes unless it is not worth it."""
+    if processes <= 1 or len(tasks) <= 1:
+        return map(function, tasks)
+
+    pool = multiprocessing.Pool(min(processes, len(tasks)))
+    try:
+        return pool.map(function, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _decode_rows(task):
+    """Return the values of fields of every job of a cached buildjson file."""
+    filepath, fields = task
+    property_fields = [field.startswith('properties.') for field in fields]
+    names = [field[len('properties.'):] if is_property else field
+             for field, is_property in zip(fields, property_fields)]
+
+    rows = []
+    for job in iter_builds(filepath, fields):
+        properties = job.get('properties', {})
+        rows.append(tuple(properties.get(name) if is_property else job.get(name)
+                          for name, is_property in zip(names, property_fields)))
+    return rows
+
+
+def _find_in_file(task):
+    """Return the jobs of request_ids found in a buildjson file which we have fetched."""
+    filepath, url, request_ids = task
+    last_mod_key, jobs = _read_jobs(filepath, url)
+    index = load_sidecar(filepath, "index", last_mod_key) or _build_index(jobs)
+    return dict((request_id, _find_job(request_id, jobs, filepath, index=index))
+                for request_id in request_ids)
+
+
+def zone_map(date, refresh=False):
+    """
+    Return a summary of the jobs of the buildjson file of a date.
+
+    The summary looks like this:
+
+    .. code-block:: python
+
+        {
+            "count": int, # Number of jobs
+            "min_starttime": int,
+            "max_starttime": int,
+            "min_endtime": int,
+            "max_endtime": int,
+            "buildernames": frozenset of strings,
+            "repo_paths": frozenset of strings, # e.g. projects/cedar
+        }
+
+    The summary is stored next to the cached file the first time we decode it. If we
+    have a summary we use it without checking if the file is current, unless refresh
+    is True. Otherwise, we fetch the file and stream it to build the summary.
+    """
+    filename = BUILDS_DAY_FILE % date
+    filepath = _filepath(filename)
+
+    if refresh or load_sidecar(filepath, "zonemap") is None:
+        fetch_file(filepath, _url(filename))
+
+    summary = load_sidecar(filepath, "zonemap")
+    if summary is None:
+        LOG.debug("Building the zone map of %s." % filename)
+        with open(filepath, 'rb') as fd:
+            summary = _write_zone_map(filepath, iter_builds(filepath, ZONE_MAP_FIELDS, fd),
+                                      _fd_last_mod_key(fd))
+    return summary
+
+
+def dates_with_jobs(dates, start_time=None, end_time=None, buildername=None, repo_path=None):
+    """
+    Return the dates whose buildjson file might have jobs matching the criteria.
+
+    A date is kept if some of its jobs could have run between start_time and end_time,
+    if buildername ran on it and if repo_path had jobs on it. Criteria set to None
+    are ignored. Only the zone maps of the dates are used (see zone_map), thus,
+    pruning a date whose file we have cached does not require decoding it.
+    """
+    kept = []
+    for date in dates:
+        summary = zone_map(date)
+        if summary["count"] == 0:
+            continue
+        if end_time is not None and summary["min_starttime"] > end_time:
+            continue
+        if start_time is not None and summary["max_endtime"] < start_time:
+            continue
+        if buildername is not None and buildername not in summary["buildernames"]:
+            continue
+        if repo_path is not None and repo_path not in summary["repo_paths"]:
+            continue
+        kept.append(date)
+    return kept
+
+
+def _build_zone_map(jobs):
+    """Summarize jobs (see zone_map); jobs can be any iterable."""
+    summary = {
+        "count": 0,
+        "min_starttime": None,
+        "max_starttime": None,
+        "min_endtime": None,
+        "max_endtime": None,
+    }
+    buildernames = set()
+    repo_paths = set()
+
+    for job in jobs:
+        summary["count"] += 1
+        for key in ("starttime", "endtime"):
+            value = job.get(key)
+            if value is None:
+                continue
+            if summary["min_" + key] is None or value < summary["min_" + key]:
+                summary["min_" + key] = value
+            if summary["max_" + key] is None or value > summary["max_" + key]:
+                summary["max_" + key] = value
+
+        properties = job.get("properties", {})
+        if "buildername" in properties:
+            buildernames.add(properties["buildername"])
+        if "repo_path" in properties:
+            repo_paths.add(properties["repo_path"])
+
+    summary["buildernames"] = frozenset(buildernames)
+    summary["repo_paths"] = frozenset(repo_paths)
+    return summary
+
+
+def _write_zone_map(filepath, jobs, last_mod_key=None):
+    """
+    Store the zone map of the jobs of filepath next to it and return it.
+
+    last_mod_key is the version of filepath which jobs come from (see write_sidecar).
+    """
+    summary = _build_zone_map(jobs)
+    write_sidecar(filepath, "zonemap", summary, last_mod_key)
+    return summary
+
+
+def _write_summaries(filepath, jobs, last_mod_key):
+    """
+    Store the zone map and the revision index of a file we have just decoded.
+
+    Summarizing the jobs now saves us from decoding the file again to do it.
+    last_mod_key is the version of filepath which we have decoded (see write_sidecar).
+    """
+    if transfer.MEMORY_SAVING_MODE:
+        # The jobs are missing most of the fields we summarize
+        return
+
+    if load_sidecar(filepath, "zonemap", last_mod_key) is None:
+        _write_zone_map(filepath, jobs, last_mod_key)
+    if load_sidecar(filepath, "revisions", last_mod_key) is None:
+        write_sidecar(filepath, "revisions", _build_revision_index(jobs), last_mod_key)
+    if load_sidecar(filepath, "endtimes", last_mod_key) is None:
+        write_sidecar(filepath, "endtimes", _build_endtimes(jobs), last_mod_key)
+
+
+def _build_endtimes(jobs):
+    """Return the endtimes of jobs sorted and the positions of the jobs in the same order."""
+    pairs = sorted((job["endtime"], position) for position, job in enumerate(jobs)
+                   if job.get("endtime") is not None)
+    return [endtime for endtime, _ in pairs], [position for _, position in pairs]
+
+
+def _stream_endtimes(filepath):
+    """
+    Return the version of a cached buildjson file and its endtimes (see
+    _build_endtimes) without decoding the rest of its jobs.
+    """
+    with open(filepath, 'rb') as fd:
+        last_mod_key = _fd_last_mod_key(fd)
+        endtimes = _build_endtimes(iter_builds(filepath, ('endtime',), fd))
+    write_sidecar(filepath, "endtimes", endtimes, last_mod_key)
+    return last_mod_key, endtimes
+
+
+def query_jobs_by_time(start_time, end_time, buildername=None):
+    """
+    Return the jobs which ended between start_time and end_time (inclusive).
+
+    If buildername is set, only the jobs of that builder are returned.
+    The days which cannot have matching jobs are pruned through their zone maps and,
+    for the rest, we binary search the sorted endtimes of the file (see
+    _write_summaries). In RECORD_STORE_MODE only the matching jobs are decoded from
+    the record store of the file. Files we have cached are used without checking if
+    they are current.
+
+    The jobs are returned sorted by endtime.
+    """
+    dates = dates_with_jobs(_dates(utc_day(start_time), utc_day(end_time)),
+                            start_time=start_time, end_time=end_time,
+                            buildername=buildername)
+    filenames = [BUILDS_DAY_FILE % date for date in dates]
+    # The jobs of the last hours might not be in the file of their day yet
+    if os.path.exists(_filepath(BUILDS_4HR_FILE)):
+        filenames.append(BUILDS_4HR_FILE)
+
+    jobs = []
+    seen = set()
+    for filename in filenames:
+        filepath = _filepath(filename)
+        # Decoding the file also writes its sorted endtimes
+        cached_jobs = _cached_jobs(filename)
+        # The endtimes have to belong to the version of the file we have decoded
+        last_mod_key = BUILDS_CACHE.version(filename)
+        endtimes = load_sidecar(filepath, "endtimes", last_mod_key)
+        if endtimes is None and transfer.MEMORY_SAVING_MODE:
+            # The jobs we keep in memory saving mode have no endtime
+            version, endtimes = _stream_endtimes(filepath)
+            if version != last_mod_key:
+                # A newer version replaced the file we have decoded
+                cached_jobs = _cached_jobs(filename)
+                if BUILDS_CACHE.version(filename) != version:
+                    LOG.warning("%s keeps changing; we are skipping it." % filename)
+                    continue
+        elif endtimes is None:
+            # The file was cached before we kept the sorted endtimes
+            endtimes = _build_endtimes(cached_jobs)
+            write_sidecar(filepath, "endtimes", endtimes, last_mod_key)
+        endtimes, positions = endtimes
+
+        first = bisect.bisect_left(endtimes, start_time)
+        last = bisect.bisect_right(endtimes, end_time)
+        for endtime, position in zip(endtimes[first:last], positions[first:last]):
+            job = cached_jobs[position]
+            if buildername is not None and \
+                    job["properties"].get("buildername") != buildername:
+                continue
+            # builds-4hr.js and the file of the day share some jobs
+            key = (tuple(_request_ids(job)), job.get("starttime"))
+            if key not in seen:
+                seen.add(key)
+                # The jobs of memory saving mode have no endtime to sort them by
+                jobs.append((endtime, job))
+
+    LOG.debug("We have found %d job(s) which ended between %s and %s." %
+              (len(jobs), utc_time(start_time), utc_time(end_time)))
+    return [pair[1] for pair in sorted(jobs, key=lambda pair: pair[0])]
+
+
+def _build_revision_index(jobs):
+    """Map every (repo_path, revision[:12], buildername) of jobs to the positions of its jobs."""
+    index = {}
+    for position, job in enumerate(jobs):
+        properties = job.get("properties", {})
+        if "revision" not in properties:
+            continue
+        key = (properties.get("repo_path"), properties["revision"][:12],
+               properties.get("buildername"))
+        index.setdefault(key, []).append(position)
+    return index
+
+
+def query_jobs_by_revision(repo_path, revision, buildername=None, dates=None):
+    """
+    Return the completed jobs of a revision found in our cached buildjson files.
+
+    Only the revision index of every file (see _write_summaries) is searched, thus,
+    we only decode the files with matching jobs. builds-4hr.js and the files of today
+    and yesterday are revalidated (at most every BUILDS_4HR_POLL_INTERVAL seconds)
+    while the files of older days are used without checking if they are current;
+    those which we have not cached are skipped (see missing_dates).
+    By default, builds-4hr.js and the files of the last REVISION_LOOKBACK_DAYS
+    days are searched; dates can be used to search other days.
+    If buildername is set, only the jobs of that builder are returned.
+    """
+    if dates is None:
+        dates = _lookback_dates()
+    filenames = [BUILDS_4HR_FILE] + [BUILDS_DAY_FILE % date for date in dates]
+
+    global LAST_4HR_POLL
+    if time.time() - LAST_4HR_POLL >= BUILDS_4HR_POLL_INTERVAL:
+        # The jobs which have just completed are only in builds-4hr.js and the
+        # files of the days which have not ended yet keep growing
+        _revalidate(BUILDS_4HR_FILE)
+        for date in set(dates).intersection(_lookback_dates(1)):
+            _revalidate(BUILDS_DAY_FILE % date)
+        LAST_4HR_POLL = time.time()
+
+    jobs = []
+    seen = set()
+    for filename in filenames:
+        if not os.path.exists(_filepath(filename)):
+            continue
+
+        index_key, index = _revision_index(filename)
+        positions = _revision_positions(index, repo_path, revision, buildername)
+        if not positions:
+            continue
+
+        cached_jobs = _cached_jobs(filename)
+        jobs_key = BUILDS_CACHE.version(filename)
+        if jobs_key is not None and jobs_key != index_key:
+            # A newer version of the file replaced the one we have indexed
+            index = _group_by_revision(_build_revision_index(cached_jobs))
+            positions = _revision_positions(index, repo_path, revision, buildername)
+
+        for position in sorted(positions):
+            job = cached_jobs[position]
+            # builds-4hr.js and the file of the day share some jobs
+            key = (tuple(_request_ids(job)), job.get("starttime"))
+            if key not in seen:
+                seen.add(key)
+                jobs.append(job)
+
+    LOG.debug("We have found %d completed job(s) of %s in our cache." % (len(jobs), revision))
+    return jobs
+
+
+def _lookback_dates(days=REVISION_LOOKBACK_DAYS):
+    """Return today and the days dates before it formatted like utc_day."""
+    today = time.time()
+    return [utc_day(today - day * 24 * 60 * 60) for day in range(days + 1)]
+
+
+def missing_dates(dates=None):
+    """
+    Return the dates of which we have not cached the buildjson file.
+
+    By default, the dates searched by query_jobs_by_revision are checked; if any of
+    them is missing the jobs it returns might be incomplete.
+    """
+    if dates is None:
+        dates = _lookback_dates()
+    return [date for date in dates
+            if not os.path.exists(_filepath(BUILDS_DAY_FILE % date))]
+
+
+def _revision_index(filename):
+    """
+    Return the version of a cached buildjson file and its revision index (see
+    _group_by_revision).
+
+    We keep it in memory until a newer version of the file is cached.
+    """
+    filepath = _filepath(filename)
+    last_mod_key = _last_mod_key(filepath)
+    if filename in REVISION_INDEXES and REVISION_INDEXES[filename][0] == last_mod_key:
+        return REVISION_INDEXES[filename]
+
+    index = load_sidecar(filepath, "revisions", last_mod_key)
+    if index is None:
+        # The file was cached before we kept revision indexes
+        _cached_jobs(filename)
+        index = load_sidecar(filepath, "revisions", last_mod_key) or {}
+
+    REVISION_INDEXES[filename] = (last_mod_key, _group_by_revision(index))
+    return REVISION_INDEXES[filename]
+
+
+def _group_by_revision(index):
+    """
+    Turn a revision index (see _build_revision_index) into a dictionary keyed by
+    (repo_path, revision[:12]) with (buildername, positions) values.
+    """
+    by_revision = {}
+    for (path, short_revision, name), positions in index.iteritems():
+        by_revision.setdefault((path, short_revision), []).append((name, positions))
+    return by_revision
+
+
+def _revision_positions(index, repo_path, revision, buildername=None):
+    """Return the positions of the jobs of a revision (and buildername) in index."""
+    return [position for name, found in index.get((repo_path, revision[:12]), [])
+            if buildername is None or name == buildername
+            for position in found]
+
+
+def _cached_jobs(filename):
+    """Return the jobs of a buildjson file from our cache without checking if it is current."""
+    filepath = _filepath(filename)
+    jobs = _in_memory(filename, filepath)
+    if jobs is not None:
+        return jobs
 
+    if RECORD_STORE_MODE:
+        last_mod_key, jobs = _cached_record_store(filename)
+    else:
+        last_mod_key, jobs = _read_jobs(filepath, _url(filename))
+        _write_summaries(filepath, jobs, last_mod_key)
+
+    BUILDS_CACHE.put(filename, jobs, last_mod_key)
+    INDEX_CACHE.pop(filename, None)
+    return jobs
 
-def fetch_by_date(date):
-    """ Helper method to download a buildjson file by providing a date."""
-    return _fetch_data(BUILDS_DAY_FILE % date)
 
+def _in_memory(key, filepath):
+    """
+    Return the jobs of BUILDS_CACHE cached under key (see _fetch_data).
 
-def _fetch_data(filename):
+    Returns None if they are not cached or if a newer version of filepath has
+    replaced the one they were decoded from; the sidecars of filepath would not
+    match them.
+    """
+    last_mod_key = BUILDS_CACHE.version(key)
+    if last_mod_key is not None and os.path.exists(filepath) and \
+            last_mod_key != _last_mod_key(filepath):
+        LOG.debug("%s has changed on disk since we decoded it." % filepath)
+        del BUILDS_CACHE[key]
+
+    return BUILDS_CACHE.get(key)
+
+
+def _fetch_data(filename, fields=None):
     """
     Helper method to fetch the buildjson data we need.
 
     This function caches the uncompressed gzip files requested in the past.
+    If fields is set, we only keep those fields of every job
+    (see mozci.utils.transfer.read_file).
 
     Returns all jobs inside of this buildjson file.
     """
-    global BUILDS_CACHE
-    if filename in BUILDS_CACHE:
-        return BUILDS_CACHE[filename]
-    url = "%s/%s.gz" % (BUILDJSON_DATA, filename)
+    # Every projection of a file is cached on its own
+    key = filename if fields is None else (filename, tuple(sorted(fields)))
+    filepath = _filepath(filename)
+    jobs = _in_memory(key, filepath)
+    if jobs is not None:
+        return jobs
+    url = _url(filename)
 
-    if not os.path.isabs(filename):
-        filepath = path_to_file(filename)
+    if RECORD_STORE_MODE and fields is None:
+        last_mod_key, jobs = _load_record_store(filename, url)
     else:
-        filepath = filename
+        # If the file exists and is valid we won't download it again
+        last_mod_key, contents = load_versioned_file(filepath, url, fields)
+        jobs = contents["builds"]
+        if fields is None:
+            _write_summaries(filepath, jobs, last_mod_key)
+
+    BUILDS_CACHE.put(key, jobs, last_mod_key)
+    # The file might have changed on disk; its index has to be validated again
+    INDEX_CACHE.pop(key, None)
+    return jobs
+
+
+def _load_record_store(filename, url):
+    """
+    Return the version of a buildjson file and its jobs as a RecordStore.
+
+    The buildjson file is only decoded if its record store is missing or if it
+    belongs to an older version of the file.
+    """
+    fetch_file(_filepath(filename), url)
+    return _cached_record_store(filename)
+
+
+def _cached_record_store(filename):
+    """
+    Return the version of a cached buildjson file and its RecordStore without
+    checking if it is current.
+    """
+    filepath = _filepath(filename)
+    store_path = _record_store_path(filepath)
+
+    last_mod_key = _last_mod_key(filepath)
+    store = open_record_store(store_path, last_mod_key)
+    if store is not None:
+        return last_mod_key, store
+
+    with file_lock(store_path):
+        # Another process might have written it while we waited for the lock
+        last_mod_key = _last_mod_key(filepath)
+        store = open_record_store(store_path, last_mod_key)
+        if store is not None:
+            return last_mod_key, store
+
+        LOG.debug("Converting %s into a record store." % filename)
+        last_mod_key, jobs = _read_jobs(filepath, _url(filename))
+        write_record_store(store_path, jobs, last_mod_key)
+        # Indexing the jobs now saves us from decoding the record store to do it
+        if load_sidecar(filepath, "index", last_mod_key) is None:
+            _write_index(filepath, _build_index(jobs), last_mod_key)
+        _write_summaries(filepath, jobs, last_mod_key)
+        del jobs
+
+    if RECORD_STORE_DIR is not None:
+        _prune_record_stores()
+    return last_mod_key, open_record_store(store_path, last_mod_key)
+
+
+def _record_store_path(filepath):
+    """Return the path of the record store of a cached buildjson file."""
+    if RECORD_STORE_DIR is None:
+        return _sidecar_path(filepath, "records")
+
+    if not os.path.exists(RECORD_STORE_DIR):
+        try:
+            os.makedirs(RECORD_STORE_DIR)
+        except OSError:
+            # Another process might have created it
+            if not os.path.isdir(RECORD_STORE_DIR):
+                raise
+    return os.path.join(RECORD_STORE_DIR, os.path.basename(filepath) + ".records")
+
+
+def _prune_record_stores():
+    """Remove the record stores of RECORD_STORE_DIR (and their locks) which are too old."""
+    too_old = time.time() - RECORD_STORE_MAX_AGE
+    for name in os.listdir(RECORD_STORE_DIR):
+        path = os.path.join(RECORD_STORE_DIR, name)
+        if name.endswith(".records"):
+            paths = [path, path + ".lock"]
+        elif name.endswith(".records.lock") and not os.path.exists(path[:-len(".lock")]):
+            # e.g. the conversion of a file failed
+            paths = [path]
+        else:
+            continue
+
+        try:
+            if os.path.getmtime(path) < too_old:
+                for path in paths:
+                    if os.path.exists(path):
+                        LOG.debug("Removing %s." % path)
+                        # Processes which have mapped it can keep on using it
+                        os.remove(path)
+        except OSError:
+            # Another process might have removed it
+            pass
+
+
+def _read_jobs(filepath, url):
+    """
+    Return the version (see transfer.read_versioned_file) and the jobs of a buildjson
+    file which we have just fetched.
+    """
+    try:
+        last_mod_key, contents = read_versioned_file(filepath)
+    except (IOError, subprocess.CalledProcessError):
+        # load_file knows how to recover from a corrupted download
+        last_mod_key, contents = load_versioned_file(filepath, url)
+    return last_mod_key, contents["builds"]
+
+
+def poll_builds_4hr():
+    """
+    Fetch builds-4hr.js if it has changed and return its jobs.
+
+    The jobs of the new version of the file replace the cached ones; the jobs that
+    fall out of its 4 hour window can be found in the file of the day they ended.
+    Other queries refresh the cached file as well, thus, telling which jobs are new
+    is up to the caller (see follow_builds_4hr).
+
+    We do not decode anything if the server tells us that the file has not changed.
+    """
+    filename = BUILDS_4HR_FILE
+    filepath = _filepath(filename)
+    url = _url(filename)
+
+    with BUILDS_CACHE.pinned(filename):
+        modified = fetch_file(filepath, url)
+        jobs = _in_memory(filename, filepath)
+        if jobs is not None and not modified:
+            return jobs
+
+        if RECORD_STORE_MODE:
+            # The other processes of the host can use the same record store
+            last_mod_key, jobs = _cached_record_store(filename)
+        else:
+            last_mod_key, jobs = _read_jobs(filepath, url)
+            _write_summaries(filepath, jobs, last_mod_key)
+        BUILDS_CACHE.put(filename, jobs, last_mod_key)
+        INDEX_CACHE.pop(filename, None)
+        _get_index(filename, jobs)
+
+    return jobs
+
+
+def follow_builds_4hr(interval=60):
+    """
+    Generator of the jobs which complete from now on.
+
+    Every interval seconds we check if builds-4hr.js has changed (see
+    poll_builds_4hr) and yield the jobs we have not seen in it before.
+    """
+    # The jobs that have already completed are not new
+    jobs = poll_builds_4hr()
+    seen = _seen_request_ids(jobs)
+    while True:
+        time.sleep(interval)
+        previous_jobs, jobs = jobs, poll_builds_4hr()
+        if jobs is previous_jobs:
+            continue
+
+        new_jobs = [job for job in jobs if seen.isdisjoint(_request_ids(job))]
+        LOG.debug("We have found %d new job(s) in %s." % (len(new_jobs), BUILDS_4HR_FILE))
+        # The jobs which fall out of the 4 hour window do not come back
+        seen = _seen_request_ids(jobs)
+        for job in new_jobs:
+            yield job
+
+
+def _seen_request_ids(jobs):
+    """Return the set of request ids of jobs."""
+    seen = set()
+    for job in jobs:
+        seen.update(_request_ids(job))
+    return seen
+
+
+def _url(filename):
+    """Return the url of a buildjson file."""
+    return "%s/%s.gz" % (BUILDJSON_DATA, filename)
+
+
+def _filepath(filename):
+    """Return the path where a buildjson file is cached."""
+    if not os.path.isabs(filename):
+        return path_to_file(filename)
+    return filename
+
+
+def _request_ids(job):
+    """Return all request ids associated to a job."""
+    # XXX: Issue 104 - We have an unclear source of request ids
+    return job["properties"].get("request_ids", []) + job["request_ids"]
+
+
+def _build_index(jobs):
+    """Map every request id found in jobs to the position of the first job containing it."""
+    index = {}
+    for position, job in enumerate(jobs):
+        for request_id in _request_ids(job):
+            index.setdefault(request_id, position)
+    return index
+
+
+def _get_index(filename, jobs):
+    """
+    Return the request_id -> position index of the jobs of a buildjson file.
+
+    jobs are the jobs of filename in BUILDS_CACHE. The index is persisted next to
+    the cached file and it is only valid for the Last-Modified time of the file it
+    was generated from. If it is missing or it belongs to another version than
+    jobs we generate it from jobs.
+    """
+    if filename in INDEX_CACHE:
+        return INDEX_CACHE[filename]
+
+    filepath = _filepath(filename)
+    last_mod_key = BUILDS_CACHE.version(filename)
+    index = load_sidecar(filepath, "index", last_mod_key)
+    if index is None:
+        LOG.debug("Indexing the request ids of %s." % filename)
+        index = _build_index(jobs)
+        _write_index(filepath, index, last_mod_key)
+    elif load_sidecar(filepath, "bloom", last_mod_key) is None:
+        # The index was written before we kept bloom filters
+        _write_bloom_filter(filepath, index, last_mod_key)
+
+    INDEX_CACHE[filename] = index
+    return index
+
+
+def _write_index(filepath, index, last_mod_key=None):
+    """
+    Store the request_id index of a buildjson file and its bloom filter next to it.
+
+    last_mod_key is the version of filepath which was indexed (see write_sidecar).
+    """
+    write_sidecar(filepath, "index", index, last_mod_key)
+    _write_bloom_filter(filepath, index, last_mod_key)
+
 
-    # If the file exists and is valid we won't download it again
-    json_contents = load_file(filepath, url)
-    BUILDS_CACHE[filename] = json_contents["builds"]
-    return json_contents["builds"]
+def _write_bloom_filter(filepath, index, last_mod_key=None):
+    """Store a bloom filter of the request ids of a buildjson file next to it."""
+    bloom_filter = BloomFilter(len(index))
+    for request_id in index:
+        bloom_filter.add(request_id)
+    write_sidecar(filepath, "bloom", bloom_filter.to_data(), last_mod_key)
 
 
-def _find_job(request_id, jobs, loaded_from):
+def _might_contain(filename, request_id):
+    """
+    Tell if our cached copy of a buildjson file might contain a request id.
+
+    We only answer through the index or the bloom filter of the file, thus, we never
+    download nor decode a file to answer. If we know nothing about the file we
+    return False.
+    """
+    if filename in INDEX_CACHE:
+        return request_id in INDEX_CACHE[filename]
+
+    data = load_sidecar(_filepath(filename), "bloom")
+    if data is None:
+        return False
+    return request_id in BloomFilter.from_data(data)
+
+
+def _find_job(request_id, jobs, loaded_from, index=None):
     """
     Look for request_id in a list of jobs.
 
     loaded_from is simply to indicate where those jobs were loaded from.
+    If index (see _get_index) is given we do not need to scan jobs.
     """
     LOG.debug("We are going to look for %s in %s." % (request_id, loaded_from))
 
+    if index is not None:
+        position = index.get(request_id)
+        if position is None:
+            return None
+        if position < len(jobs) and request_id in _request_ids(jobs[position]):
+            return jobs[position]
+        # The index belongs to another version of the file
+        LOG.debug("The index of %s is stale; scanning it for %s." % (loaded_from, request_id))
+
     for job in jobs:
-        # XXX: Issue 104 - We have an unclear source of request ids
-        prop_req_ids = job["properties"].get("request_ids", [])
-        root_req_ids = job["request_ids"]
-        if request_id in list(set(prop_req_ids + root_req_ids)):
+        if request_id in _request_ids(job):
             return job
 
     return None
 
 
+def _query_job(request_id, filename):
+    """Look for request_id in the buildjson file filename through its index."""
+    return _query_jobs([request_id], filename)[request_id]
+
+
+def _query_jobs(request_ids, filename):
+    """
+    Look for all request_ids in the buildjson file filename through its index.
+
+    Returns a dictionary mapping every request_id to its job or None if not found.
+    """
+    jobs = _fetch_data(filename)
+    index = _get_index(filename, jobs)
+    return dict((request_id, _find_job(request_id, jobs, filename, index=index))
+                for request_id in request_ids)
+
+
 def query_job_data(complete_at, request_id):
     """
     Look for a job identified by `request_id` inside of a buildjson
@@ -126,11 +1119,140 @@ def query_job_data(complete_at, request_id):
     This means that since 4pm to midnight we generate the same file again and again
     without adding any new data.
     """
-    global BUILDS_CACHE
-
     assert type(request_id) is int
     assert type(complete_at) is int
 
+    job = query_jobs_data([(complete_at, request_id)])[request_id]
+    if job is None:
+        LOG.info("We have not found the job with request_id %s in %s" %
+                 (request_id, _buildjson_filename(complete_at)))
+    return job
+
+
+def query_jobs_data(jobs):
+    """
+    Look for many jobs at once (see query_job_data).
+
+    jobs is an iterable of (complete_at, request_id) tuples. The jobs are grouped
+    by the buildjson file they can be found in, thus, every file is only loaded
+    and searched once.
+
+    Returns a dictionary mapping every request_id to its job or None if not found.
+    """
+    request_ids_per_file = collections.defaultdict(set)
+    complete_at_per_request = {}
+    for complete_at, request_id in jobs:
+        request_ids_per_file[_buildjson_filename(complete_at)].add(request_id)
+        complete_at_per_request[request_id] = complete_at
+
+    found = {}
+    # The files which are not in memory can be decoded on a pool of processes; only
+    # the jobs we are looking for are sent back from them
+    uncached = [filename for filename in request_ids_per_file
+                if filename != BUILDS_4HR_FILE and filename not in BUILDS_CACHE]
+    if DECODE_PROCESSES <= 1 or len(uncached) <= 1:
+        uncached = []
+
+    for filename in uncached:
+        fetch_file(_filepath(filename), _url(filename))
+    tasks = [(_filepath(filename), _url(filename), request_ids_per_file[filename])
+             for filename in uncached]
+    for jobs in _map_files(_find_in_file, tasks, DECODE_PROCESSES):
+        found.update(jobs)
+
+    for filename, request_ids in request_ids_per_file.iteritems():
+        if filename not in uncached:
+            found.update(_query_jobs(request_ids, filename))
+
+    # The jobs completed around midnight might be in the file of the adjacent day.
+    # The bloom filters tell us which of those files are worth searching.
+    for request_id, complete_at in sorted(complete_at_per_request.iteritems()):
+        if found[request_id] is not None:
+            continue
+
+        for filename in _candidate_filenames(complete_at):
+            if filename != _buildjson_filename(complete_at) and \
+                    _might_contain(filename, request_id):
+                job = _query_job(request_id, filename)
+                if job is not None:
+                    LOG.debug("We found %d in the adjacent file %s." % (request_id, filename))
+                    found[request_id] = job
+                    break
+
+    # Our copies of the files might be old. We revalidate every candidate file
+    # at most once and we only decode it again if the server has a newer version.
+    revalidated = set()
+    for request_id, complete_at in sorted(complete_at_per_request.iteritems()):
+        if found[request_id] is not None:
+            continue
+
+        for filename in _candidate_filenames(complete_at):
+            if filename not in revalidated:
+                revalidated.add(filename)
+                _revalidate(filename)
+
+            with BUILDS_CACHE.pinned(filename):
+                jobs = _cached_jobs(filename)
+                job = _find_job(request_id, jobs, filename, _get_index(filename, jobs))
+            if job is not None:
+                LOG.info("We found %d in %s (expected in %s)." %
+                         (request_id, filename, _buildjson_filename(complete_at)))
+                found[request_id] = job
+                break
+
+    return found
+
+
+def _revalidate(filename):
+    """
+    Make sure that our copy of a buildjson file is current.
+
+    We ask the server with a conditional request and we only forget the decoded
+    jobs of the file if it has a newer version.
+    """
+    if filename == BUILDS_4HR_FILE:
+        # This only decodes builds-4hr.js again if it has changed
+        poll_builds_4hr()
+        return
+
+    if fetch_file(_filepath(filename), _url(filename)):
+        LOG.debug("There is a newer version of %s." % filename)
+        if filename in BUILDS_CACHE:
+            del BUILDS_CACHE[filename]
+
+
+def _candidate_filenames(complete_at):
+    """
+    Return the buildjson files which might contain a job completed at complete_at.
+
+    The files are returned in the order in which we search them:
+
+    * builds-4hr.js if the job completed in the last RECENT_HOURS hours; the file
+      of the day might not have the job yet (see query_job_data)
+    * the file of the UTC day in which the job completed
+    * the file of the adjacent day if the job completed less than AMBIGUOUS_WINDOW
+      seconds away from midnight UTC (and that day has started)
+    """
+    hours_ago = (utc_dt() - utc_dt(complete_at)).total_seconds() / (60 * 60)
+    seconds_into_day = complete_at % (24 * 60 * 60)
+    candidates = []
+
+    if hours_ago < RECENT_HOURS:
+        candidates.append(BUILDS_4HR_FILE)
+
+    candidates.append(BUILDS_DAY_FILE % utc_day(complete_at))
+
+    if seconds_into_day < AMBIGUOUS_WINDOW:
+        candidates.append(BUILDS_DAY_FILE % utc_day(complete_at - AMBIGUOUS_WINDOW))
+    elif seconds_into_day > 24 * 60 * 60 - AMBIGUOUS_WINDOW and \
+            utc_day(complete_at + AMBIGUOUS_WINDOW) <= utc_day():
+        candidates.append(BUILDS_DAY_FILE % utc_day(complete_at + AMBIGUOUS_WINDOW))
+
+    return candidates
+
+
+def _buildjson_filename(complete_at):
+    """Return the name of the buildjson file which should contain a job completed at complete_at."""
     date = utc_day(complete_at)
     LOG.debug("Job identified with complete_at value: %d run on %s UTC." %
               (complete_at, date))
@@ -144,25 +1266,6 @@ def query_job_data(complete_at, request_id):
     if hours_ago < 4:
         # We might be able to grab information about pending and running jobs
         # from builds-running.js and builds-pending.js
-        filename = BUILDS_4HR_FILE
+        return BUILDS_4HR_FILE
     else:
-        filename = BUILDS_DAY_FILE % date
-    job = _find_job(request_id, _fetch_data(filename), filename)
-
-    if job:
-        return job
-
-    # If we have not found the job, it might be that our cache for this
-    # file is old. We will clean the cache and try one more time. If
-    # it fails, we will raise an Exception
-    LOG.debug("We did not find %d in %s, we'll clear our cache and try again."
-              % (request_id, filename))
-    del BUILDS_CACHE[filename]
-
-    job = _find_job(request_id, _fetch_data(filename), filename)
-    if job:
-        return job
-
-    LOG.info("We have not found the job with request_id %s in %s" %
-             (request_id, filename))
-    return None
+        return BUILDS_DAY_FILE % date
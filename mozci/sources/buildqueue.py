@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+This module helps with the state of the jobs which are pending or running as
+published by the Release Engineering systems:
+http://builddata.pub.build.mozilla.org/builddata/buildjson
+
+builds-pending.js and builds-running.js have the jobs of every branch and revision
+which are waiting for a machine or running. This lets us answer about pending and
+running jobs of any revision without asking buildapi once per revision.
+
+The structure of builds-pending.js is this (builds-running.js is the same with a
+"running" key):
+
+.. code-block:: python
+
+    {
+        "pending": {
+            "mozilla-inbound": { # branch
+                "146071751b1e": [ # revision
+                    {
+                        "id": int, # request_id
+                        "buildername": string,
+                        "submitted_at": int,
+                        ...
+                    },
+                ],
+            },
+        },
+    }
+
+A running job has a list of "request_ids" and a "start_time" instead of an "id".
+"""
+import gzip
+import json
+import logging
+import time
+
+from mozci.errors import BuildjsonError
+from mozci.utils.transfer import fetch_file, path_to_file
+
+LOG = logging.getLogger('mozci')
+
+BUILDJSON_DATA = "http://builddata.pub.build.mozilla.org/builddata/buildjson"
+PENDING, RUNNING = "pending", "running"
+FILES = {
+    PENDING: "builds-pending.js",
+    RUNNING: "builds-running.js",
+}
+# Seconds during which we trust our copy of the files without asking the server
+POLL_INTERVAL = 60
+
+# Indexes of the jobs of every state (see _build_indexes)
+INDEXES = {}
+LAST_POLL = {}
+
+
+def refresh(force=False):
+    """
+    Make sure that our copy of the files is at most POLL_INTERVAL seconds old.
+
+    We use conditional requests, thus, we only download and index the files again
+    if they have changed on the server.
+    """
+    for state, filename in FILES.iteritems():
+        if not force and state in INDEXES and \
+                time.time() - LAST_POLL.get(state, 0) < POLL_INTERVAL:
+            continue
+
+        filepath = path_to_file(filename)
+        changed = fetch_file(filepath, "%s/%s" % (BUILDJSON_DATA, filename))
+        LAST_POLL[state] = time.time()
+        if changed or state not in INDEXES:
+            LOG.debug("Indexing the jobs of %s." % filename)
+            INDEXES[state] = _build_indexes(_load_json(filepath).get(state, {}))
+
+
+def _load_json(filepath):
+    """
+    Decode builds-pending.js or builds-running.js.
+
+    read_file would apply the settings of buildjson files (e.g. memory saving mode),
+    which do not apply to these files.
+
+    Raises BuildjsonError if the file is not valid json.
+    """
+    with open(filepath, 'rb') as fd:
+        # Sniff whether the file is gzipped
+        magic = fd.read(2)
+        fd.seek(0)
+        if magic == '\037\213':
+            fd = gzip.GzipFile(fileobj=fd)
+        try:
+            return json.load(fd)
+        except ValueError, e:
+            raise BuildjsonError("%s is not valid json: %s" % (filepath, e))
+
+
+def _build_indexes(jobs_per_branch):
+    """
+    Index the jobs of builds-pending.js or builds-running.js.
+
+    Every job gets the "branch" and "revision" it belongs to and is indexed by
+    revision (the first 12 characters), by buildername and by request_id.
+    """
+    indexes = {
+        "revision": {},
+        "buildername": {},
+        "request_id": {},
+    }
+    for branch, jobs_per_revision in jobs_per_branch.iteritems():
+        for revision, jobs in jobs_per_revision.iteritems():
+            for job in jobs:
+                job = dict(job, branch=branch, revision=revision)
+                indexes["revision"].setdefault(revision[:12], []).append(job)
+                indexes["buildername"].setdefault(job["buildername"], []).append(job)
+                for request_id in _request_ids(job):
+                    indexes["request_id"][request_id] = job
+    return indexes
+
+
+def _request_ids(job):
+    """Return the request ids of a pending or running job."""
+    if "request_ids" in job:
+        return job["request_ids"]
+    return [job["id"]]
+
+
+def _query_jobs(state, revision=None, buildername=None):
+    refresh()
+    indexes = INDEXES[state]
+    if revision is not None:
+        jobs = indexes["revision"].get(revision[:12], [])
+        if buildername is not None:
+            jobs = [job for job in jobs if job["buildername"] == buildername]
+        return jobs
+
+    if buildername is not None:
+        return indexes["buildername"].get(buildername, [])
+
+    return [job for revision_jobs in indexes["revision"].itervalues() for job in revision_jobs]
+
+
+def query_pending_jobs(revision=None, buildername=None):
+    """Return the pending jobs of a revision and/or a builder (all of them by default)."""
+    return _query_jobs(PENDING, revision, buildername)
+
+
+def query_running_jobs(revision=None, buildername=None):
+    """Return the running jobs of a revision and/or a builder (all of them by default)."""
+    return _query_jobs(RUNNING, revision, buildername)
+
+
+def query_job_state(request_id):
+    """
+    Return the state (PENDING or RUNNING) of the job of a request_id.
+
+    Returns None if the job is neither pending nor running.
+    """
+    refresh()
+    for state in (RUNNING, PENDING):
+        if request_id in INDEXES[state]["request_id"]:
+            return state
+    return None
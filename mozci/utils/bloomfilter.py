@@ -0,0 +1,48 @@
+"""
+A small bloom filter to tell if a value is definitely not part of a set without
+keeping the set around, e.g. whether a request id can be found in a buildjson file.
+"""
+import hashlib
+import math
+import struct
+
+
+class BloomFilter(object):
+    """
+    Set-like object which can have false positives but never false negatives.
+
+    capacity is the number of values we expect to add and error_rate the probability
+    of a false positive once capacity values have been added.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        num_bits = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_bits = max(num_bits, 8)
+        self.num_hashes = max(int(round(self.num_bits * math.log(2) / capacity)), 1)
+        self.bits = bytearray((self.num_bits + 7) / 8)
+
+    def _positions(self, value):
+        # Double hashing: the i-th hash is h1 + i * h2
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(str(value)).digest())
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position / 8] |= 1 << (position % 8)
+
+    def __contains__(self, value):
+        return all(self.bits[position / 8] & (1 << (position % 8))
+                   for position in self._positions(value))
+
+    def to_data(self):
+        """Return the filter as builtin types (e.g. to store it with marshal)."""
+        return (self.num_bits, self.num_hashes, str(self.bits))
+
+    @classmethod
+    def from_data(cls, data):
+        """Create a filter from the data returned by to_data."""
+        bloom_filter = cls.__new__(cls)
+        bloom_filter.num_bits, bloom_filter.num_hashes, bits = data
+        bloom_filter.bits = bytearray(bits)
+        return bloom_filter
@@ -0,0 +1,220 @@
+"""
+This module manages the files that mozci caches under ~/.mozilla/mozci.
+
+We keep a manifest with the last time each cached file was used and evict the least
+recently used files (together with their sidecars) once the cache goes over its
+budgets. The eviction runs on a background thread at most once every
+CLEANUP_INTERVAL seconds, thus, callers never pay for scanning the directory.
+
+Only files of known kinds are managed (see KINDS); credentials, logs and other
+files that live in the same directory are never touched.
+"""
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+LOG = logging.getLogger('mozci')
+
+CACHE_DIR = os.path.expanduser('~/.mozilla/mozci/')
+MANIFEST = os.path.join(CACHE_DIR, 'manifest.json')
+
+# Every kind of file maps a file (and its sidecars) to the file it belongs to
+KINDS = {
+    'buildjson': re.compile(r'^(builds-[^.]+\.js)(\..*)?$'),
+    'allthethings': re.compile(r'^(allthethings\.json)(\..*)?$'),
+}
+# Budgets in bytes; files are evicted until every kind and the total fit
+KIND_BUDGETS = {
+    'buildjson': 15 * 1024 ** 3,
+    'allthethings': 1024 ** 3,
+}
+TOTAL_BUDGET = 20 * 1024 ** 3
+# Files not used in this many days are evicted even if we are within budget
+MAX_AGE_DAYS = 120
+CLEANUP_INTERVAL = 24 * 60 * 60
+
+# Last time that files were used by this process; flushed into the manifest
+USAGE = {}
+_LOCK = threading.Lock()
+_CLEANUP_THREAD = None
+
+
+def record_use(filepath):
+    """Remember that we have used a cached file; this does not touch the disk."""
+    with _LOCK:
+        if not USAGE:
+            atexit.register(flush_usage)
+        USAGE[os.path.basename(filepath)] = int(time.time())
+
+
+def _load_manifest():
+    """Return the manifest or an empty one if it does not exist or it is unreadable."""
+    if not os.path.exists(MANIFEST):
+        return {'last_cleanup': 0, 'last_used': {}}
+
+    try:
+        with open(MANIFEST) as fd:
+            return json.load(fd)
+    except ValueError:
+        LOG.debug("Ignoring unreadable %s." % MANIFEST)
+        return {'last_cleanup': 0, 'last_used': {}}
+
+
+def _write_manifest(manifest):
+    """Write the manifest into a temporary file and move it into place."""
+    # transfer imports this module, thus, we cannot import it at the top
+    from mozci.utils.transfer import atomic_open
+    with atomic_open(MANIFEST, 'w') as fd:
+        json.dump(manifest, fd)
+
+
+def _manifest_lock():
+    """Return a lock held by a single process while it updates the manifest."""
+    from mozci.utils.transfer import file_lock
+    return file_lock(MANIFEST)
+
+
+def _merge_usage(manifest):
+    """Merge the usage of this process into manifest."""
+    with _LOCK:
+        usage = dict(USAGE)
+
+    last_used = manifest['last_used']
+    for filename, timestamp in usage.iteritems():
+        last_used[filename] = max(timestamp, last_used.get(filename, 0))
+
+
+def flush_usage():
+    """Write the usage of this process into the manifest."""
+    if not USAGE or not os.path.exists(CACHE_DIR):
+        return
+
+    # Other processes merge their usage into the manifest as well
+    with _manifest_lock():
+        manifest = _load_manifest()
+        _merge_usage(manifest)
+        _write_manifest(manifest)
+
+
+def _cached_files():
+    """
+    Return the groups of cached files we manage.
+
+    Returns a dictionary mapping (kind, file) to the size of the file plus its
+    sidecars and the list of paths that compose it.
+    """
+    groups = {}
+    for filename in os.listdir(CACHE_DIR):
+        for kind, regex in KINDS.iteritems():
+            match = regex.match(filename)
+            if match:
+                filepath = os.path.join(CACHE_DIR, filename)
+                size, paths = groups.get((kind, match.group(1)), (0, []))
+                groups[(kind, match.group(1))] = \
+                    (size + os.path.getsize(filepath), paths + [filepath])
+                break
+    return groups
+
+
+def _evict(paths):
+    for path in paths:
+        LOG.debug("Cleaning up %s" % path)
+        try:
+            os.remove(path)
+        except OSError:
+            # Another process might have removed it
+            pass
+
+
+def cleanup(max_age_days=None):
+    """
+    Evict the cached files we do not need.
+
+    Files not used in max_age_days (MAX_AGE_DAYS by default) are evicted. After that,
+    the least recently used files are evicted until every kind is within KIND_BUDGETS
+    and all of them are within TOTAL_BUDGET.
+    """
+    if max_age_days is None:
+        max_age_days = MAX_AGE_DAYS
+    with _manifest_lock():
+        manifest = _load_manifest()
+        _merge_usage(manifest)
+        groups = _cached_files()
+
+        # Forget about files which are no longer in the cache
+        filenames = set(filename for kind, filename in groups)
+        last_used = dict((filename, timestamp)
+                         for filename, timestamp in manifest['last_used'].iteritems()
+                         if filename in filenames)
+        manifest['last_used'] = last_used
+
+        def _last_used(group):
+            # Files we have not seen being used are as old as their last modification
+            kind, filename = group
+            if filename in last_used:
+                return last_used[filename]
+            filepath = os.path.join(CACHE_DIR, filename)
+            if os.path.exists(filepath):
+                return os.path.getmtime(filepath)
+            # e.g. the partial download of a file
+            return max(os.path.getmtime(path) for path in groups[group][1])
+
+        oldest_first = sorted(groups, key=_last_used)
+        evicted = set()
+
+        too_old = time.time() - max_age_days * 24 * 60 * 60
+        for group in oldest_first:
+            if _last_used(group) < too_old:
+                evicted.add(group)
+
+        def _fit(budget, candidates):
+            total = sum(groups[group][0] for group in candidates if group not in evicted)
+            for group in candidates:
+                if total <= budget:
+                    break
+                if group not in evicted:
+                    evicted.add(group)
+                    total -= groups[group][0]
+
+        for kind, budget in KIND_BUDGETS.iteritems():
+            _fit(budget, [group for group in oldest_first if group[0] == kind])
+        _fit(TOTAL_BUDGET, oldest_first)
+
+        for group in evicted:
+            _evict(groups[group][1])
+            last_used.pop(group[1], None)
+
+        manifest['last_cleanup'] = int(time.time())
+        _write_manifest(manifest)
+    LOG.debug("We have evicted %d cached file(s)." % len(evicted))
+
+
+def _cleanup():
+    try:
+        cleanup()
+    except Exception, e:
+        # Cleaning up is not critical; we will try again later
+        LOG.debug("Cleaning up the cache failed: %s" % e)
+
+
+def schedule_cleanup():
+    """
+    Run cleanup on a background thread if it has not run in CLEANUP_INTERVAL seconds.
+
+    This returns immediately.
+    """
+    global _CLEANUP_THREAD
+
+    if _CLEANUP_THREAD is not None or not os.path.exists(CACHE_DIR):
+        return
+
+    if time.time() - _load_manifest()['last_cleanup'] < CLEANUP_INTERVAL:
+        return
+
+    _CLEANUP_THREAD = threading.Thread(target=_cleanup, name='mozci-cache-cleanup')
+    _CLEANUP_THREAD.daemon = True
+    _CLEANUP_THREAD.start()
@@ -0,0 +1,119 @@
+"""
+This module stores a list of records (e.g. the builds of a buildjson file) in a compact
+binary file which can be memory-mapped. Reading a record only decodes that record and
+processes reading the same file share the operating system's page cache instead of
+holding a private copy of the decoded records.
+
+The layout of a record store is:
+
+* A header: magic string, key (e.g. the Last-Modified time of the source file),
+  number of records and the position of the offset table
+* Every record as a 4 bytes length followed by the marshalled record
+* The offset table: a fixed-width (8 bytes) position per record
+"""
+import logging
+import marshal
+import mmap
+import os
+import struct
+
+from mozci.utils.transfer import atomic_open
+
+LOG = logging.getLogger('mozci')
+
+MAGIC = 'MOZCIRS1'
+HEADER = struct.Struct('<8sqQQ')
+OFFSET = struct.Struct('<Q')
+LENGTH = struct.Struct('<I')
+
+
+def write_record_store(filepath, records, key):
+    """
+    Write records into a record store identified by key.
+
+    records can be any iterable; it does not need to be held in memory.
+    The file is written to a temporary file first and moved into place at the end
+    in order to never leave a truncated record store behind.
+    """
+    offsets = []
+    with atomic_open(filepath) as fd:
+        # We will fill the header once we know where the offset table starts
+        fd.write('\0' * HEADER.size)
+        position = HEADER.size
+        for record in records:
+            data = marshal.dumps(record)
+            offsets.append(position)
+            fd.write(LENGTH.pack(len(data)))
+            fd.write(data)
+            position += LENGTH.size + len(data)
+
+        for offset in offsets:
+            fd.write(OFFSET.pack(offset))
+
+        fd.seek(0)
+        fd.write(HEADER.pack(MAGIC, key, len(offsets), position))
+
+    LOG.debug("We have stored %d records in %s." % (len(offsets), filepath))
+
+
+def open_record_store(filepath, key):
+    """
+    Return the RecordStore stored in filepath.
+
+    Returns None if it does not exist, it is corrupted or it was not written with key.
+    """
+    if not os.path.exists(filepath):
+        return None
+
+    try:
+        store = RecordStore(filepath)
+    except (ValueError, struct.error, mmap.error), e:
+        LOG.debug("Ignoring unreadable %s: %s" % (filepath, e))
+        return None
+
+    if store.key != key:
+        LOG.debug("%s is stale." % filepath)
+        store.close()
+        return None
+
+    return store
+
+
+class RecordStore(object):
+    """
+    Read-only sequence of the records stored by write_record_store.
+
+    Records are decoded every time they are accessed.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with open(filepath, 'rb') as fd:
+            self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.key, self._count, self._table = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or self._table + self._count * OFFSET.size != len(self._map):
+            self._map.close()
+            raise ValueError("%s is not a valid record store." % filepath)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError("record store index out of range")
+
+        offset, = OFFSET.unpack_from(self._map, self._table + position * OFFSET.size)
+        length, = LENGTH.unpack_from(self._map, offset)
+        start = offset + LENGTH.size
+        return marshal.loads(self._map[start:start + length])
+
+    def __iter__(self):
+        for position in xrange(self._count):
+            yield self[position]
+
+    def close(self):
+        """Unmap the file."""
+        self._map.close()
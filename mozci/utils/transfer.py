@@ -1,19 +1,27 @@
 import calendar
-import datetime
+import contextlib
 import errno
-import fnmatch
+import gc
 import gzip
+import hashlib
 import json
 import logging
+import marshal
 import os
 import platform
 import shutil
 import subprocess
+import threading
 import time
+import warnings
+
+from multiprocessing.pool import ThreadPool
 
 import requests
 
 from mozci.errors import MozciError
+from mozci.utils import cache_manager
+from mozci.utils.cache_manager import record_use
 from progressbar import Bar, Timer, FileTransferSpeed, ProgressBar
 
 # yajl2 backend is faster then the default backend, but it requires
@@ -23,10 +31,59 @@ try:
 except:
     import ijson
 
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
 LOG = logging.getLogger('mozci')
 MEMORY_SAVING_MODE = False
+# Fields of every build that we keep in memory saving mode unless asked for others.
+# Top-level keys are named as they are and keys of the properties as properties.<key>
+LEAN_FIELDS = (
+    'request_ids',
+    'properties.buildername',
+    'properties.packageUrl',
+    'properties.request_ids',
+    'properties.revision',
+    'properties.testPackagesUrl',
+    'properties.testsUrl',
+)
+# Set this to True to store a snapshot of the decoded contents next to every file
+# loaded with load_file. Loading a snapshot is several times faster than decoding
+# the json file again, however, it takes more disk space than the gzipped file.
+SNAPSHOT_MODE = False
+# Set this to True to share a single copy of the strings that repeat across builds
+# (the keys of the builds and the values of INTERNED_PROPERTIES) instead of
+# keeping a copy of them for every build.
+INTERN_STRINGS = False
+INTERNED_PROPERTIES = frozenset([
+    'branch',
+    'buildername',
+    'master',
+    'platform',
+    'product',
+    'project',
+    'repo_path',
+    'repository',
+    'scheduler',
+    'slavename',
+    'stage_platform',
+])
+# How fetch_file keeps the files it downloads: 'gzip' keeps them as served while 'raw'
+# decompresses them once after download; decoding a raw file skips decompressing it
+# every time at the cost of several times the disk space.
+CACHE_CODEC = 'gzip'
 SHOW_PROGRESS_BAR = True
+# Deprecated; only used by clean_directory (see mozci.utils.cache_manager)
 CLEANUP_DAYS = 120
+# How many times we resume an interrupted download before giving up
+DOWNLOAD_ATTEMPTS = 5
+# Files bigger than this (in bytes) are downloaded as DOWNLOAD_SEGMENTS concurrent
+# ranges if the server supports it. Set DOWNLOAD_SEGMENTS to 1 to disable it.
+PARALLEL_DOWNLOAD_THRESHOLD = 50 * 1024 * 1024
+DOWNLOAD_SEGMENTS = 4
 
 
 def path_to_file(filename):
@@ -40,19 +97,213 @@ def path_to_file(filename):
 
 def clean_directory():
     """
-    Clean ./mozilla/mozci directory of buildjson files that are older than 120 days
-    Modify CLEANUP_DAYS to change the number of days for which files are not be cleaned up.
+    Clean ./mozilla/mozci directory of cached files that are older than CLEANUP_DAYS.
+
+    Deprecated; the cache is managed by mozci.utils.cache_manager. This runs its
+    cleanup right away, which also evicts files to keep the cache within its budgets.
     """
-    path = os.path.expanduser('~/.mozilla/mozci/')
-    filter_build_files = fnmatch.filter(os.listdir(path), "builds-*")
-    permissible_last_date = datetime.date.today() - datetime.timedelta(days=CLEANUP_DAYS)
-    permissible_timestamp = int(time.mktime(permissible_last_date.timetuple()))
-    for filename in filter_build_files:
-        full_filepath = os.path.join(path, filename)
-        last_mod_timestamp = int(os.stat(full_filepath).st_mtime)
-        if last_mod_timestamp < permissible_timestamp:
-            LOG.debug("Cleaning up %s" % full_filepath)
-            os.remove(full_filepath)
+    warnings.warn("clean_directory is deprecated; use mozci.utils.cache_manager.cleanup",
+                  DeprecationWarning)
+    cache_manager.cleanup(max_age_days=CLEANUP_DAYS)
+
+
+def _sidecar_path(filepath, kind):
+    """Return the path of the `kind` sidecar file of filepath."""
+    return "%s.%s" % (filepath, kind)
+
+
+def _last_mod_key(filepath):
+    """
+    Return what identifies the version of a cached file.
+
+    _verify_last_mod pins the modified time of a downloaded file to the server's
+    Last-Modified header, thus, it changes every time a newer version is fetched.
+    """
+    return int(os.stat(filepath).st_mtime)
+
+
+def _fd_last_mod_key(fd):
+    """
+    Return the version (see _last_mod_key) of the file we have open as fd.
+
+    Newer versions of a file are moved into place rather than written on top of it,
+    thus, this is the version we read even if a newer one is downloaded meanwhile.
+    """
+    return int(os.fstat(fd.fileno()).st_mtime)
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """
+    Disable the garbage collector while creating large object graphs.
+
+    Decoding a big file creates millions of objects which trigger lots of
+    useless collections; it can double the time it takes to decode it.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def write_sidecar(filepath, kind, data, last_mod_key=None):
+    """
+    Store data derived from filepath next to it.
+
+    data can only contain builtin types (see the marshal module).
+    The data is keyed by the modified time of filepath; load_sidecar will ignore
+    it as soon as a newer version of filepath gets downloaded.
+    last_mod_key is the version of filepath which data was derived from (see
+    _fd_last_mod_key); by default it is the current one. We do not store data
+    derived from a version which has already been replaced.
+    """
+    if last_mod_key is None:
+        last_mod_key = _last_mod_key(filepath)
+    elif last_mod_key != _last_mod_key(filepath):
+        LOG.debug("Not writing the %s of %s; a newer version replaced it." % (kind, filepath))
+        return
+    _dump_sidecar(filepath, kind, data, last_mod_key)
+
+
+def _dump_sidecar(filepath, kind, data, last_mod_key):
+    sidecar = _sidecar_path(filepath, kind)
+    LOG.debug("Writing %s." % sidecar)
+    with atomic_open(sidecar) as fd:
+        marshal.dump((last_mod_key, data), fd)
+
+
+def load_sidecar(filepath, kind, last_mod_key=None):
+    """
+    Return the data stored by write_sidecar for filepath.
+
+    Returns None if there is no sidecar or if it belongs to another version of
+    filepath than last_mod_key (see _fd_last_mod_key; by default, the current one).
+    """
+    sidecar = _sidecar_path(filepath, kind)
+    if not os.path.exists(sidecar) or not os.path.exists(filepath):
+        return None
+
+    try:
+        with open(sidecar, 'rb') as fd, _gc_paused():
+            stored_key, data = marshal.load(fd)
+    except (EOFError, TypeError, ValueError), e:
+        LOG.debug("Ignoring unreadable %s: %s" % (sidecar, e))
+        return None
+
+    if last_mod_key is None:
+        last_mod_key = _last_mod_key(filepath)
+    if stored_key != last_mod_key:
+        LOG.debug("%s is stale." % sidecar)
+        return None
+
+    return data
+
+
+@contextlib.contextmanager
+def atomic_open(filepath, mode='wb'):
+    """
+    Open a temporary file which replaces filepath once the block finishes.
+
+    If anything fails within the block, filepath is left untouched. This way a
+    crash never leaves a truncated file in our cache.
+    """
+    # Other processes or threads might be writing the same file
+    tmp_filepath = '%s.%d.%d.tmp' % (filepath, os.getpid(), threading.current_thread().ident)
+    try:
+        with open(tmp_filepath, mode) as fd:
+            yield fd
+    except:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+
+    _replace(tmp_filepath, filepath)
+
+
+@contextlib.contextmanager
+def file_lock(filepath):
+    """
+    Hold an exclusive lock on filepath within this context.
+
+    Other processes which want to write the same file wait for the one holding the
+    lock; once they get it they should check if the file has already been written.
+    Locking is not supported on Windows.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    with open(filepath + '.lock', 'w') as fd:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _replace(src, dst):
+    """Move src on top of dst."""
+    if platform.system() == 'Windows' and os.path.exists(dst):
+        # Windows does not let us rename on top of an existing file
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def _sha1(filepath):
+    """Return the sha1 hex digest of a file."""
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def touch(filepath, kinds):
+    """
+    Set the modified time of filepath to now, keeping its sidecars of `kinds` valid.
+
+    Sidecars are keyed by the modified time of their file (see write_sidecar), thus,
+    we store them again under the new one.
+    """
+    now = time.time()
+    for kind in kinds:
+        data = load_sidecar(filepath, kind)
+        if data is not None:
+            _dump_sidecar(filepath, kind, data, int(now))
+    os.utime(filepath, (now, now))
+
+
+def write_checksum(filepath):
+    """Store the size and sha1 of a file we have just downloaded next to it."""
+    write_sidecar(filepath, "sha1", {
+        'size': os.path.getsize(filepath),
+        'sha1': _sha1(filepath),
+    })
+
+
+def verify_checksum(filepath, full=False):
+    """
+    Verify a file against the checksum stored by write_checksum.
+
+    By default we only compare the size, which is enough to detect truncated files
+    without reading them. If full is True, we also compare the sha1.
+
+    Returns None if we do not have a checksum for this version of the file.
+    """
+    checksum = load_sidecar(filepath, "sha1")
+    if checksum is None:
+        return None
+
+    if os.path.getsize(filepath) != checksum['size']:
+        return False
+
+    if full and _sha1(filepath) != checksum['sha1']:
+        return False
+
+    return True
 
 
 def _verify_last_mod(remote_last_mod_date, filename):
@@ -85,16 +336,22 @@ class DownloadProgressBar(ProgressBar):
         super(DownloadProgressBar, self).__init__(widgets=widgets, maxval=size)
 
 
-def _load_json_file(filepath):
+def _load_json_file(filepath, object_hook=None, fd=None):
     '''
     This is a helper function to load json contents from a file
 
+    object_hook is called with every decoded json object (see json.loads).
+    If fd is set, we read filepath from that open file.
+
     Raises an Exception if a Windows user doesn't have gzip installed.
     '''
+    if fd is None:
+        with open(filepath, 'rb') as fd:
+            return _load_json_file(filepath, object_hook, fd)
+
     LOG.debug("About to load %s." % filepath)
 
     # Sniff whether the file is gzipped
-    fd = open(filepath, 'rb')
     magic = fd.read(2)
     fd.seek(0)
 
@@ -121,11 +378,8 @@ def _load_json_file(filepath):
     else:
         data = fd.read()
 
-    if platform.system() != 'Windows':
-        fd.close()
-
     try:
-        return json.loads(data)
+        return json.loads(data, object_hook=object_hook)
     except ValueError, e:
         LOG.exception(e)
         new_file = filepath + ".corrupted"
@@ -135,32 +389,297 @@ def _load_json_file(filepath):
         exit(1)
 
 
+@contextlib.contextmanager
+def _open_decompressed(filepath, fd=None):
+    '''
+    Open a file of our cache as a stream of decompressed data.
+
+    If fd is set, we read filepath from that open file.
+
+    Raises an Exception if a Windows user doesn't have gzip installed.
+    '''
+    if fd is None:
+        with open(filepath, 'rb') as fd:
+            with _open_decompressed(filepath, fd) as stream:
+                yield stream
+        return
+
+    # Sniff whether the file is gzipped
+    magic = fd.read(2)
+    fd.seek(0)
+
+    if magic != '\037\213':  # gzip magic number
+        yield fd
+        return
+
+    if platform.system() != 'Windows':
+        gzipper = gzip.GzipFile(fileobj=fd)
+        try:
+            yield gzipper
+        finally:
+            gzipper.close()
+        return
+
+    # Windows doesn't like multiple processes opening the same files
+    fd.close()
+    # Issue 202 - gzip.py on Windows does not handle big files well
+    cmd = ["gzip", "-cd", filepath]
+    LOG.debug("-> %s" % ' '.join(cmd))
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    except OSError, e:
+        if e.errno == errno.ENOENT:
+            raise Exception(
+                "You don't have gzip installed on your system. "
+                "Please install it. You can find it inside of mozilla-build."
+            )
+        raise
+
+    try:
+        yield proc.stdout
+    finally:
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def iter_builds(filepath, fields=None, fd=None):
+    '''
+    Generator of the builds of a buildjson file in our cache.
+
+    The file is decompressed and decoded incrementally, thus, we only hold one
+    build in memory at a time. If fields is set, we only keep those fields of
+    every build (see read_file). If fd is set, we read filepath from that open file.
+
+    Raises IOError or CalledProcessError if the file is corrupted.
+    '''
+    LOG.debug("About to stream %s." % filepath)
+    if fields is not None:
+        keys, property_keys = _compile_projection(fields)
+    string_table = {}
+
+    with _open_decompressed(filepath, fd) as stream:
+        for build in ijson.items(stream, 'builds.item'):
+            if fields is not None:
+                build = _project(build, keys, property_keys)
+            if INTERN_STRINGS:
+                build = _intern_build(build, string_table)
+            yield build
+
+
 def _save_file(req, filepath):
     '''
-    Helper class to download a file and show a progress bar.
+    Helper function to download a file and show a progress bar.
+
+    We download into a partial file which is only moved into place once it has the
+    size announced by the server. If a download of the same version of the file was
+    interrupted (even by a previous process), we resume it with Range requests.
+    If the file is big, we download it as several concurrent ranges.
+
+    Raises MozciError if we can't download the whole file.
     '''
     LOG.debug("About to fetch %s from %s" % (filepath, req.url))
     size = int(req.headers['Content-Length'].strip())
+    last_mod = req.headers['last-modified']
+    accepts_ranges = req.headers.get('Accept-Ranges') == 'bytes'
+    partial = filepath + '.part'
+    segments = ['%s.%d' % (partial, i) for i in range(DOWNLOAD_SEGMENTS)]
+
+    # Partial downloads of other versions of the file (or split differently) are useless
+    version = '%s %d' % (last_mod, DOWNLOAD_SEGMENTS)
+    if _read_partial_version(partial) != version:
+        _remove_partial(partial, segments)
+        with open(partial + '.version', 'w') as fd:
+            fd.write(version)
+
     if SHOW_PROGRESS_BAR:
         pbar = DownloadProgressBar(filepath, size).start()
-    bytes = 0
-    with open(filepath, 'wb') as fd:
+    progress = _Progress(pbar.update if SHOW_PROGRESS_BAR else None)
+
+    if accepts_ranges and DOWNLOAD_SEGMENTS > 1 and size >= PARALLEL_DOWNLOAD_THRESHOLD \
+            and not os.path.exists(partial):
+        req.close()
+        _download_segments(req.url, partial, segments, size, last_mod, progress)
+
+    elif accepts_ranges and os.path.exists(partial) and os.path.getsize(partial) > 0:
+        LOG.info("Resuming the download of %s." % filepath)
+        req.close()
+        _download_range(req.url, partial, 0, size - 1, last_mod, progress)
+
+    else:
+        try:
+            _write_response(req, partial, 'wb', progress)
+        except requests.exceptions.RequestException, e:
+            if not accepts_ranges:
+                raise MozciError("The download of %s failed: %s" % (filepath, e))
+            LOG.info("The download of %s was interrupted; resuming it." % filepath)
+            _download_range(req.url, partial, 0, size - 1, last_mod, progress)
+
+    if SHOW_PROGRESS_BAR:
+        pbar.finish()
+
+    if os.path.getsize(partial) != size:
+        raise MozciError("We have downloaded %d bytes of %s instead of %d." %
+                         (os.path.getsize(partial), filepath, size))
+
+    _replace(partial, filepath)
+    os.remove(partial + '.version')
+    _verify_last_mod(last_mod, filepath)
+    write_checksum(filepath)
+
+
+class _Progress(object):
+    """Thread-safe counter of downloaded bytes which updates a progress bar."""
+
+    def __init__(self, update=None):
+        self.bytes = 0
+        self._update = update
+        self._lock = threading.Lock()
+
+    def add(self, nbytes):
+        with self._lock:
+            self.bytes += nbytes
+            if self._update:
+                self._update(self.bytes)
+
+
+def _read_partial_version(partial):
+    """Return the Last-Modified and number of segments of a partial download."""
+    if not os.path.exists(partial + '.version'):
+        return None
+    with open(partial + '.version') as fd:
+        return fd.read()
+
+
+def _remove_partial(partial, segments):
+    """Remove any partial download."""
+    for path in [partial] + segments:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _write_response(req, filepath, mode, progress):
+    """Write the body of a streamed response into filepath."""
+    with open(filepath, mode) as fd:
         for chunk in req.iter_content(10 * 1024):
             if chunk:  # filter out keep-alive new chunks
                 fd.write(chunk)
-                bytes += len(chunk)
-                if SHOW_PROGRESS_BAR:
-                    pbar.update(bytes)
-    if SHOW_PROGRESS_BAR:
-        pbar.finish()
-    _verify_last_mod(req.headers['last-modified'], filepath)
+                progress.add(len(chunk))
+
+
+def _download_range(url, filepath, start, end, last_mod, progress):
+    """
+    Download the bytes start to end (inclusive) of url into filepath.
+
+    The bytes already in filepath are not downloaded again. If-Range makes sure that
+    we only get the bytes of the same version of the file (last_mod).
 
+    Raises MozciError if we can't download all the bytes.
+    """
+    for attempt in range(DOWNLOAD_ATTEMPTS):
+        done = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+        if start + done > end:
+            return
+
+        if attempt == 0:
+            progress.add(done)
+
+        headers = {
+            'Accept-Encoding': None,
+            'Range': 'bytes=%d-%d' % (start + done, end),
+            'If-Range': last_mod,
+        }
+        try:
+            req = requests.get(url, stream=True, headers=headers)
+            if req.status_code != 206:
+                # The file has changed on the server or it does not support ranges
+                raise MozciError("We received %s instead of partial content for %s." %
+                                 (req.status_code, url))
+            _write_response(req, filepath, 'ab', progress)
+        except requests.exceptions.RequestException, e:
+            LOG.info("The download of %s was interrupted (%s)." % (url, e))
+
+    done = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+    if start + done <= end:
+        raise MozciError("We could not download %s after %d attempts." %
+                         (url, DOWNLOAD_ATTEMPTS))
+
+
+def _download_segments(url, partial, segments, size, last_mod, progress):
+    """
+    Download url as concurrent ranges and join them into partial.
 
-def load_file(filename, url):
+    The first size % len(segments) segments get one more byte than the rest; segments
+    which would be empty (e.g. for files smaller than the number of segments) are
+    not used.
+    """
+    segment_size, remainder = divmod(size, len(segments))
+    ranges = []
+    start = 0
+    for i, segment in enumerate(segments):
+        end = start + segment_size + (1 if i < remainder else 0)
+        if end > start:
+            ranges.append((segment, start, end - 1))
+        start = end
+    segments = [segment_range[0] for segment_range in ranges]
+    LOG.debug("Downloading %s in %d segments." % (url, len(segments)))
+
+    def _download_segment(segment_range):
+        segment, start, end = segment_range
+        _download_range(url, segment, start, end, last_mod, progress)
+
+    pool = ThreadPool(max(len(segments), 1))
+    try:
+        # Using get() rather than join() raises the exceptions of the threads
+        pool.map_async(_download_segment, ranges).get(timeout=24 * 60 * 60)
+    finally:
+        pool.close()
+
+    with open(partial, 'wb') as fd:
+        for segment in segments:
+            with open(segment, 'rb') as segment_fd:
+                shutil.copyfileobj(segment_fd, fd)
+    for segment in segments:
+        os.remove(segment)
+
+
+def _last_mod_date(filepath):
+    """Return the modified time of a cached file as an HTTP date (None if it is missing)."""
+    if not os.path.exists(filepath):
+        return None
+    return time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(os.stat(filepath).st_mtime))
+
+
+def _is_gzipped(filepath):
+    with open(filepath, 'rb') as fd:
+        return fd.read(2) == '\037\213'  # gzip magic number
+
+
+def _apply_codec(filepath):
+    """
+    Store a file we have fetched as CACHE_CODEC says.
+
+    The transcoded file keeps the modified time of the original one (its
+    Last-Modified), thus, we can still revalidate it and its sidecars stay valid.
+    """
+    if CACHE_CODEC != 'raw' or not _is_gzipped(filepath):
+        return
+
+    LOG.debug("Decompressing %s." % filepath)
+    last_mod = os.stat(filepath).st_mtime
+    with atomic_open(filepath) as fd:
+        with _open_decompressed(filepath) as stream:
+            shutil.copyfileobj(stream, fd, 1024 * 1024)
+    os.utime(filepath, (last_mod, last_mod))
+    write_checksum(filepath)
+
+
+def fetch_file(filename, url):
     '''
     We download a file without decompressing it so we can keep track of its progress.
-    We save it to disk and return the contents of it.
-    We also check if the file on the server is newer to determine if we should download it again.
+    We check if the file on the server is newer to determine if we should download it again.
+
+    Returns True if a new version of the file was downloaded.
 
     Raises MozciError if anything goes wrong.
     '''
@@ -175,12 +694,17 @@ def load_file(filename, url):
     }
 
     exists = os.path.exists(filepath)
+    record_use(filepath)
+
+    if exists and verify_checksum(filepath) is False:
+        # Issue 213: sometimes we end up with a corrupted builds-*.js file
+        LOG.info("%s is corrupted, we will have to download a new one.", filepath)
+        os.remove(filepath)
+        exists = False
 
     if exists:
         # The file exists in the cache, let's verify that is still current
-        statinfo = os.stat(filepath)
-        last_mod_date = time.strftime('%a, %d %b %Y %H:%M:%S GMT',
-                                      time.gmtime(statinfo.st_mtime))
+        last_mod_date = _last_mod_date(filepath)
         headers['If-Modified-Since'] = last_mod_date
     else:
         # The file does not exist in the cache; let's fetch
@@ -195,57 +719,214 @@ def load_file(filename, url):
             LOG.debug("The server's last modified in %s" % req.headers['last-modified'])
             LOG.info("Fetch newer version of %s." % filename)
 
-        _save_file(req, filename)
+        # Other processes might be downloading the same file
+        with file_lock(filepath):
+            if _last_mod_date(filepath) == req.headers['last-modified']:
+                LOG.debug("Another process has already downloaded %s." % filename)
+                req.close()
+            else:
+                _save_file(req, filepath)
+                _apply_codec(filepath)
+        return True
 
     elif req.status_code == 304:
         # The file on disk is recent
         LOG.debug("%s is on disk and it is current." % last_mod_date)
+        # It might have been downloaded before CACHE_CODEC was set
+        _apply_codec(filepath)
+        return False
 
     else:
         raise MozciError("We received %s which is unexpected." % req.status_code)
 
-    try:
-        if not MEMORY_SAVING_MODE:
-            LOG.debug("Running in *non*-memory saving mode.")
-            return _load_json_file(filepath)
 
-        LOG.debug("Running in memory saving mode.")
-        return _lean_load_json_file(filepath)
+def load_file(filename, url, fields=None):
+    '''
+    We make sure that our cached copy of a file is current (see fetch_file) and
+    return the contents of it.
+
+    If fields is set, we only keep those fields of every build (see read_file).
+
+    Raises MozciError if anything goes wrong.
+    '''
+    return load_versioned_file(filename, url, fields)[1]
+
+
+def load_versioned_file(filename, url, fields=None):
+    '''
+    Same as load_file, but we return the version of the file we have decoded
+    (see read_versioned_file) together with its contents.
+    '''
+    # Obtain the absolute path to our file in the cache
+    if not os.path.isabs(filename):
+        filepath = path_to_file(filename)
+    else:
+        filepath = filename
+
+    fetch_file(filepath, url)
+
+    try:
+        return read_versioned_file(filepath, fields)
 
     # Issue 213: sometimes we download a corrupted builds-*.js file
     except (IOError, subprocess.CalledProcessError):
         LOG.info("%s is corrupted, we will have to download a new one.", filename)
         os.remove(filepath)
-        return load_file(filename, url)
+        return load_versioned_file(filename, url, fields)
 
 
-def _lean_load_json_file(filepath):
-    """Helper function to load json contents from a file using ijson."""
-    LOG.debug("About to load %s." % filepath)
+def read_file(filepath, fields=None):
+    '''
+    Return the contents of a file in our cache without checking if it is current.
+
+    fields is a projection of the builds of a buildjson file, e.g.
+    ('starttime', 'endtime', 'properties.buildername'). If it is set, the file is
+    streamed and only those fields of every build are kept in memory. In memory
+    saving mode we use LEAN_FIELDS if fields is not set.
+    If INTERN_STRINGS is set, the builds share the strings that repeat across them.
+
+    Raises IOError or CalledProcessError if the file is corrupted.
+    '''
+    return read_versioned_file(filepath, fields)[1]
+
+
+def read_versioned_file(filepath, fields=None):
+    '''
+    Same as read_file, but we return (last_mod_key, contents).
+
+    Another process might download a newer version of the file while we decode it.
+    last_mod_key is the version we have actually decoded (see _fd_last_mod_key),
+    thus, anything derived from the contents has to be stored for that version
+    (see write_sidecar).
+    '''
+    if fields is None and MEMORY_SAVING_MODE:
+        fields = LEAN_FIELDS
+
+    # The contents differ for every projection so they can't share a snapshot
+    if fields is None:
+        snapshot = "snapshot"
+    else:
+        snapshot = "snapshot-%s" % hashlib.sha1(','.join(sorted(fields))).hexdigest()[:12]
+
+    with open(filepath, 'rb') as fd:
+        last_mod_key = _fd_last_mod_key(fd)
+
+        if SNAPSHOT_MODE:
+            contents = load_sidecar(filepath, snapshot, last_mod_key)
+            if contents is not None:
+                LOG.debug("Loaded %s from its snapshot." % filepath)
+                return last_mod_key, _intern_contents(contents)
+
+        if fields is None:
+            LOG.debug("Running in *non*-memory saving mode.")
+            # Interning every object as soon as it is decoded frees the duplicated
+            # strings right away (the builds streamed by _lean_load_json_file are
+            # interned by iter_builds)
+            string_table = {}
+            contents = _load_json_file(
+                filepath,
+                (lambda obj: _intern_object(obj, string_table)) if INTERN_STRINGS else None,
+                fd=fd)
+        else:
+            LOG.debug("Running in memory saving mode.")
+            contents = _lean_load_json_file(filepath, fields, fd=fd)
+
+    if SNAPSHOT_MODE:
+        write_sidecar(filepath, snapshot, contents, last_mod_key)
+
+    return last_mod_key, contents
+
 
-    fd = open(filepath, 'rb')
+def _intern_contents(contents):
+    """Intern the builds of the contents of a buildjson file if INTERN_STRINGS is set."""
+    if INTERN_STRINGS and 'builds' in contents:
+        builds = contents['builds']
+        string_table = {}
+        # Replacing the builds one by one frees the duplicated strings as we go
+        for position, build in enumerate(builds):
+            builds[position] = _intern_build(build, string_table)
+    return contents
+
+
+def _intern_build(build, string_table):
+    """Return build with the strings that repeat across builds replaced by shared copies."""
+    if isinstance(build.get('properties'), dict):
+        build['properties'] = _intern_object(build['properties'], string_table)
+    return _intern_object(build, string_table)
+
+
+def _intern_object(obj, string_table):
+    """
+    Return a copy of a json object whose keys and values of INTERNED_PROPERTIES are
+    shared copies from string_table.
+
+    We use a table rather than intern() since the json decoders return unicode.
+    Every file gets its own table, thus, the shared strings are freed together with
+    the builds of the file.
+    """
+    intern_string = string_table.setdefault
+    interned = {}
+    for key, value in obj.iteritems():
+        if key in INTERNED_PROPERTIES and isinstance(value, basestring):
+            value = intern_string(value, value)
+        interned[intern_string(key, key)] = value
+    return interned
+
+
+def _compile_projection(fields):
+    """
+    Split a projection (see read_file) into top-level keys and property keys.
+
+    Asking for 'properties' keeps all of the properties.
+    """
+    keys = set()
+    property_keys = set()
+    for field in fields:
+        if field.startswith('properties.'):
+            property_keys.add(field[len('properties.'):])
+        else:
+            keys.add(field)
+
+    if 'properties' in keys:
+        property_keys = None
+    elif property_keys:
+        keys.add('properties')
+
+    return keys, property_keys
+
+
+def _project(build, keys, property_keys):
+    """Return the fields of build selected by _compile_projection."""
+    projected = {}
+    for key in keys:
+        if key in build:
+            projected[key] = build[key]
+
+    if property_keys is not None and 'properties' in projected:
+        projected['properties'] = {
+            key: value for (key, value) in build['properties'].iteritems()
+            if key in property_keys
+        }
+
+    return projected
+
+
+def _lean_load_json_file(filepath, fields=LEAN_FIELDS, fd=None):
+    """
+    Helper function to load the fields we need of every build of a file using ijson.
+
+    If fd is set, we read filepath from that open file.
+    """
+    LOG.debug("About to load %s." % filepath)
 
-    gzipper = gzip.GzipFile(fileobj=fd)
-    builds = ijson.items(gzipper, 'builds.item')
     ret = {'builds': []}
     try:
         # We are going to store only the information we need from builds-.js
         # and ignore the rest.
-        ret['builds'] = [{
-            'properties': {
-                key: value for (key, value) in b["properties"].iteritems()
-                if key in ('buildername', 'request_ids', 'revision', 'packageUrl',
-                           'testPackagesUrl', 'testsUrl')
-            },
-            'request_ids': b['request_ids']
-        } for b in builds]
+        ret['builds'] = list(iter_builds(filepath, fields, fd))
 
     except IOError, e:
         LOG.warning(str(e))
         raise
 
-    finally:
-        fd.close()
-        gzipper.close()
-
     return ret
@@ -0,0 +1,29 @@
+"""Settings shared by every test."""
+import os
+import shutil
+import tempfile
+
+import pytest
+from mock import patch
+
+from mozci.utils import cache_manager
+
+
+@pytest.fixture(scope='session', autouse=True)
+def cache_manifest(request):
+    """Record the usage of cached files in a temporary manifest instead of the real one."""
+    tmp_dir = tempfile.mkdtemp()
+    patcher = patch.multiple(
+        cache_manager,
+        CACHE_DIR=tmp_dir,
+        MANIFEST=os.path.join(tmp_dir, 'manifest.json'),
+    )
+    patcher.start()
+
+    def _finalize():
+        # flush_usage runs at exit, after the real manifest has been restored
+        cache_manager.USAGE.clear()
+        patcher.stop()
+        shutil.rmtree(tmp_dir)
+
+    request.addfinalizer(_finalize)
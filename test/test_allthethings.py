@@ -1,4 +1,5 @@
 """This file contains tests for mozci/sources/allthethings.py."""
+import glob
 import json
 import os
 import unittest
@@ -29,6 +30,32 @@ def mock_get(data):
     return response
 
 
+SHARDED_DATA = {
+    "builders": {
+        "Platform1 repo build": {
+            "properties": {"branch": "projects/repo"}, "shortname": "repo-platform1",
+        },
+        "Platform1 repo opt test mochitest-1": {
+            "properties": {"branch": "projects/repo"}, "shortname": "repo-platform1-test",
+        },
+        "Platform1 try build": {
+            "properties": {"branch": "try"}, "shortname": "try-platform1",
+        },
+        "Platform1 try opt test mochitest-1": {
+            "properties": {"branch": "try"}, "shortname": "try-platform1-test",
+        },
+    },
+    "schedulers": {
+        # Schedulers are split between the repositories of their downstream builders
+        "tests-platform1-opt-unittest": {
+            "downstream": ["Platform1 repo opt test mochitest-1",
+                           "Platform1 try opt test mochitest-1"],
+            "triggered_by": ["platform1-opt-unittest"],
+        },
+    },
+}
+
+
 class TestFetching(unittest.TestCase):
 
     """
@@ -47,10 +74,11 @@ class TestFetching(unittest.TestCase):
 
     def tearDown(self):
         """Clean up after every test."""
-        if os.path.exists(TMP_FILENAME):
-            os.remove(TMP_FILENAME)
+        for path in glob.glob(TMP_FILENAME + '*'):
+            os.remove(path)
         # This will clean in-memory caching
         allthethings.DATA = None
+        allthethings.MANIFEST = None
 
     @patch('requests.get', return_value=mock_get(DATA))
     @patch('requests.head', return_value=Mock(headers={'content-length': str(len(DATA))}))
@@ -58,9 +86,9 @@ class TestFetching(unittest.TestCase):
         """
         We are going to call fetch_allthethings_data 2 times.
 
-        The first time it should use requests.get to download the file, and requests.head
-        to verify its integrity. The second time it will return the variable stored in-memory,
-        so it won't call neither head or get.
+        The first time it should use requests.get to download the file and verify its
+        integrity with the response's content-length. The second time it will return the
+        variable stored in-memory, so it won't call neither head or get.
         """
         # Calling the function the first time, and checking its result
         self.assertEquals(allthethings.fetch_allthethings_data(), self.expected)
@@ -69,21 +97,91 @@ class TestFetching(unittest.TestCase):
         allthethings.fetch_allthethings_data()
         get.assert_called_with(self.URL, stream=True)
         assert get.call_count == 1
-        head.assert_called_with(self.URL)
-        assert head.call_count == 1
+        assert head.call_count == 0
 
     @patch('requests.get', return_value=mock_get(DATA))
     @patch('requests.head', return_value=Mock(headers={'content-length': str(len(DATA))}))
     def test_calling_twice_without_caching(self, head, get):
-        """Without caching, get and head should both be called 2 times."""
+        """Without caching, get should be called 2 times."""
         self.assertEquals(allthethings.fetch_allthethings_data(no_caching=True), self.expected)
-        head.assert_called_with(self.URL)
         get.assert_called_with(self.URL, stream=True)
 
         # Calling again
         self.assertEquals(allthethings.fetch_allthethings_data(no_caching=True), self.expected)
         assert get.call_count == 2
-        assert head.call_count == 2
+        assert head.call_count == 0
+
+    @patch('requests.get', return_value=mock_get(DATA))
+    @patch('requests.head', return_value=Mock(headers={'content-length': str(len(DATA))}))
+    def test_checksum_instead_of_head(self, head, get):
+        """A file downloaded by a previous process should be verified without the server."""
+        allthethings.fetch_allthethings_data()
+        allthethings.DATA = None
+        self.assertEquals(allthethings.fetch_allthethings_data(), self.expected)
+        assert get.call_count == 1
+        assert head.call_count == 0
+
+    @patch('requests.get', return_value=mock_get(DATA))
+    @patch('requests.head', return_value=Mock(headers={'content-length': str(len(DATA))}))
+    def test_file_without_checksum(self, head, get):
+        """A file cached without a checksum should get one once the server verifies it."""
+        with open(TMP_FILENAME, 'w') as f:
+            f.write(self.DATA)
+        self.assertEquals(allthethings.fetch_allthethings_data(), self.expected)
+        allthethings.DATA = None
+        self.assertEquals(allthethings.fetch_allthethings_data(), self.expected)
+        assert get.call_count == 0
+        assert head.call_count == 1
+        assert allthethings.verify_checksum(TMP_FILENAME, full=True)
+
+    @patch('requests.get', return_value=mock_get(DATA))
+    @patch('requests.head', return_value=Mock(headers={'content-length': str(len(DATA))}))
+    def test_truncated_file_with_checksum(self, head, get):
+        """A file that does not match its checksum should be downloaded again."""
+        allthethings.fetch_allthethings_data()
+        allthethings.DATA = None
+        mtime = os.path.getmtime(TMP_FILENAME)
+        with open(TMP_FILENAME, 'r+') as f:
+            f.truncate(4)
+        os.utime(TMP_FILENAME, (mtime, mtime))
+        self.assertEquals(allthethings.fetch_allthethings_data(), self.expected)
+        assert get.call_count == 2
+        assert head.call_count == 0
+
+    @patch('requests.get', return_value=mock_get(json.dumps(SHARDED_DATA)))
+    @patch('requests.head',
+           return_value=Mock(headers={'content-length': str(len(json.dumps(SHARDED_DATA)))}))
+    def test_old_file_verified_with_head(self, head, get):
+        """A file verified with the server should be trusted for another MAX_AGE."""
+        allthethings.fetch_allthethings_manifest()
+        old = os.path.getmtime(TMP_FILENAME) - allthethings.MAX_AGE - 1
+        os.utime(TMP_FILENAME, (old, old))
+        allthethings.write_checksum(TMP_FILENAME)
+        allthethings._write_shards(allthethings.DATA)
+        allthethings.DATA = None
+        allthethings.MANIFEST = None
+
+        self.assertEquals(allthethings.fetch_allthethings_manifest(), {'repo': 2, 'try': 2})
+        assert head.call_count == 1
+        assert os.path.getmtime(TMP_FILENAME) > old
+
+        # The sidecars are still valid for the file we have touched
+        allthethings.MANIFEST = None
+        self.assertEquals(allthethings.fetch_allthethings_manifest(), {'repo': 2, 'try': 2})
+        self.assertEquals(len(allthethings.fetch_allthethings_shard('try')['builders']), 2)
+        assert head.call_count == 1
+        assert get.call_count == 1
+        self.assertIsNone(allthethings.DATA)
+
+    @patch('requests.get')
+    def test_truncated_downloads(self, get):
+        """We should give up after DOWNLOAD_ATTEMPTS truncated downloads."""
+        response = mock_get(self.DATA)
+        response.headers = {'content-length': str(len(self.DATA) + 1)}
+        get.return_value = response
+        with self.assertRaises(allthethings.MozciError):
+            allthethings.fetch_allthethings_data()
+        assert get.call_count == allthethings.DOWNLOAD_ATTEMPTS
 
     @patch('requests.get', return_value=mock_get(DATA))
     @patch('requests.head', return_value=Mock(headers={'content-length': str(len(DATA))}))
@@ -97,6 +195,51 @@ class TestFetching(unittest.TestCase):
         head.assert_called_with(self.URL)
         get.assert_called_with(self.URL, stream=True)
 
+    @patch('requests.get', return_value=mock_get(DATA))
+    @patch('requests.head', return_value=Mock(headers={'content-length': str(len(DATA))}))
+    def test_catalog(self, head, get):
+        """A catalog should be loaded only for the file it was compiled from."""
+        self.assertIsNone(allthethings.load_catalog('repo'))
+        with patch('mozci.utils.transfer._sha1') as sha1:
+            allthethings.write_catalog('repo', {'builders': set(['Platform1 repo build'])})
+            self.assertEquals(allthethings.load_catalog('repo'),
+                              {'builders': set(['Platform1 repo build'])})
+            self.assertIsNone(allthethings.load_catalog('mozilla-beta'))
+        # We should not hash the file to find out if the catalog is current
+        assert sha1.call_count == 0
+
+        # A new download with different contents
+        mtime = os.path.getmtime(TMP_FILENAME)
+        with open(TMP_FILENAME, 'w') as f:
+            f.write(self.DATA.replace('1', '2'))
+        os.utime(TMP_FILENAME, (mtime, mtime))
+        allthethings.write_checksum(TMP_FILENAME)
+        self.assertIsNone(allthethings.load_catalog('repo'))
+        assert head.call_count == 0
+
+    @patch('requests.get', return_value=mock_get(json.dumps(SHARDED_DATA)))
+    def test_shards(self, get):
+        """A shard should be loaded without loading the whole file."""
+        self.assertEquals(allthethings.fetch_allthethings_manifest(), {'repo': 2, 'try': 2})
+        allthethings.DATA = None
+        allthethings.MANIFEST = None
+
+        self.assertEquals(allthethings.fetch_allthethings_shard('try'), {
+            "builders": dict((buildername, builderinfo) for buildername, builderinfo in
+                             SHARDED_DATA["builders"].iteritems() if "try" in buildername),
+            "schedulers": {
+                "tests-platform1-opt-unittest": {
+                    "downstream": ["Platform1 try opt test mochitest-1"],
+                    "triggered_by": ["platform1-opt-unittest"],
+                },
+            },
+        })
+        self.assertEquals(
+            allthethings.fetch_allthethings_shard('not-a-repo'),
+            {'builders': {}, 'schedulers': {}})
+        self.assertIsNone(allthethings.DATA)
+        assert get.call_count == 1
+
     def test_with_verify_set_to_false_and_existing_cache(self):
         """If verify is set to False and there already is a file, we should just use it."""
         # Making sure the file exists.
@@ -104,6 +247,47 @@ class TestFetching(unittest.TestCase):
             f.write('{"data": 2}')
         self.assertEquals(allthethings.fetch_allthethings_data(verify=False), {'data': 2})
 
+    def test_lean_load(self):
+        """A lean load should only keep the builders' data we use and the schedulers."""
+        with open(TMP_FILENAME, 'w') as f:
+            json.dump({
+                "builders": {
+                    "Platform1 repo.1 build": {
+                        "properties": {"branch": "repo.1", "repo_path": "real-path"},
+                        "shortname": "repo.1-platform1",
+                        "slavepool": "b23a27e728808b811f86a8a7a20edb1b3648ec9a",
+                    },
+                },
+                "schedulers": {
+                    "tests-repo.1-platform1-opt-unittest": {
+                        "downstream": ["Platform1 repo.1 opt test mochitest-1"],
+                        "triggered_by": ["repo.1-platform1-opt-unittest"],
+                    },
+                },
+                "master_builders": {"master1": {}},
+                "slavepools": {"b23a27e728808b811f86a8a7a20edb1b3648ec9a": ["slave1"]},
+            }, f)
+
+        allthethings.LEAN_LOAD = True
+        try:
+            data = allthethings.fetch_allthethings_data(verify=False)
+        finally:
+            allthethings.LEAN_LOAD = False
+        self.assertEquals(data, {
+            "builders": {
+                "Platform1 repo.1 build": {
+                    "properties": {"branch": "repo.1"},
+                    "shortname": "repo.1-platform1",
+                },
+            },
+            "schedulers": {
+                "tests-repo.1-platform1-opt-unittest": {
+                    "downstream": ["Platform1 repo.1 opt test mochitest-1"],
+                    "triggered_by": ["repo.1-platform1-opt-unittest"],
+                },
+            },
+        })
+
     def test_with_verify_set_to_false_and_no_cache(self):
         """If verify is set to False and there is no file, it should raise an Error."""
         with self.assertRaises(AssertionError):
@@ -0,0 +1,31 @@
+"""This file contains tests for mozci/utils/bloomfilter.py."""
+import marshal
+import unittest
+
+from mozci.utils.bloomfilter import BloomFilter
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    """Test BloomFilter."""
+
+    def setUp(self):
+        self.bloom_filter = BloomFilter(1000)
+        for value in xrange(0, 2000, 2):
+            self.bloom_filter.add(value)
+
+    def test_no_false_negatives(self):
+        """Every value we have added should be found."""
+        assert all(value in self.bloom_filter for value in xrange(0, 2000, 2))
+
+    def test_error_rate(self):
+        """Few values we have not added should be found."""
+        false_positives = sum(value in self.bloom_filter for value in xrange(1, 20000, 2))
+        assert false_positives < 300
+
+    def test_to_data(self):
+        """A filter should survive being marshalled."""
+        data = marshal.loads(marshal.dumps(self.bloom_filter.to_data()))
+        bloom_filter = BloomFilter.from_data(data)
+        self.assertEquals(bloom_filter.bits, self.bloom_filter.bits)
+        assert 1998 in bloom_filter
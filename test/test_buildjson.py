@@ -0,0 +1,634 @@
+"""This file contains tests for mozci/sources/buildjson.py."""
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import patch
+
+from mozci.sources import buildjson
+from mozci.utils import transfer
+
+BUILDS = [
+    {"properties": {"request_ids": [1, 2], "revision": "abcdef123456"},
+     "request_ids": [1, 2]},
+    {"properties": {"revision": "123456abcdef"},
+     "request_ids": [3]},
+    {"properties": {"request_ids": [4], "revision": "fedcba654321"},
+     "request_ids": [5]},
+]
+
+
+def versioned(contents):
+    """Mock load_versioned_file or read_versioned_file returning contents."""
+    def _read(filepath, *args, **kwargs):
+        return transfer._last_mod_key(filepath), contents
+    return _read
+
+
+class TestBuildjsonIndex(unittest.TestCase):
+
+    """Test the request_id index of buildjson files."""
+
+    def setUp(self):
+        """Create a fake cached buildjson file."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, buildjson.BUILDS_DAY_FILE % "2015-06-01")
+        with open(self.filename, 'w') as f:
+            f.write('{}')
+        buildjson.BUILDS_CACHE.clear()
+        buildjson.INDEX_CACHE.clear()
+
+    def tearDown(self):
+        """Clean up the fake cache."""
+        shutil.rmtree(self.tmp_dir)
+        buildjson.BUILDS_CACHE.clear()
+        buildjson.INDEX_CACHE.clear()
+
+    def test_build_index(self):
+        """Request ids from both the root and the properties should be indexed."""
+        self.assertEquals(buildjson._build_index(BUILDS), {1: 0, 2: 0, 3: 1, 4: 2, 5: 2})
+
+    @patch('mozci.sources.buildjson.load_versioned_file', side_effect=versioned({'builds': BUILDS}))
+    def test_query_job_with_index(self, load_versioned_file):
+        """Jobs should be found through the index."""
+        self.assertEquals(buildjson._query_job(4, self.filename), BUILDS[2])
+        self.assertEquals(buildjson._query_job(3, self.filename), BUILDS[1])
+        self.assertIsNone(buildjson._query_job(6, self.filename))
+        assert load_versioned_file.call_count == 1
+
+    def test_stale_index_position(self):
+        """A position of an index of another version of the file should not be trusted."""
+        self.assertEquals(buildjson._find_job(3, BUILDS, self.filename, {3: 0}), BUILDS[1])
+        self.assertIsNone(buildjson._find_job(6, BUILDS[:1], self.filename, {6: 2}))
+
+    @patch('mozci.sources.buildjson.fetch_file', return_value=False)
+    @patch('mozci.sources.buildjson.read_versioned_file',
+           side_effect=versioned({'builds': BUILDS}))
+    @patch('mozci.sources.buildjson.load_versioned_file',
+           side_effect=versioned({'builds': BUILDS[:1]}))
+    def test_replaced_file_is_decoded_again(self, load_versioned_file, read_versioned_file,
+                                            fetch_file):
+        """Cached jobs should be dropped once a newer version of their file replaces it."""
+        self.assertIsNone(buildjson._query_job(4, self.filename))
+        os.utime(self.filename, (1433200000, 1433200000))
+        self.assertEquals(buildjson._cached_jobs(self.filename), BUILDS)
+        assert read_versioned_file.call_count == 1
+
+    @patch('mozci.sources.buildjson._build_index', return_value={1: 0})
+    @patch('mozci.sources.buildjson.load_versioned_file', side_effect=versioned({'builds': BUILDS}))
+    def test_index_is_persisted(self, load_versioned_file, _build_index):
+        """A second process should reuse the index stored next to the file."""
+        buildjson._query_job(1, self.filename)
+        buildjson.BUILDS_CACHE.clear()
+        buildjson.INDEX_CACHE.clear()
+        buildjson._query_job(1, self.filename)
+        assert _build_index.call_count == 1
+
+    @patch('mozci.sources.buildjson.fetch_file', return_value=False)
+    @patch('mozci.sources.buildjson.read_versioned_file', side_effect=versioned({'builds': BUILDS}))
+    def test_record_store_mode(self, read_versioned_file, fetch_file):
+        """The jobs should only be decoded the first time we create the record store."""
+        buildjson.RECORD_STORE_MODE = True
+        try:
+            self.assertEquals(buildjson._query_job(5, self.filename), BUILDS[2])
+            buildjson.BUILDS_CACHE.clear()
+            buildjson.INDEX_CACHE.clear()
+            self.assertEquals(buildjson._query_job(3, self.filename), BUILDS[1])
+        finally:
+            buildjson.RECORD_STORE_MODE = False
+        assert read_versioned_file.call_count == 1
+        assert fetch_file.call_count == 2
+
+        # Other processes should be able to probe the file through its bloom filter
+        assert os.path.exists(self.filename + '.bloom')
+        buildjson.INDEX_CACHE.clear()
+        assert buildjson._might_contain(self.filename, 5)
+
+    @patch('mozci.sources.buildjson.fetch_file', return_value=False)
+    @patch('mozci.sources.buildjson.read_versioned_file', side_effect=versioned({'builds': BUILDS}))
+    def test_record_store_dir(self, read_versioned_file, fetch_file):
+        """Record stores should be shared through RECORD_STORE_DIR."""
+        shared_dir = os.path.join(self.tmp_dir, 'shm')
+        buildjson.RECORD_STORE_MODE = True
+        buildjson.RECORD_STORE_DIR = shared_dir
+        try:
+            self.assertEquals(buildjson._query_job(5, self.filename), BUILDS[2])
+            # Another process would find the record store
+            buildjson.BUILDS_CACHE.clear()
+            buildjson.INDEX_CACHE.clear()
+            self.assertEquals(buildjson._query_job(3, self.filename), BUILDS[1])
+        finally:
+            buildjson.RECORD_STORE_MODE = False
+            buildjson.RECORD_STORE_DIR = None
+        assert read_versioned_file.call_count == 1
+        self.assertEquals(sorted(os.listdir(shared_dir)),
+                          [os.path.basename(self.filename) + '.records',
+                           os.path.basename(self.filename) + '.records.lock'])
+
+    def test_prune_record_stores(self):
+        """Old record stores should be removed from RECORD_STORE_DIR."""
+        buildjson.RECORD_STORE_DIR = self.tmp_dir
+        try:
+            for name, mtime in (('old.records', 0), ('old.records.lock', 0),
+                                ('orphan.records.lock', 0), ('new.records', time.time()),
+                                ('new.records.lock', 0)):
+                with open(os.path.join(self.tmp_dir, name), 'w') as f:
+                    f.write('')
+                os.utime(os.path.join(self.tmp_dir, name), (mtime, mtime))
+            buildjson._prune_record_stores()
+        finally:
+            buildjson.RECORD_STORE_DIR = None
+        self.assertEquals(sorted(name for name in os.listdir(self.tmp_dir) if '.records' in name),
+                          ['new.records', 'new.records.lock'])
+
+    @patch('mozci.sources.buildjson.fetch_file', return_value=False)
+    @patch('mozci.sources.buildjson.load_versioned_file', side_effect=versioned({'builds': BUILDS}))
+    def test_query_jobs_data(self, load_versioned_file, fetch_file):
+        """Jobs within the same file should only load the file once."""
+        with patch('mozci.sources.buildjson._buildjson_filename', return_value=self.filename), \
+                patch('mozci.sources.buildjson._candidate_filenames',
+                      return_value=[self.filename]):
+            found = buildjson.query_jobs_data([(1433116800, 1), (1433116900, 4),
+                                               (1433117000, 6)])
+        self.assertEquals(found, {1: BUILDS[0], 4: BUILDS[2], 6: None})
+        assert load_versioned_file.call_count == 1
+        # The file is revalidated for the missing job but it has not changed
+        assert fetch_file.call_count == 1
+
+    @patch('mozci.sources.buildjson.fetch_file')
+    @patch('mozci.sources.buildjson.read_versioned_file')
+    @patch('mozci.sources.buildjson.load_versioned_file',
+           side_effect=versioned({'builds': BUILDS[:1]}))
+    def test_revalidate(self, load_versioned_file, read_versioned_file, fetch_file):
+        """A file should only be decoded again if the server has a newer version."""
+        def _new_version(filepath, url):
+            # A new version has a new Last-Modified
+            os.utime(filepath, (1433200000, 1433200000))
+            return True
+
+        fetch_file.side_effect = _new_version
+        read_versioned_file.side_effect = versioned({'builds': BUILDS})
+        with patch('mozci.sources.buildjson._buildjson_filename', return_value=self.filename), \
+                patch('mozci.sources.buildjson._candidate_filenames',
+                      return_value=[self.filename]):
+            found = buildjson.query_jobs_data([(1433116800, 1), (1433116900, 4)])
+        self.assertEquals(found, {1: BUILDS[0], 4: BUILDS[2]})
+        assert load_versioned_file.call_count == 1
+        assert read_versioned_file.call_count == 1
+
+    @patch('mozci.sources.buildjson.fetch_file', return_value=False)
+    @patch('mozci.sources.buildjson.load_versioned_file')
+    def test_adjacent_file(self, load_versioned_file, fetch_file):
+        """Jobs missing from their file should be found in adjacent files known to have them."""
+        adjacent = os.path.join(self.tmp_dir, buildjson.BUILDS_DAY_FILE % "2015-06-02")
+        with open(adjacent, 'w') as f:
+            f.write('{}')
+        load_versioned_file.side_effect = lambda filepath, url, fields=None: versioned(
+            {'builds': BUILDS if filepath == adjacent else BUILDS[:1]})(filepath)
+
+        # Write the bloom filter of the adjacent file and forget about it
+        buildjson._query_job(1, adjacent)
+        assert os.path.exists(adjacent + '.bloom')
+        buildjson.BUILDS_CACHE.clear()
+        buildjson.INDEX_CACHE.clear()
+
+        with patch('mozci.sources.buildjson._buildjson_filename', return_value=self.filename), \
+                patch('mozci.sources.buildjson._candidate_filenames',
+                      return_value=[self.filename, adjacent]):
+            found = buildjson.query_jobs_data([(1433116800, 3), (1433116900, 6)])
+        self.assertEquals(found, {3: BUILDS[1], 6: None})
+        # The adjacent file is only loaded for 3; the bloom filter rules it out for 6
+        self.assertEquals([args[0][0] for args in load_versioned_file.call_args_list],
+                          [adjacent, self.filename, adjacent])
+
+    def test_candidate_filenames(self):
+        """Jobs completed close to midnight UTC might be in the file of the other day."""
+        self.assertEquals(buildjson._candidate_filenames(1433116800 + 60),
+                          [buildjson.BUILDS_DAY_FILE % "2015-06-01",
+                           buildjson.BUILDS_DAY_FILE % "2015-05-31"])
+        self.assertEquals(buildjson._candidate_filenames(1433116800 - 60),
+                          [buildjson.BUILDS_DAY_FILE % "2015-05-31",
+                           buildjson.BUILDS_DAY_FILE % "2015-06-01"])
+        self.assertEquals(buildjson._candidate_filenames(1433116800 + 12 * 60 * 60),
+                          [buildjson.BUILDS_DAY_FILE % "2015-06-01"])
+        recent = buildjson._candidate_filenames(int(time.time()) - 60 * 60)
+        self.assertEquals(recent[0], buildjson.BUILDS_4HR_FILE)
+
+
+class TestZoneMap(unittest.TestCase):
+
+    """Test the zone maps of buildjson files."""
+
+    JOBS = [
+        {"starttime": 10, "endtime": 20,
+         "properties": {"buildername": "b1", "repo_path": "projects/cedar"}},
+        {"starttime": 5, "endtime": 30,
+         "properties": {"buildername": "b2", "repo_path": "mozilla-central"}},
+    ]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, buildjson.BUILDS_DAY_FILE % "2015-06-01")
+        with open(self.filename, 'w') as f:
+            f.write('{}')
+        buildjson.BUILDS_CACHE.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        buildjson.BUILDS_CACHE.clear()
+
+    def test_build_zone_map(self):
+        """The summary should cover every job."""
+        self.assertEquals(buildjson._build_zone_map(self.JOBS), {
+            "count": 2,
+            "min_starttime": 5,
+            "max_starttime": 10,
+            "min_endtime": 20,
+            "max_endtime": 30,
+            "buildernames": frozenset(["b1", "b2"]),
+            "repo_paths": frozenset(["projects/cedar", "mozilla-central"]),
+        })
+
+    @patch('mozci.sources.buildjson.fetch_file')
+    @patch('mozci.sources.buildjson.iter_builds')
+    @patch('mozci.sources.buildjson._filepath')
+    @patch('mozci.sources.buildjson.load_versioned_file')
+    def test_written_on_first_parse(self, load_versioned_file, _filepath, iter_builds, fetch_file):
+        """Decoding a file should store its zone map; zone_map should not decode it again."""
+        load_versioned_file.side_effect = versioned({'builds': self.JOBS})
+        _filepath.return_value = self.filename
+        buildjson._fetch_data(buildjson.BUILDS_DAY_FILE % "2015-06-01")
+
+        self.assertEquals(buildjson.zone_map("2015-06-01")["count"], 2)
+        assert fetch_file.call_count == 0
+        assert iter_builds.call_count == 0
+
+    @patch('mozci.sources.buildjson.zone_map')
+    def test_dates_with_jobs(self, zone_map):
+        """Dates should be pruned by time range, buildername and repo_path."""
+        summaries = {
+            "2015-06-01": buildjson._build_zone_map(self.JOBS[:1]),
+            "2015-06-02": buildjson._build_zone_map(self.JOBS[1:]),
+            "2015-06-03": buildjson._build_zone_map([]),
+        }
+        zone_map.side_effect = summaries.get
+        dates = sorted(summaries)
+
+        self.assertEquals(buildjson.dates_with_jobs(dates), dates[:2])
+        self.assertEquals(buildjson.dates_with_jobs(dates, start_time=25), ["2015-06-02"])
+        self.assertEquals(buildjson.dates_with_jobs(dates, end_time=7), ["2015-06-02"])
+        self.assertEquals(buildjson.dates_with_jobs(dates, buildername="b1"), ["2015-06-01"])
+        self.assertEquals(buildjson.dates_with_jobs(dates, repo_path="mozilla-central"),
+                          ["2015-06-02"])
+
+
+class TestFetchRange(unittest.TestCase):
+
+    """Test fetch_range."""
+
+    def test_dates(self):
+        """Ranges should include both ends and cross months."""
+        self.assertEquals(buildjson._dates("2015-05-30", "2015-06-02"),
+                          ["2015-05-30", "2015-05-31", "2015-06-01", "2015-06-02"])
+        self.assertEquals(buildjson._dates("2015-06-02", "2015-06-01"), [])
+
+    @patch('mozci.sources.buildjson._load_day')
+    def test_order(self, _load_day):
+        """Jobs should be yielded day after day."""
+        _load_day.side_effect = lambda date, fields: [date + "-a", date + "-b"]
+        self.assertEquals(list(buildjson.fetch_range("2015-06-01", "2015-06-03")),
+                          ["2015-06-01-a", "2015-06-01-b", "2015-06-02-a", "2015-06-02-b",
+                           "2015-06-03-a", "2015-06-03-b"])
+
+    @patch('mozci.sources.buildjson._load_day')
+    def test_in_flight_limit(self, _load_day):
+        """Only prefetch days should be loaded ahead of the day being consumed."""
+        _load_day.side_effect = lambda date, fields: [date]
+        jobs = buildjson.fetch_range("2015-06-01", "2015-06-30", prefetch=2)
+        self.assertEquals(next(jobs), "2015-06-01")
+        jobs.close()
+        assert _load_day.call_count <= 3
+
+
+class TestDecodeFiles(unittest.TestCase):
+
+    """Test decoding several buildjson files on a pool of processes."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepaths = []
+        for day, builds in (("2015-06-01", BUILDS[:1]), ("2015-06-02", BUILDS[1:])):
+            filepath = os.path.join(self.tmp_dir, buildjson.BUILDS_DAY_FILE % day)
+            with open(filepath, 'w') as f:
+                json.dump({'builds': builds}, f)
+            self.filepaths.append(filepath)
+        buildjson.BUILDS_CACHE.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        buildjson.BUILDS_CACHE.clear()
+
+    def test_decode_files(self):
+        """Every file should be decoded into rows with the values of the fields."""
+        self.assertEquals(
+            buildjson.decode_files(self.filepaths, ('properties.revision', 'request_ids'), 2),
+            [[("abcdef123456", [1, 2])],
+             [("123456abcdef", [3]), ("fedcba654321", [5])]])
+
+    @patch('mozci.sources.buildjson.fetch_file')
+    @patch('mozci.sources.buildjson.load_versioned_file')
+    def test_query_jobs_data(self, load_versioned_file, fetch_file):
+        """Jobs of several files should be found without loading them in this process."""
+        buildjson.DECODE_PROCESSES = 2
+        try:
+            with patch('mozci.sources.buildjson._buildjson_filename',
+                       side_effect=lambda complete_at: self.filepaths[complete_at]):
+                found = buildjson.query_jobs_data([(0, 1), (1, 3), (1, 4)])
+        finally:
+            buildjson.DECODE_PROCESSES = 1
+        self.assertEquals(found, {1: BUILDS[0], 3: BUILDS[1], 4: BUILDS[2]})
+        assert load_versioned_file.call_count == 0
+        assert fetch_file.call_count == 2
+
+
+class TestRevisionIndex(unittest.TestCase):
+
+    """Test finding the completed jobs of a revision."""
+
+    JOBS = [
+        {"request_ids": [1], "starttime": 1,
+         "properties": {"repo_path": "projects/cedar", "revision": "abcdef1234567890",
+                        "buildername": "b1"}},
+        {"request_ids": [2], "starttime": 2,
+         "properties": {"repo_path": "projects/cedar", "revision": "abcdef1234567890",
+                        "buildername": "b2"}},
+        {"request_ids": [3], "starttime": 3,
+         "properties": {"repo_path": "mozilla-central", "revision": "abcdef1234567890",
+                        "buildername": "b1"}},
+    ]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for filename, jobs in ((buildjson.BUILDS_4HR_FILE, self.JOBS[:1]),
+                               (buildjson.BUILDS_DAY_FILE % "2015-06-01", self.JOBS)):
+            with open(os.path.join(self.tmp_dir, filename), 'w') as f:
+                json.dump({'builds': jobs}, f)
+        buildjson.BUILDS_CACHE.clear()
+        buildjson.REVISION_INDEXES.clear()
+        buildjson.LAST_4HR_POLL = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        buildjson.BUILDS_CACHE.clear()
+        buildjson.REVISION_INDEXES.clear()
+        buildjson.LAST_4HR_POLL = 0
+
+    def test_build_revision_index(self):
+        """Jobs should be indexed by repo_path, short revision and buildername."""
+        self.assertEquals(buildjson._build_revision_index(self.JOBS), {
+            ("projects/cedar", "abcdef123456", "b1"): [0],
+            ("projects/cedar", "abcdef123456", "b2"): [1],
+            ("mozilla-central", "abcdef123456", "b1"): [2],
+        })
+
+    @patch('mozci.sources.buildjson.fetch_file', return_value=False)
+    def test_query_jobs_by_revision(self, fetch_file):
+        """Jobs should be found in every cached file only once; only builds-4hr.js is fetched."""
+        with patch('mozci.sources.buildjson._filepath',
+                   side_effect=lambda filename: os.path.join(self.tmp_dir, filename)):
+            self.assertEquals(
+                buildjson.query_jobs_by_revision("projects/cedar", "abcdef1234567890abcd",
+                                                 dates=["2015-06-01", "2015-06-02"]),
+                self.JOBS[:2])
+            self.assertEquals(
+                buildjson.query_jobs_by_revision("mozilla-central", "abcdef123456", "b1",
+                                                 dates=["2015-06-01"]),
+                self.JOBS[2:])
+        # builds-4hr.js is only revalidated once within BUILDS_4HR_POLL_INTERVAL
+        fetch_file.assert_called_once_with(
+            os.path.join(self.tmp_dir, buildjson.BUILDS_4HR_FILE),
+            buildjson._url(buildjson.BUILDS_4HR_FILE))
+        assert os.path.exists(os.path.join(
+            self.tmp_dir, buildjson.BUILDS_DAY_FILE % "2015-06-01") + ".revisions")
+
+    @patch('mozci.sources.buildjson.fetch_file', return_value=False)
+    def test_recent_files_are_revalidated(self, fetch_file):
+        """The files of today and yesterday should be revalidated with builds-4hr.js."""
+        dates = buildjson._lookback_dates(2)
+        with patch('mozci.sources.buildjson._filepath',
+                   side_effect=lambda filename: os.path.join(self.tmp_dir, filename)):
+            buildjson.query_jobs_by_revision("projects/cedar", "abcdef123456", dates=dates)
+            self.assertEquals(buildjson.missing_dates(dates + ["2015-06-01"]), dates)
+        self.assertEquals(
+            sorted(args[0][0] for args in fetch_file.call_args_list),
+            sorted(os.path.join(self.tmp_dir, filename) for filename in
+                   [buildjson.BUILDS_4HR_FILE] +
+                   [buildjson.BUILDS_DAY_FILE % date for date in dates[:2]]))
+
+    @patch('mozci.sources.buildjson.load_sidecar', wraps=buildjson.load_sidecar)
+    @patch('mozci.sources.buildjson.fetch_file', return_value=False)
+    def test_revision_indexes_in_memory(self, fetch_file, load_sidecar):
+        """The revision index of a file should only be loaded once per version."""
+        filename = os.path.join(self.tmp_dir, buildjson.BUILDS_DAY_FILE % "2015-06-01")
+        buildjson._cached_jobs(filename)
+        buildjson._revision_index(filename)
+        calls = load_sidecar.call_count
+        self.assertEquals(
+            sorted(buildjson._revision_index(filename)[1][("projects/cedar", "abcdef123456")]),
+            [("b1", [0]), ("b2", [1])])
+        assert load_sidecar.call_count == calls
+
+
+class TestQueryJobsByTime(unittest.TestCase):
+
+    """Test query_jobs_by_time."""
+
+    # 2015-06-01 00:00:00 UTC
+    MIDNIGHT = 1433116800
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.jobs = [
+            {"request_ids": [i], "starttime": self.MIDNIGHT + i * 3600 - 60,
+             "endtime": self.MIDNIGHT + i * 3600,
+             "properties": {"buildername": "b%d" % (i % 2)}}
+            for i in (5, 3, 1, 4, 2)
+        ]
+        filepath = os.path.join(self.tmp_dir, buildjson.BUILDS_DAY_FILE % "2015-06-01")
+        with open(filepath, 'w') as f:
+            json.dump({'builds': self.jobs}, f)
+        buildjson.BUILDS_CACHE.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        buildjson.BUILDS_CACHE.clear()
+
+    def test_build_endtimes(self):
+        """Endtimes should be sorted together with the positions of their jobs."""
+        endtimes, positions = buildjson._build_endtimes(self.jobs)
+        self.assertEquals(positions, [2, 4, 1, 3, 0])
+        self.assertEquals(endtimes, sorted(job["endtime"] for job in self.jobs))
+
+    @patch('mozci.sources.buildjson.fetch_file')
+    def test_query_jobs_by_time(self, fetch_file):
+        """Only the jobs which ended within the range should be returned."""
+        with patch('mozci.sources.buildjson._filepath',
+                   side_effect=lambda filename: os.path.join(self.tmp_dir, filename)):
+            jobs = buildjson.query_jobs_by_time(self.MIDNIGHT + 2 * 3600,
+                                                self.MIDNIGHT + 4 * 3600)
+            self.assertEquals([job["request_ids"] for job in jobs], [[2], [3], [4]])
+
+            jobs = buildjson.query_jobs_by_time(self.MIDNIGHT + 2 * 3600,
+                                                self.MIDNIGHT + 4 * 3600, "b1")
+            self.assertEquals([job["request_ids"] for job in jobs], [[3]])
+
+            self.assertEquals(buildjson.query_jobs_by_time(self.MIDNIGHT + 2 * 3600,
+                                                           self.MIDNIGHT + 4 * 3600, "b2"),
+                              [])
+
+        # Without RECORD_STORE_MODE no record store should be written
+        self.assertEquals(
+            [name for name in os.listdir(self.tmp_dir) if name.endswith(".records")], [])
+
+    @patch('mozci.sources.buildjson.fetch_file')
+    def test_memory_saving_mode(self, fetch_file):
+        """The endtimes should not be built from jobs without endtime."""
+        transfer.MEMORY_SAVING_MODE = True
+        try:
+            with patch('mozci.sources.buildjson._filepath',
+                       side_effect=lambda filename: os.path.join(self.tmp_dir, filename)):
+                jobs = buildjson.query_jobs_by_time(self.MIDNIGHT + 2 * 3600,
+                                                    self.MIDNIGHT + 4 * 3600)
+        finally:
+            transfer.MEMORY_SAVING_MODE = False
+        self.assertEquals([job["request_ids"] for job in jobs], [[2], [3], [4]])
+        filepath = os.path.join(self.tmp_dir, buildjson.BUILDS_DAY_FILE % "2015-06-01")
+        self.assertEquals(buildjson.load_sidecar(filepath, "endtimes"),
+                          buildjson._build_endtimes(self.jobs))
+
+    @patch('mozci.sources.buildjson.read_versioned_file')
+    @patch('mozci.sources.buildjson.fetch_file')
+    def test_file_is_decoded_once(self, fetch_file, read_versioned_file):
+        """The endtimes should be built from the jobs we decode for the query."""
+        read_versioned_file.side_effect = versioned({'builds': self.jobs})
+        with patch('mozci.sources.buildjson._filepath',
+                   side_effect=lambda filename: os.path.join(self.tmp_dir, filename)):
+            jobs = buildjson.query_jobs_by_time(self.MIDNIGHT, self.MIDNIGHT + 6 * 3600)
+        self.assertEquals(len(jobs), 5)
+        assert read_versioned_file.call_count == 1
+
+
+class TestPollBuilds4hr(unittest.TestCase):
+
+    """Test poll_builds_4hr and follow_builds_4hr."""
+
+    def setUp(self):
+        """Cache builds-4hr.js with the first two jobs."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, buildjson.BUILDS_4HR_FILE)
+        with open(self.filename, 'w') as f:
+            f.write('{}')
+        buildjson.BUILDS_CACHE.clear()
+        buildjson.BUILDS_CACHE[buildjson.BUILDS_4HR_FILE] = BUILDS[:2]
+
+    def tearDown(self):
+        """Clean up the fake cache."""
+        shutil.rmtree(self.tmp_dir)
+        buildjson.BUILDS_CACHE.clear()
+
+    @patch('mozci.sources.buildjson._filepath')
+    @patch('mozci.sources.buildjson.fetch_file', return_value=True)
+    @patch('mozci.sources.buildjson.read_versioned_file',
+           side_effect=versioned({'builds': BUILDS[1:]}))
+    def test_modified(self, read_versioned_file, fetch_file, _filepath):
+        """The new version of the file should replace the cached jobs."""
+        _filepath.return_value = self.filename
+        self.assertEquals(buildjson.poll_builds_4hr(), BUILDS[1:])
+        self.assertEquals(buildjson.BUILDS_CACHE[buildjson.BUILDS_4HR_FILE], BUILDS[1:])
+
+    @patch('mozci.sources.buildjson._filepath')
+    @patch('mozci.sources.buildjson.fetch_file', return_value=False)
+    @patch('mozci.sources.buildjson.read_versioned_file')
+    def test_not_modified(self, read_versioned_file, fetch_file, _filepath):
+        """Nothing should be decoded if the file has not changed."""
+        _filepath.return_value = self.filename
+        self.assertEquals(buildjson.poll_builds_4hr(), BUILDS[:2])
+        assert read_versioned_file.call_count == 0
+
+    @patch('time.sleep')
+    @patch('mozci.sources.buildjson.poll_builds_4hr')
+    def test_follow_builds_4hr(self, poll_builds_4hr, sleep):
+        """Only the jobs the follower has not seen should be yielded."""
+        # The file gets evicted and decoded again before a new version shows up
+        poll_builds_4hr.side_effect = [BUILDS[:2], list(BUILDS[:2]), BUILDS[1:]]
+        self.assertEquals(list(itertools.islice(buildjson.follow_builds_4hr(), 1)),
+                          [BUILDS[2]])
+        assert poll_builds_4hr.call_count == 3
+
+
+class TestBuildsCache(unittest.TestCase):
+
+    """Test the memory budget of BuildsCache."""
+
+    def setUp(self):
+        """Every file will be estimated to use 10 bytes."""
+        self.cache = buildjson.BuildsCache(budget=25)
+        self.patcher = patch('mozci.sources.buildjson._estimate_size', return_value=10)
+        self.patcher.start()
+
+    def tearDown(self):
+        """Stop estimating sizes with the mock."""
+        self.patcher.stop()
+
+    def test_least_recently_used_is_evicted(self):
+        """We should evict the file which was used the longest time ago."""
+        self.cache['a'] = [1]
+        self.cache['b'] = [2]
+        self.assertEquals(self.cache.get('a'), [1])
+        self.cache['c'] = [3]
+        assert 'a' in self.cache
+        assert 'b' not in self.cache
+        assert 'c' in self.cache
+        self.assertIsNone(self.cache.get('b'))
+        # Membership tests are not counted
+        self.assertEquals(self.cache.stats(), {
+            'hits': 1, 'misses': 1, 'evictions': 1, 'entries': 2, 'size': 20})
+
+    @patch('mozci.sources.buildjson.fetch_file', return_value=False)
+    @patch('mozci.sources.buildjson.load_versioned_file',
+           side_effect=versioned({'builds': BUILDS}))
+    def test_lookups_are_counted_once(self, load_versioned_file, fetch_file):
+        """Every lookup of _fetch_data should count a single hit or miss."""
+        tmp_dir = tempfile.mkdtemp()
+        filename = os.path.join(tmp_dir, buildjson.BUILDS_DAY_FILE % "2015-06-01")
+        with open(filename, 'w') as f:
+            f.write('{}')
+        try:
+            with patch('mozci.sources.buildjson.BUILDS_CACHE', self.cache):
+                buildjson._fetch_data(filename)
+                buildjson._fetch_data(filename)
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEquals((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_pinned_files_are_not_evicted(self):
+        """A pinned file should be kept even if it is the least recently used."""
+        self.cache[buildjson.BUILDS_4HR_FILE] = [1]
+        self.cache['b'] = [2]
+        with self.cache.pinned(buildjson.BUILDS_4HR_FILE):
+            self.cache['c'] = [3]
+        assert buildjson.BUILDS_4HR_FILE in self.cache
+        assert 'b' not in self.cache
+
+
+class TestEstimateSize(unittest.TestCase):
+
+    """Test _estimate_size."""
+
+    def test_estimate_size(self):
+        """More jobs should be estimated to use more memory."""
+        assert buildjson._estimate_size(BUILDS) > buildjson._estimate_size(BUILDS[:1]) > 0
@@ -0,0 +1,118 @@
+"""This file contains tests for mozci/sources/buildqueue.py."""
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from mozci.errors import BuildjsonError
+from mozci.sources import buildqueue
+from mozci.utils import transfer
+
+REVISION = "146071751b1e5d16b87786f6e60485222c28c202"
+FILES = {
+    "builds-pending.js": {"pending": {"try": {REVISION: [
+        {"id": 3, "buildername": "Linux x86-64 try build", "submitted_at": 1433164406},
+        {"id": 4, "buildername": "Linux try build", "submitted_at": 1433164406},
+    ]}}},
+    "builds-running.js": {"running": {"try": {REVISION: [
+        {"request_ids": [1, 2], "buildername": "Linux x86-64 try build",
+         "start_time": 1433164406},
+    ]}}},
+}
+
+
+def _load_json(filepath):
+    for filename, contents in FILES.iteritems():
+        if filepath.endswith(filename):
+            return contents
+
+
+@patch('mozci.sources.buildqueue._load_json', side_effect=_load_json)
+@patch('mozci.sources.buildqueue.fetch_file', return_value=True)
+class TestBuildqueue(unittest.TestCase):
+
+    """Test the indexes of the pending and running jobs."""
+
+    def setUp(self):
+        buildqueue.INDEXES.clear()
+        buildqueue.LAST_POLL.clear()
+
+    def tearDown(self):
+        buildqueue.INDEXES.clear()
+        buildqueue.LAST_POLL.clear()
+
+    def test_query_jobs(self, fetch_file, load_json):
+        """Jobs should be found by revision and buildername."""
+        jobs = buildqueue.query_pending_jobs(REVISION[:12], "Linux x86-64 try build")
+        self.assertEquals([job["id"] for job in jobs], [3])
+        self.assertEquals(jobs[0]["branch"], "try")
+        self.assertEquals(jobs[0]["revision"], REVISION)
+        self.assertEquals(len(buildqueue.query_pending_jobs(REVISION)), 2)
+        self.assertEquals(len(buildqueue.query_pending_jobs(buildername="Linux try build")), 1)
+        self.assertEquals(len(buildqueue.query_running_jobs()), 1)
+        self.assertEquals(buildqueue.query_running_jobs("123456abcdef"), [])
+
+    def test_query_job_state(self, fetch_file, load_json):
+        """Jobs should be found by request_id."""
+        self.assertEquals(buildqueue.query_job_state(2), buildqueue.RUNNING)
+        self.assertEquals(buildqueue.query_job_state(4), buildqueue.PENDING)
+        self.assertIsNone(buildqueue.query_job_state(5))
+
+    def test_poll_interval(self, fetch_file, load_json):
+        """The files should not be fetched again within POLL_INTERVAL."""
+        buildqueue.query_pending_jobs()
+        buildqueue.query_running_jobs()
+        assert fetch_file.call_count == 2
+
+        buildqueue.refresh(force=True)
+        assert fetch_file.call_count == 4
+        assert load_json.call_count == 4
+
+    def test_not_modified(self, fetch_file, load_json):
+        """Files which have not changed should not be indexed again."""
+        buildqueue.refresh()
+        fetch_file.return_value = False
+        buildqueue.refresh(force=True)
+        assert load_json.call_count == 2
+
+
+class TestBuildqueueFiles(unittest.TestCase):
+
+    """Test decoding the files we have fetched."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        buildqueue.INDEXES.clear()
+        buildqueue.LAST_POLL.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        buildqueue.INDEXES.clear()
+        buildqueue.LAST_POLL.clear()
+
+    @patch('mozci.sources.buildqueue.fetch_file', return_value=True)
+    def test_memory_saving_mode(self, fetch_file):
+        """The settings of buildjson files should not apply to these files."""
+        for filename, contents in FILES.iteritems():
+            with open(os.path.join(self.tmp_dir, filename), 'w') as f:
+                json.dump(contents, f)
+
+        transfer.MEMORY_SAVING_MODE = True
+        try:
+            with patch('mozci.sources.buildqueue.path_to_file',
+                       side_effect=lambda filename: os.path.join(self.tmp_dir, filename)):
+                self.assertEquals(len(buildqueue.query_pending_jobs()), 2)
+                self.assertEquals(len(buildqueue.query_running_jobs()), 1)
+        finally:
+            transfer.MEMORY_SAVING_MODE = False
+
+    def test_invalid_file(self):
+        """A file which is not valid json should raise BuildjsonError."""
+        filepath = os.path.join(self.tmp_dir, "builds-pending.js")
+        with gzip.open(filepath, 'wb') as f:
+            f.write('{"pending": ')
+        self.assertRaises(BuildjsonError, buildqueue._load_json, filepath)
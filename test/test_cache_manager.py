@@ -0,0 +1,94 @@
+"""This file contains tests for mozci/utils/cache_manager.py."""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import warnings
+
+from mock import patch
+
+from mozci.utils import cache_manager, transfer
+
+
+class TestCleanup(unittest.TestCase):
+
+    """Test the eviction of cached files."""
+
+    def setUp(self):
+        """Create a cache with three days of buildjson files."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patcher = patch.multiple(
+            cache_manager,
+            CACHE_DIR=self.tmp_dir,
+            MANIFEST=os.path.join(self.tmp_dir, 'manifest.json'),
+            USAGE={},
+            KIND_BUDGETS={'buildjson': 250},
+            TOTAL_BUDGET=1000,
+        )
+        self.patcher.start()
+
+        now = time.time()
+        for age, filename in enumerate(['builds-2015-06-03.js', 'builds-2015-06-02.js',
+                                        'builds-2015-06-01.js', 'credentials.txt']):
+            self._create(filename, 100, now - age * 60)
+        self._create('builds-2015-06-01.js.index', 10, now)
+
+    def tearDown(self):
+        """Remove the cache."""
+        self.patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _create(self, filename, size, mtime):
+        filepath = os.path.join(self.tmp_dir, filename)
+        with open(filepath, 'w') as f:
+            f.write('0' * size)
+        os.utime(filepath, (mtime, mtime))
+
+    def test_least_recently_used_are_evicted(self):
+        """The oldest file and its sidecars should go; unknown files should stay."""
+        cache_manager.cleanup()
+        self.assertEquals(sorted(os.listdir(self.tmp_dir)), [
+            'builds-2015-06-02.js', 'builds-2015-06-03.js', 'credentials.txt',
+            'manifest.json', 'manifest.json.lock'])
+
+    def test_recently_used_files_are_kept(self):
+        """Using a file should protect it from being evicted."""
+        cache_manager.record_use(os.path.join(self.tmp_dir, 'builds-2015-06-01.js'))
+        cache_manager.cleanup()
+        self.assertEquals(sorted(os.listdir(self.tmp_dir)), [
+            'builds-2015-06-01.js', 'builds-2015-06-01.js.index', 'builds-2015-06-03.js',
+            'credentials.txt', 'manifest.json', 'manifest.json.lock'])
+
+    def test_clean_directory(self):
+        """The deprecated transfer.clean_directory should evict files older than CLEANUP_DAYS."""
+        self._create('builds-2015-01-01.js', 10, time.time() - 200 * 24 * 60 * 60)
+        with patch.multiple(cache_manager, KIND_BUDGETS={'buildjson': 1000}), \
+                patch.object(transfer, 'CLEANUP_DAYS', 150), \
+                warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            transfer.clean_directory()
+        self.assertEquals([warning.category for warning in caught], [DeprecationWarning])
+        self.assertEquals(sorted(name for name in os.listdir(self.tmp_dir)
+                                 if name.startswith('builds-')),
+                          ['builds-2015-06-01.js', 'builds-2015-06-01.js.index',
+                           'builds-2015-06-02.js', 'builds-2015-06-03.js'])
+
+    def test_flush_usage_merges_manifest(self):
+        """Flushing should keep the usage other processes have written."""
+        cache_manager._write_manifest(
+            {'last_cleanup': 0, 'last_used': {'builds-2015-06-02.js': 10}})
+        cache_manager.record_use(os.path.join(self.tmp_dir, 'builds-2015-06-01.js'))
+        cache_manager.flush_usage()
+        self.assertEquals(sorted(cache_manager._load_manifest()['last_used']),
+                          ['builds-2015-06-01.js', 'builds-2015-06-02.js'])
+
+    @patch('threading.Thread')
+    def test_schedule_cleanup(self, thread):
+        """The cleanup should only be scheduled once it is due."""
+        with patch.object(cache_manager, '_CLEANUP_THREAD', None):
+            cache_manager.schedule_cleanup()
+        with patch.object(cache_manager, '_CLEANUP_THREAD', None):
+            cache_manager.cleanup()
+            cache_manager.schedule_cleanup()
+        assert thread.call_count == 1
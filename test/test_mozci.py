@@ -121,3 +121,25 @@ class TestJobValidation(unittest.TestCase):
     def test_status_summary_coalesced(self, get_status):
         """Test _status_summary with a coalesced state."""
         assert mozci.mozci._status_summary(self.jobs) == (0, 0, 0, 1, 0)
+
+
+class TestStatusInfo(unittest.TestCase):
+
+    """Test _status_info and _status_infos."""
+
+    JOBS = [{"requests": [{"request_id": request_id, "complete_at": 1433116800}]}
+            for request_id in (1, 2, 3)]
+
+    @patch.dict('mozci.query_jobs.JOB_DATA_CACHE', {1: {"properties": {}}}, clear=True)
+    @patch('mozci.sources.buildjson.query_job_data')
+    def test_status_info_from_cache(self, query_job_data):
+        """Jobs which get_job_status has found should not be looked for again."""
+        assert mozci.mozci._status_info(self.JOBS[0]) == {"properties": {}}
+        assert query_job_data.call_count == 0
+
+    @patch.dict('mozci.query_jobs.JOB_DATA_CACHE', {1: {"properties": {}}}, clear=True)
+    @patch('mozci.sources.buildjson.query_jobs_data', return_value={2: {"id": 2}, 3: None})
+    def test_status_infos(self, query_jobs_data):
+        """The jobs we have not found yet should be looked for at once."""
+        assert mozci.mozci._status_infos(self.JOBS) == [{"properties": {}}, {"id": 2}, None]
+        query_jobs_data.assert_called_once_with([(1433116800, 2), (1433116800, 3)])
@@ -6,6 +6,8 @@ import unittest
 
 from mock import patch
 
+from mozci import platforms
+from mozci.sources.allthethings import split_into_shards
 from mozci.platforms import (
     _get_job_type,
     _include_builders_matching,
@@ -34,6 +36,31 @@ def _get_mock_allthethings():
 MOCK_ALLTHETHINGS = _get_mock_allthethings()
 
 
+def _mock_shards():
+    """Split the allthethings data mocked by a test into shards."""
+    return split_into_shards(platforms.fetch_allthethings_data())
+
+
+@pytest.fixture(autouse=True)
+def compile_catalog(request):
+    """Every test compiles the catalogs from its mocked allthethings data."""
+    platforms.CATALOGS.clear()
+    platforms.UPSTREAM_TO_DOWNSTREAM = None
+    for dictionary in (platforms.SHORTNAME_TO_NAME, platforms.BUILD_JOBS,
+                       platforms.BUILDERNAME_TO_TRIGGER):
+        dictionary.clear()
+    for patcher in (
+            patch('mozci.platforms.load_catalog', return_value=None),
+            patch('mozci.platforms.write_catalog'),
+            patch('mozci.platforms.fetch_allthethings_manifest',
+                  side_effect=lambda: dict((repo_name, len(shard['builders'])) for
+                                           repo_name, shard in _mock_shards().iteritems())),
+            patch('mozci.platforms.fetch_allthethings_shard',
+                  side_effect=lambda repo_name: _mock_shards()[repo_name])):
+        patcher.start()
+        request.addfinalizer(patcher.stop)
+
+
 class TestIsDownstream(unittest.TestCase):
 
     """Test is_downstream with mock data."""
@@ -278,6 +305,69 @@ def test_include_builders_matching():
         'obtained: "%s", expected "%s"' % (obtained, expected)
 
 
+class TestCatalog(unittest.TestCase):
+
+    """Test the catalogs of builders derived from allthethings data."""
+
+    @patch('mozci.platforms.fetch_allthethings_data')
+    def test_compile_catalog(self, fetch_allthethings_data):
+        """Only the catalog of the repository we ask about should be compiled."""
+        fetch_allthethings_data.return_value = MOCK_ALLTHETHINGS
+        self.assertEquals(
+            determine_upstream_builder('Platform1 repo opt test mochitest-1'),
+            'Platform1 repo build')
+        self.assertEquals(platforms.CATALOGS.keys(), ['repo'])
+        platforms.write_catalog.assert_called_once_with('repo', platforms.CATALOGS['repo'])
+        self.assertEquals(
+            sorted(platforms.CATALOGS['repo']['upstream_to_downstream']['Platform1 repo build']),
+            ['Platform1 repo opt test mochitest-1', 'Platform1 repo talos tp5o'])
+
+    @patch('mozci.platforms.fetch_allthethings_data')
+    def test_stored_catalog(self, fetch_allthethings_data):
+        """A stored catalog should be used without loading allthethings data."""
+        fetch_allthethings_data.return_value = MOCK_ALLTHETHINGS
+        catalog = platforms._compile_catalog('repo', _mock_shards()['repo'])
+        platforms.CATALOGS.clear()
+        platforms.load_catalog.return_value = catalog
+        self.assertEquals(
+            get_buildername_metadata('Platform1 repo talos tp5o')['suite_name'], 'tp5o')
+        self.assertEquals(
+            sorted(get_downstream_jobs('Platform1 repo build')),
+            ['Platform1 repo opt test mochitest-1', 'Platform1 repo talos tp5o'])
+        assert platforms.fetch_allthethings_shard.call_count == 0
+        assert platforms.write_catalog.call_count == 0
+
+    @patch('mozci.platforms.fetch_allthethings_data')
+    def test_list_builders_of_repo(self, fetch_allthethings_data):
+        """Listing the builders of a repository should only load its shard."""
+        fetch_allthethings_data.return_value = MOCK_ALLTHETHINGS
+        self.assertEquals(
+            sorted(list_builders('mozilla-beta')),
+            sorted(builder for builder in list_builders() if 'mozilla-beta' in builder))
+        platforms.CATALOGS.clear()
+        platforms.fetch_allthethings_shard.reset_mock()
+        list_builders('mozilla-beta')
+        platforms.fetch_allthethings_shard.assert_called_once_with('mozilla-beta')
+        self.assertEquals(list_builders('not-a-repo'), [])
+
+    @patch('mozci.platforms.fetch_allthethings_data')
+    def test_builder_without_branch(self, fetch_allthethings_data):
+        """Builders without a branch should be skipped."""
+        data = dict(MOCK_ALLTHETHINGS)
+        data['builders'] = dict(MOCK_ALLTHETHINGS['builders'])
+        data['builders']['Platform1 nightly l10n'] = {
+            "properties": {"platform": "platform1", "product": "real-product"},
+            "shortname": "nightly-l10n",
+        }
+        fetch_allthethings_data.return_value = data
+        self.assertIsNone(get_buildername_metadata('Platform1 nightly l10n'))
+        self.assertIsNone(get_buildername_metadata('Not a valid buildername'))
+        self.assertNotIn('Platform1 nightly l10n', list_builders(filter=False))
+        self.assertEquals(
+            determine_upstream_builder('Platform1 repo opt test mochitest-1'),
+            'Platform1 repo build')
+
+
 get_job_type_test_cases = [
     ("Platform1 repo pgo talos mochitest-1", "pgo"),
     ("Platform1 repo debug test mochitest-1", "debug"),
@@ -5,7 +5,7 @@ from mock import patch, Mock
 
 from mozci.errors import TreeherderError
 from mozci import query_jobs
-from mozci.query_jobs import BuildApi, TreeherderApi, SUCCESS, PENDING,\
+from mozci.query_jobs import BuildApi, BuildjsonApi, TreeherderApi, SUCCESS, PENDING,\
     RUNNING, UNKNOWN, COALESCED, FAILURE
 
 BASE_JSON = """
@@ -218,6 +218,23 @@ class TestBuildApiGetJobStatus(unittest.TestCase):
         with self.assertRaises(Exception):
             self.query_api.get_job_status(weird_job)
 
+    @patch('mozci.query_jobs.query_job_data')
+    @patch('mozci.query_jobs.query_jobs_data', return_value={71123549: None})
+    def test_prefetched_job_not_found(self, query_jobs_data, query_job_data):
+        """A job the prefetch did not find should not be looked for again."""
+        successful_job = json.loads(JOBS_SCHEDULE)[0]
+        self.query_api._prefetch_job_status([successful_job])
+        self.assertEquals(self.query_api.get_job_status(successful_job), RUNNING)
+        assert query_job_data.call_count == 0
+
+    def test_job_data_cache_size(self):
+        """The oldest jobs should be dropped from JOB_DATA_CACHE."""
+        with patch.object(query_jobs, 'JOB_DATA_CACHE', query_jobs.collections.OrderedDict()), \
+                patch.object(query_jobs, 'JOB_DATA_CACHE_SIZE', 2):
+            for request_id in range(3):
+                query_jobs._cache_job_data(request_id, {})
+            self.assertEquals(query_jobs.JOB_DATA_CACHE.keys(), [1, 2])
+
 
 class TestTreeherderApiGetJobStatus(unittest.TestCase):
     """Test query_job_status with different types of jobs"""
@@ -274,3 +291,101 @@ class TestBuildApiGetMatchingJobs(unittest.TestCase):
             self.query_api.get_matching_jobs(
                 "try", "146071751b1e",
                 'Invalid buildername'), [])
+
+
+BUILDJSON_JOB = {
+    "request_ids": [71123549],
+    "result": SUCCESS,
+    "starttime": 1433164406,
+    "endtime": 1433166609,
+    "properties": {
+        "buildername": "Linux x86-64 try build",
+        "repo_path": "try",
+        "request_ids": [71123549],
+        "revision": "146071751b1e5d16b87786f6e60485222c28c202",
+    },
+}
+
+
+class TestBuildjsonApiGetMatchingJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.query_api = BuildjsonApi()
+        # We have cached the buildjson files of every day
+        self.missing_dates = patch('mozci.query_jobs.missing_dates', return_value=[])
+        self.missing_dates.start()
+
+    def tearDown(self):
+        self.missing_dates.stop()
+
+    @patch('mozci.query_jobs.query_repo_url', return_value="https://hg.mozilla.org/try")
+    @patch('mozci.query_jobs.query_jobs_by_revision', return_value=[BUILDJSON_JOB])
+    @patch('mozci.sources.buildqueue.query_pending_jobs', return_value=[])
+    @patch('mozci.sources.buildqueue.query_running_jobs', return_value=[])
+    @patch('mozci.query_jobs.query_jobs_schedule')
+    def test_completed_jobs(self, query_jobs_schedule, query_running_jobs, query_pending_jobs,
+                            query_jobs_by_revision, query_repo_url):
+        """Completed jobs should be found without asking buildapi."""
+        jobs = self.query_api.get_matching_jobs(
+            "try", "146071751b1e", "Linux x86-64 try build")
+        query_jobs_by_revision.assert_called_once_with(
+            "try", "146071751b1e", "Linux x86-64 try build")
+        assert query_jobs_schedule.call_count == 0
+        self.assertEquals(len(jobs), 1)
+        self.assertEquals(self.query_api.get_buildapi_request_id("try", jobs[0]), 71123549)
+        self.assertEquals(self.query_api.get_job_status(jobs[0]), SUCCESS)
+
+    @patch('mozci.query_jobs.query_repo_url', return_value="https://hg.mozilla.org/try")
+    @patch('mozci.query_jobs.query_jobs_by_revision', return_value=[BUILDJSON_JOB])
+    @patch('mozci.sources.buildqueue.query_pending_jobs', return_value=[{
+        "id": 71123550, "buildername": "Linux x86-64 try build",
+        "revision": "146071751b1e5d16b87786f6e60485222c28c202"}])
+    @patch('mozci.sources.buildqueue.query_running_jobs', return_value=[{
+        "request_ids": [71123549], "buildername": "Linux x86-64 try build",
+        "start_time": 1433164406, "revision": "146071751b1e5d16b87786f6e60485222c28c202"}])
+    @patch('mozci.sources.buildqueue.query_job_state', return_value=None)
+    @patch('mozci.query_jobs.query_jobs_schedule')
+    def test_queued_jobs(self, query_jobs_schedule, query_job_state, query_running_jobs,
+                         query_pending_jobs, query_jobs_by_revision, query_repo_url):
+        """Pending and running jobs should be added to the completed ones."""
+        jobs = self.query_api.get_matching_jobs(
+            "try", "146071751b1e", "Linux x86-64 try build")
+        assert query_jobs_schedule.call_count == 0
+        self.assertEquals(
+            [self.query_api.get_buildapi_request_id("try", job) for job in jobs],
+            [71123549, 71123550, 71123549])
+        self.assertEquals(
+            [self.query_api.get_job_status(job) for job in jobs[1:]], [PENDING, RUNNING])
+
+    @patch('mozci.query_jobs.query_repo_url', return_value="https://hg.mozilla.org/try")
+    @patch('mozci.query_jobs.query_jobs_by_revision', return_value=[])
+    @patch('mozci.sources.buildqueue.query_pending_jobs', return_value=[])
+    @patch('mozci.sources.buildqueue.query_running_jobs', return_value=[])
+    @patch('mozci.query_jobs.BuildApi.get_matching_jobs', return_value=["pending job"])
+    def test_fall_back(self, get_matching_jobs, query_running_jobs, query_pending_jobs,
+                       query_jobs_by_revision, query_repo_url):
+        """Jobs we know nothing about should be looked for in buildapi."""
+        self.assertEquals(
+            self.query_api.get_matching_jobs(
+                "try", "146071751b1e", "Linux x86-64 try build"),
+            ["pending job"])
+
+    @patch('mozci.sources.buildqueue.query_job_state')
+    def test_job_status_from_buildqueue(self, query_job_state):
+        """Pending jobs of buildapi which have started running since should be running."""
+        job = {"requests": [{"request_id": 71123549}]}
+        query_job_state.return_value = "running"
+        self.assertEquals(self.query_api.get_job_status(job), RUNNING)
+        query_job_state.return_value = None
+        self.assertEquals(self.query_api.get_job_status(job), PENDING)
+
+    @patch('mozci.query_jobs.missing_dates', return_value=["2015-06-01"])
+    @patch('mozci.query_jobs.query_jobs_by_revision')
+    @patch('mozci.query_jobs.BuildApi.get_matching_jobs', return_value=["completed job"])
+    def test_missing_files(self, get_matching_jobs, query_jobs_by_revision, missing_dates):
+        """Without the buildjson files of some days we should ask buildapi."""
+        self.assertEquals(
+            self.query_api.get_matching_jobs(
+                "try", "146071751b1e", "Linux x86-64 try build"),
+            ["completed job"])
+        assert query_jobs_by_revision.call_count == 0
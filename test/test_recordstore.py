@@ -0,0 +1,47 @@
+"""This file contains tests for mozci/utils/recordstore.py."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from mozci.utils.recordstore import open_record_store, write_record_store
+
+RECORDS = [
+    {u"properties": {u"buildername": u"Platform1 repo build"}, u"request_ids": [1]},
+    {u"properties": {}, u"request_ids": [2, 3]},
+]
+
+
+class TestRecordStore(unittest.TestCase):
+
+    """Test writing and reading record stores."""
+
+    def setUp(self):
+        """Create a record store."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, "builds-2015-06-01.js.records")
+        write_record_store(self.filepath, iter(RECORDS), 1433116800)
+
+    def tearDown(self):
+        """Remove the record store."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_records(self):
+        """We should be able to read back every record."""
+        store = open_record_store(self.filepath, 1433116800)
+        self.assertEquals(len(store), 2)
+        self.assertEquals(store[1], RECORDS[1])
+        self.assertEquals(store[-1], RECORDS[1])
+        self.assertEquals(list(store), RECORDS)
+        with self.assertRaises(IndexError):
+            store[2]
+
+    def test_stale_record_store(self):
+        """A record store written for another key should not be used."""
+        self.assertIsNone(open_record_store(self.filepath, 1433203200))
+
+    def test_truncated_record_store(self):
+        """A truncated record store should not be used."""
+        with open(self.filepath, 'r+b') as f:
+            f.truncate(os.path.getsize(self.filepath) - 1)
+        self.assertIsNone(open_record_store(self.filepath, 1433116800))
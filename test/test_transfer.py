@@ -0,0 +1,417 @@
+"""This file contains tests for mozci/utils/transfer.py."""
+import gzip
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import requests
+
+from mock import patch, Mock
+
+from mozci.errors import MozciError
+from mozci.utils import transfer
+
+
+def _hold_lock(filepath, acquired):
+    """Hold the lock of filepath for a while."""
+    with transfer.file_lock(filepath):
+        acquired.set()
+        time.sleep(0.5)
+
+
+class TestSidecars(unittest.TestCase):
+
+    """Test write_sidecar and load_sidecar."""
+
+    def setUp(self):
+        """Create a file to attach sidecars to."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, "builds-2015-06-01.js")
+        with open(self.filepath, 'w') as f:
+            f.write('{}')
+        os.utime(self.filepath, (1433116800, 1433116800))
+
+    def tearDown(self):
+        """Remove the temporary files."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_sidecar(self):
+        """We should get back what we stored."""
+        transfer.write_sidecar(self.filepath, "index", {1: 0})
+        self.assertEquals(transfer.load_sidecar(self.filepath, "index"), {1: 0})
+
+    def test_missing_sidecar(self):
+        """A missing sidecar should return None."""
+        self.assertIsNone(transfer.load_sidecar(self.filepath, "index"))
+
+    def test_stale_sidecar(self):
+        """A sidecar of an older version of the file should be ignored."""
+        transfer.write_sidecar(self.filepath, "index", {1: 0})
+        os.utime(self.filepath, (1433203200, 1433203200))
+        self.assertIsNone(transfer.load_sidecar(self.filepath, "index"))
+
+    def test_sidecar_of_replaced_version(self):
+        """Data derived from a version which has been replaced should not be stored."""
+        decoded = transfer._last_mod_key(self.filepath)
+        os.utime(self.filepath, (1433203200, 1433203200))
+        transfer.write_sidecar(self.filepath, "index", {1: 0}, decoded)
+        self.assertIsNone(transfer.load_sidecar(self.filepath, "index"))
+        self.assertIsNone(transfer.load_sidecar(self.filepath, "index", decoded))
+
+    def test_read_versioned_file(self):
+        """We should get the version of the file we have decoded."""
+        self.assertEquals(transfer.read_versioned_file(self.filepath), (1433116800, {}))
+
+    def test_corrupted_sidecar(self):
+        """A truncated sidecar should be ignored."""
+        with open(transfer._sidecar_path(self.filepath, "index"), 'wb') as f:
+            f.write('')
+        self.assertIsNone(transfer.load_sidecar(self.filepath, "index"))
+
+
+class TestSnapshots(unittest.TestCase):
+
+    """Test load_file with SNAPSHOT_MODE set."""
+
+    def setUp(self):
+        """Create a cached file."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, "builds-2015-06-01.js")
+        with open(self.filepath, 'w') as f:
+            f.write('{"builds": []}')
+        transfer.SNAPSHOT_MODE = True
+
+    def tearDown(self):
+        """Remove the temporary files."""
+        shutil.rmtree(self.tmp_dir)
+        transfer.SNAPSHOT_MODE = False
+
+    @patch('mozci.utils.transfer.fetch_file', return_value=False)
+    @patch('mozci.utils.transfer._load_json_file', return_value={u'builds': [1]})
+    def test_snapshot_is_used(self, _load_json_file, fetch_file):
+        """The file should only be decoded the first time."""
+        self.assertEquals(transfer.load_file(self.filepath, 'url'), {u'builds': [1]})
+        self.assertEquals(transfer.load_file(self.filepath, 'url'), {u'builds': [1]})
+        assert _load_json_file.call_count == 1
+        assert fetch_file.call_count == 2
+
+    @patch('mozci.utils.transfer.fetch_file', return_value=True)
+    @patch('mozci.utils.transfer._load_json_file', return_value={u'builds': [1]})
+    def test_snapshot_of_older_file(self, _load_json_file, fetch_file):
+        """A newer version of the file should be decoded again."""
+        transfer.load_file(self.filepath, 'url')
+        os.utime(self.filepath, (1433203200, 1433203200))
+        transfer.load_file(self.filepath, 'url')
+        assert _load_json_file.call_count == 2
+
+
+class TestProjection(unittest.TestCase):
+
+    """Test the projection of builds in memory saving mode."""
+
+    BUILD = {
+        'endtime': 1433116900,
+        'request_ids': [1],
+        'result': 0,
+        'properties': {'buildername': 'Platform1 repo build', 'revision': 'abcdef123456'},
+    }
+
+    def test_default_projection(self):
+        """LEAN_FIELDS should keep the fields we need to find jobs and their files."""
+        keys, property_keys = transfer._compile_projection(transfer.LEAN_FIELDS)
+        self.assertEquals(transfer._project(self.BUILD, keys, property_keys), {
+            'request_ids': [1],
+            'properties': {'buildername': 'Platform1 repo build', 'revision': 'abcdef123456'},
+        })
+
+    def test_custom_projection(self):
+        """Only the fields requested should be kept."""
+        keys, property_keys = transfer._compile_projection(
+            ('endtime', 'result', 'properties.buildername'))
+        self.assertEquals(transfer._project(self.BUILD, keys, property_keys), {
+            'endtime': 1433116900,
+            'result': 0,
+            'properties': {'buildername': 'Platform1 repo build'},
+        })
+
+    def test_all_properties(self):
+        """Asking for properties should keep all of them."""
+        keys, property_keys = transfer._compile_projection(('properties',))
+        self.assertEquals(transfer._project(self.BUILD, keys, property_keys),
+                          {'properties': self.BUILD['properties']})
+
+    def test_read_file_with_fields(self):
+        """read_file should stream a gzipped file and only keep the fields requested."""
+        tmp_dir = tempfile.mkdtemp()
+        filepath = os.path.join(tmp_dir, "builds-2015-06-01.js")
+        try:
+            gzipper = gzip.open(filepath, 'wb')
+            gzipper.write(json.dumps({'builds': [self.BUILD, self.BUILD]}))
+            gzipper.close()
+            builds = transfer.read_file(filepath, ('endtime',))['builds']
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEquals(builds, [{'endtime': 1433116900}] * 2)
+
+    def test_iter_builds_uncompressed(self):
+        """iter_builds should also stream files which are not gzipped."""
+        tmp_dir = tempfile.mkdtemp()
+        filepath = os.path.join(tmp_dir, "builds-2015-06-01.js")
+        try:
+            with open(filepath, 'w') as f:
+                json.dump({'builds': [self.BUILD]}, f)
+            builds = list(transfer.iter_builds(filepath))
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEquals(builds, [self.BUILD])
+
+
+class TestInternStrings(unittest.TestCase):
+
+    """Test sharing the strings that repeat across builds."""
+
+    BUILD = {
+        'endtime': 1433116900,
+        'properties': {'buildername': 'Platform1 repo build', 'log_url': 'http://log'},
+    }
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, "builds-2015-06-01.js")
+        with open(self.filepath, 'w') as f:
+            json.dump({'builds': [self.BUILD, self.BUILD]}, f)
+        transfer.INTERN_STRINGS = True
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        transfer.INTERN_STRINGS = False
+
+    def _assert_interned(self, builds):
+        self.assertEquals(builds, [self.BUILD, self.BUILD])
+        first, second = [build['properties'] for build in builds]
+        assert first['buildername'] is second['buildername']
+        # Only the values of INTERNED_PROPERTIES are shared
+        assert first['log_url'] is not second['log_url']
+
+    def test_read_file(self):
+        """Decoded builds should share the values of INTERNED_PROPERTIES."""
+        self._assert_interned(transfer.read_file(self.filepath)['builds'])
+
+    def test_iter_builds(self):
+        """Streamed builds should share the values of INTERNED_PROPERTIES."""
+        self._assert_interned(list(transfer.iter_builds(self.filepath)))
+
+
+def mock_response(data, status_code=200, fail_after=None):
+    """Mock of a streamed requests.get() response of a file with ranges support."""
+    response = Mock()
+    response.status_code = status_code
+    response.url = 'http://example.com/builds-2015-06-01.js.gz'
+    response.headers = {
+        'Content-Length': str(len(data)),
+        'last-modified': 'Mon, 01 Jun 2015 23:59:59 GMT',
+        'Accept-Ranges': 'bytes',
+    }
+
+    def iter_content(chunk_size):
+        """Yield data in chunks and fail after fail_after chunks."""
+        for i in range(0, len(data), 2):
+            if fail_after is not None and i >= fail_after:
+                raise requests.exceptions.ConnectionError("Connection reset by peer")
+            yield data[i:i + 2]
+
+    response.iter_content = iter_content
+    return response
+
+
+class TestSaveFile(unittest.TestCase):
+
+    """Test the resumable downloads of _save_file."""
+
+    DATA = '0123456789'
+
+    def setUp(self):
+        """Create a directory for the downloads."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, "builds-2015-06-01.js")
+        transfer.SHOW_PROGRESS_BAR = False
+
+    def tearDown(self):
+        """Remove the downloads."""
+        shutil.rmtree(self.tmp_dir)
+        transfer.SHOW_PROGRESS_BAR = True
+
+    @patch('requests.get')
+    def test_interrupted_download_is_resumed(self, get):
+        """We should only request the bytes we are missing."""
+        get.return_value = mock_response(self.DATA[6:], status_code=206)
+        transfer._save_file(mock_response(self.DATA, fail_after=6), self.filepath)
+
+        with open(self.filepath) as f:
+            self.assertEquals(f.read(), self.DATA)
+        self.assertEquals(get.call_args[1]['headers']['Range'], 'bytes=6-9')
+        assert not os.path.exists(self.filepath + '.part')
+
+    @patch('requests.get')
+    def test_incomplete_download(self, get):
+        """The partial file should be kept and the cached file untouched."""
+        get.side_effect = requests.exceptions.ConnectionError("Connection refused")
+        with self.assertRaises(MozciError):
+            transfer._save_file(mock_response(self.DATA, fail_after=4), self.filepath)
+
+        assert not os.path.exists(self.filepath)
+        self.assertEquals(os.path.getsize(self.filepath + '.part'), 4)
+
+    @patch('requests.get')
+    def test_parallel_download(self, get):
+        """Big files should be downloaded as several ranges and joined in order."""
+        def get_range(url, stream, headers):
+            start, end = map(int, headers['Range'][len('bytes='):].split('-'))
+            return mock_response(self.DATA[start:end + 1], status_code=206)
+
+        get.side_effect = get_range
+        with patch.multiple(transfer, PARALLEL_DOWNLOAD_THRESHOLD=0, DOWNLOAD_SEGMENTS=3):
+            transfer._save_file(mock_response(self.DATA), self.filepath)
+
+        with open(self.filepath) as f:
+            self.assertEquals(f.read(), self.DATA)
+        assert get.call_count == 3
+
+    @patch('requests.get')
+    def test_parallel_download_of_small_file(self, get):
+        """Files smaller than DOWNLOAD_SEGMENTS should not request empty ranges."""
+        def get_range(url, stream, headers):
+            start, end = map(int, headers['Range'][len('bytes='):].split('-'))
+            assert start <= end
+            return mock_response(self.DATA[start:end + 1], status_code=206)
+
+        get.side_effect = get_range
+        with patch.multiple(transfer, PARALLEL_DOWNLOAD_THRESHOLD=0, DOWNLOAD_SEGMENTS=15):
+            transfer._save_file(mock_response(self.DATA), self.filepath)
+
+        with open(self.filepath) as f:
+            self.assertEquals(f.read(), self.DATA)
+        assert get.call_count == len(self.DATA)
+        assert not [filename for filename in os.listdir(self.tmp_dir) if '.part' in filename]
+
+
+class TestChecksums(unittest.TestCase):
+
+    """Test atomic_open and the checksum sidecars."""
+
+    def setUp(self):
+        """Create a directory for the files."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, "allthethings.json")
+
+    def tearDown(self):
+        """Remove the files."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_atomic_open_failure(self):
+        """A failure while writing should leave the previous file untouched."""
+        with open(self.filepath, 'w') as f:
+            f.write('{}')
+        with self.assertRaises(ValueError):
+            with transfer.atomic_open(self.filepath) as f:
+                f.write('{"tru')
+                raise ValueError()
+        with open(self.filepath) as f:
+            self.assertEquals(f.read(), '{}')
+        self.assertEquals(os.listdir(self.tmp_dir), ['allthethings.json'])
+
+    def test_verify_checksum(self):
+        """A file with a different size or content should not pass verification."""
+        with transfer.atomic_open(self.filepath) as f:
+            f.write('{"data": 1}')
+        self.assertIsNone(transfer.verify_checksum(self.filepath))
+        transfer.write_checksum(self.filepath)
+        mtime = os.path.getmtime(self.filepath)
+        self.assertTrue(transfer.verify_checksum(self.filepath, full=True))
+
+        with open(self.filepath, 'w') as f:
+            f.write('{"data": 2}')
+        os.utime(self.filepath, (mtime, mtime))
+        self.assertTrue(transfer.verify_checksum(self.filepath))
+        self.assertFalse(transfer.verify_checksum(self.filepath, full=True))
+
+        with open(self.filepath, 'w') as f:
+            f.write('{"data"')
+        os.utime(self.filepath, (mtime, mtime))
+        self.assertFalse(transfer.verify_checksum(self.filepath))
+
+
+class TestCacheCodec(unittest.TestCase):
+
+    """Test storing the files we fetch as CACHE_CODEC says."""
+
+    def setUp(self):
+        """Create a gzipped file."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, "builds-2015-06-01.js")
+        gzipper = gzip.open(self.filepath, 'wb')
+        gzipper.write(json.dumps({'builds': [{'endtime': 1433116900}]}))
+        gzipper.close()
+        os.utime(self.filepath, (1433116800, 1433116800))
+        transfer.write_sidecar(self.filepath, "index", {1: 0})
+
+    def tearDown(self):
+        """Remove the files."""
+        shutil.rmtree(self.tmp_dir)
+        transfer.CACHE_CODEC = 'gzip'
+
+    def test_gzip(self):
+        """By default files should be kept as they were served."""
+        transfer._apply_codec(self.filepath)
+        assert transfer._is_gzipped(self.filepath)
+
+    def test_raw(self):
+        """Files should be decompressed but keep their Last-Modified and sidecars."""
+        transfer.CACHE_CODEC = 'raw'
+        transfer._apply_codec(self.filepath)
+        assert not transfer._is_gzipped(self.filepath)
+        self.assertEquals(os.path.getmtime(self.filepath), 1433116800)
+        self.assertTrue(transfer.verify_checksum(self.filepath, full=True))
+        self.assertEquals(transfer.load_sidecar(self.filepath, "index"), {1: 0})
+        self.assertEquals(transfer.read_file(self.filepath),
+                          {'builds': [{'endtime': 1433116900}]})
+
+
+class TestFileLock(unittest.TestCase):
+
+    """Test file_lock and how fetch_file uses it."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, "builds-4hr.js")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_file_lock(self):
+        """Only one process should hold the lock of a file at a time."""
+        acquired = multiprocessing.Event()
+        proc = multiprocessing.Process(target=_hold_lock, args=(self.filepath, acquired))
+        proc.start()
+        acquired.wait()
+        start = time.time()
+        with transfer.file_lock(self.filepath):
+            assert time.time() - start > 0.2
+        proc.join()
+
+    @patch('mozci.utils.transfer._save_file')
+    @patch('mozci.utils.transfer.requests.get')
+    def test_downloaded_by_another_process(self, get, _save_file):
+        """We should not download what another process has just downloaded."""
+        with open(self.filepath, 'w') as f:
+            f.write('{}')
+        response = mock_response('{}')
+        # Another process downloaded this version after we sent our request
+        os.utime(self.filepath, (1433203199, 1433203199))
+        get.return_value = response
+        self.assertTrue(transfer.fetch_file(self.filepath, response.url))
+        assert _save_file.call_count == 0